@@ -1,26 +1,28 @@
+import json
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import re
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+from env import load_env
+from cache import AnalysisCache, analysis_key
+import metrics
+from monitor import VitalsMonitor, VITAL_KEYS
+from triage import Triage
 
-load_dotenv(override=True)
+load_env()
 
+ANALYSIS_TIMEOUT = float(os.getenv("ANALYSIS_TIMEOUT", "30"))  # seconds
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+TIMEOUT_RESULT = ("AI analysis timed out. Please try again.", "", None)
+TIERS = ("local", "offline", "cache", "llm")  # who answered an analysis
 
-class MedicalAgent:
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            print("Warning: GEMINI_API_KEY not found in .env")
-            self.model = None
-        else:
-            print(f"Agent loaded API Key: {api_key[:5]}... (Length: {len(api_key)})")
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
-            self.chat = self.model.start_chat(history=[])
-            self._initialize_persona()
-
-    def _initialize_persona(self):
-        if self.model:
-            system_prompt = """
+# "stateless" sends every analysis as a self-contained request; "chat" keeps one growing chat session
+AGENT_MODE = os.getenv("AGENT_MODE", "stateless")
+AGENT_CONTEXT_READINGS = int(os.getenv("AGENT_CONTEXT_READINGS", "5"))
+AGENT_MAX_CONTEXT_CHARS = int(os.getenv("AGENT_MAX_CONTEXT_CHARS", "4000"))  # hard cap on the per-request prompt
+
+SYSTEM_PROMPT = """
             You are vAItal, a calm and professional medical AI assistant. 
             Your goal is to analyze user vitals and symptoms to provide:
             1. Calming advice to the user.
@@ -31,53 +33,363 @@ class MedicalAgent:
             Always prioritize patient safety. 
             If vitals are severely abnormal, recommend immediate medical attention.
             """
-            self.chat.send_message(system_prompt)
 
-    def analyze(self, vitals_data, symptoms):
-        if not self.model:
-            return "AI Module not initialized (Missing API Key).", "", False
 
-        prompt = f"""
-        Current Vitals: {vitals_data}
-        User Symptoms: {symptoms}
+# Gemini emits properties alphabetically unless told otherwise; these names sort in the order we want
+# them to finish streaming: the verdict first, then the advice, then the long doctor report.
+RESPONSE_FIELDS = ("emergency", "patient_advice", "report_for_doctor")
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "emergency": {"type": "boolean"},
+        "patient_advice": {"type": "string"},
+        "report_for_doctor": {"type": "string"}
+    },
+    "required": list(RESPONSE_FIELDS)
+}
+GENERATION_CONFIG = {"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA}
 
-        Please provide three distinct sections separated by "---":
+_MISSING = object()
 
-        SECTION 1 (Patient Advice):
-        Directly address the patient. Be calming and concise. Give specific advice on what to do immediately.
 
-        ---
+def summarize_recent(recent):
+    """One compact line per vital from a VitalsHistory.window() style dict of columns."""
+    lines = []
+    for key in VITAL_KEYS:
+        values = recent.get(key)
+        if values is None or not len(values):
+            continue
+        values = values.tolist()
+        lines.append(f"{key}: {', '.join(str(v) for v in values)} (min {min(values)}, max {max(values)})")
+    return "\n".join(lines)
 
-        SECTION 2 (Doctor Report):
-        For medical professionals. Structured summary including:
-        - Patient Condition Summary
-        - Vitals Analysis
-        - Reported Symptoms
-        - Recommended Urgency Level
 
-        ---
+class FieldStream:
+    """Pulls top-level fields out of a JSON object while it is still streaming in."""
 
-        SECTION 3 (Emergency Status):
-        Just "YES" or "NO"
-        """
+    def __init__(self, fields):
+        self.text = ""
+        self.values = {}
+        self._pending = list(fields)
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, chunk):
+        """Adds a chunk of text and returns the fields that became complete with it."""
+        self.text += chunk
+        found = {}
+        for name in list(self._pending):
+            value = self._extract(name)
+            if value is not _MISSING:
+                found[name] = self.values[name] = value
+                self._pending.remove(name)
+        return found
 
+    def _extract(self, name):
+        match = re.search(r'"%s"\s*:\s*' % re.escape(name), self.text)
+        if match is None:
+            return _MISSING
+        rest = self.text[match.end():]
         try:
-            response = self.chat.send_message(prompt)
-            text = response.text
+            value, end = self._decoder.raw_decode(rest)
+        except ValueError:
+            return _MISSING  # value still streaming
+        if end == len(rest) and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return _MISSING  # a number may still be growing
+        return value
+
+
+def _parse_sections(text):
+    # Older prompt format: three sections separated by "---"
+    parts = text.split("---")
+    if len(parts) < 3:
+        return None
+    patient_advice = parts[0].replace("SECTION 1 (Patient Advice):", "").strip()
+    doctor_report = parts[1].replace("SECTION 2 (Doctor Report):", "").strip()
+    emergency_status = parts[2].replace("SECTION 3 (Emergency Status):", "").strip().upper()
+    if "YES" not in emergency_status and "NO" not in emergency_status:
+        return None
+    return patient_advice, doctor_report, "YES" in emergency_status
+
+
+def parse_response(text):
+    """(patient_advice, doctor_report, emergency) from a model reply, or None if it can't be trusted."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return _parse_sections(text)
+    if not isinstance(data, dict) or not isinstance(data.get("emergency"), bool):
+        return None
+    return str(data.get("patient_advice", "")), str(data.get("report_for_doctor", "")), data["emergency"]
+
+
+class AnalysisHandle:
+    """Handle for an analysis running in the background. Poll done(), then read result().
+    progress fills in early fields (emergency, patient_advice) while the response is still streaming.
+    The deadline counts from submission, so time spent queued for a worker counts toward the timeout."""
+
+    def __init__(self, future, timeout):
+        self.future = future
+        self.progress = {}
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+
+    def remaining(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def done(self):
+        """True once there is something to show: the result, or the timeout."""
+        return self.future.done() or self.timed_out()
+
+    def timed_out(self):
+        """True if the analysis missed its deadline, whether or not it has stopped running yet."""
+        future = self.future
+        if not future.done():
+            return time.monotonic() >= self.deadline
+        return future.cancelled() or (future.exception() is None and future.result() is TIMEOUT_RESULT)
+
+    def cancel(self):
+        """Drops the analysis if it is still queued. A running one stops at its deadline on its own:
+        the LLM request carries the remaining time as its timeout and the stream is abandoned past it."""
+        self.future.cancel()
+
+    def result(self):
+        """Returns (patient_advice, doctor_report, emergency), blocking at most until the deadline."""
+        try:
+            return self.future.result(timeout=self.remaining())
+        except (TimeoutError, CancelledError):
+            self.cancel()
+            return TIMEOUT_RESULT
+
+
+class MedicalAgent:
+    def __init__(self, timeout=None, max_workers=None, cache=None, mode=None):
+        self.timeout = timeout or ANALYSIS_TIMEOUT
+        self.mode = mode or AGENT_MODE
+        self.context_readings = AGENT_CONTEXT_READINGS
+        self.max_context_chars = AGENT_MAX_CONTEXT_CHARS
+        self.last_usage = None
+        self.last_timing = None
+        self.usage = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0, "max_prompt_tokens": 0}
+        self.cache = cache if cache is not None else AnalysisCache()
+        self._monitor = VitalsMonitor()
+        self.triage = Triage()
+        self.tiers = {tier: {"count": 0, "seconds": 0.0} for tier in TIERS}
+        self.max_workers = max_workers or ANALYSIS_WORKERS
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._chat_lock = threading.Lock()
+
+        # The Gemini client is built on first use, so construction never touches the network
+        self._model = None
+        self.chat = None
+        self.api_key = os.getenv("GEMINI_API_KEY")
+        if not self.api_key:
+            print("Warning: GEMINI_API_KEY not found in .env, analyses will use offline triage only")
+        else:
+            print(f"Agent loaded API Key: {self.api_key[:5]}... (Length: {len(self.api_key)})")
+
+    @property
+    def model(self):
+        if self._model is None and self.api_key:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai  # slow import, only paid when the AI is first needed
+
+                    genai.configure(api_key=self.api_key)
+                    # The persona rides along as a system instruction instead of a priming round-trip
+                    model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=SYSTEM_PROMPT)
+                    if self.mode == "chat":
+                        self.chat = model.start_chat(history=[])
+                    self._model = model
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        self._model = model
 
-            parts = text.split("---")
+    def _record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.last_usage = {
+            "prompt_tokens": usage.prompt_token_count,
+            "output_tokens": usage.candidates_token_count,
+            "total_tokens": usage.total_token_count
+        }
+        metrics.LLM_TOKENS.labels("prompt").inc(usage.prompt_token_count)
+        metrics.LLM_TOKENS.labels("output").inc(usage.candidates_token_count)
+        with self._lock:
+            self.usage["requests"] += 1
+            self.usage["prompt_tokens"] += usage.prompt_token_count
+            self.usage["output_tokens"] += usage.candidates_token_count
+            self.usage["max_prompt_tokens"] = max(self.usage["max_prompt_tokens"], usage.prompt_token_count)
 
-            # Default values in case parsing fails
-            patient_advice = text
-            doctor_report = "Could not parse doctor report."
-            emergency = False
+    def _record_tier(self, tier, seconds, progress):
+        progress["tier"] = tier
+        metrics.TRIAGE_DECISIONS.labels(tier).inc()
+        metrics.STAGE_SECONDS.labels(f"analyze_{tier}").observe(seconds)
+        with self._lock:
+            self.tiers[tier]["count"] += 1
+            self.tiers[tier]["seconds"] += seconds
 
-            if len(parts) >= 3:
-                patient_advice = parts[0].replace("SECTION 1 (Patient Advice):", "").strip()
-                doctor_report = parts[1].replace("SECTION 2 (Doctor Report):", "").strip()
-                emergency_status = parts[2].replace("SECTION 3 (Emergency Status):", "").strip()
-                emergency = "YES" in emergency_status.upper()
+    def tier_stats(self):
+        """Per tier: analyses answered, share of all analyses and mean latency in seconds."""
+        with self._lock:
+            total = sum(tier["count"] for tier in self.tiers.values())
+            return {name: {"count": tier["count"],
+                           "rate": tier["count"] / total if total else 0.0,
+                           "mean_seconds": tier["seconds"] / tier["count"] if tier["count"] else 0.0}
+                    for name, tier in self.tiers.items()}
 
-            return patient_advice, doctor_report, emergency
+    def _stream(self, prompt, timeout=None):
+        """Yields the response text chunk by chunk as Gemini generates it. timeout (seconds) bounds the request."""
+        request_options = {"timeout": timeout} if timeout is not None else None
+        with metrics.timer("llm_call"):
+            try:
+                if self.mode == "chat":
+                    # The chat history only advances once the stream is fully read, so hold the lock until then
+                    with self._chat_lock:
+                        response = self.chat.send_message(prompt, stream=True, generation_config=GENERATION_CONFIG,
+                                                          request_options=request_options)
+                        for chunk in response:
+                            yield chunk.text
+                else:
+                    response = self.model.generate_content(prompt, stream=True, generation_config=GENERATION_CONFIG,
+                                                           request_options=request_options)
+                    for chunk in response:
+                        yield chunk.text
+            except Exception:
+                metrics.LLM_CALLS.labels("error").inc()
+                raise
+        metrics.LLM_CALLS.labels("ok").inc()
+        self._record_usage(response)
+
+    @metrics.timed("analyze")
+    def analyze(self, vitals_data, symptoms, details=None, recent=None, progress=None, thresholds=None,
+                deadline=None):
+        """Answers from the local triage tier when the reading is clear-cut (or when there is no API key),
+        otherwise from the cache or the LLM.
+
+        details: per-vital status from VitalsMonitor.check_vitals, used for triage and the cache key.
+        thresholds: the patient's {vital: (low, high)} the details were checked against (defaults if None).
+        recent: VitalsHistory.window() of the last few readings, summarized into the prompt.
+        progress: optional dict that receives "emergency" and "patient_advice" as soon as each field
+        has streamed in, "timings" (seconds to first token, verdict, advice and completion) at the end,
+        and "tier" plus "triage" (what the local tier decided and why).
+        deadline: time.monotonic() past which the LLM call is abandoned and TIMEOUT_RESULT returned."""
+        progress = progress if progress is not None else {}
+        started = time.perf_counter()
+        if details is None:
+            details = self._monitor.check_vitals(vitals_data)["details"]
+        offline = self.model is None
+        with metrics.timer("triage"):
+            result, progress["triage"] = self.triage.assess(vitals_data, symptoms, details, thresholds, offline)
+        if result is not None:
+            elapsed = time.perf_counter() - started
+            progress.update(emergency=result[2], patient_advice=result[0])
+            progress["timings"] = {"first_token": None, "verdict": elapsed, "advice": elapsed, "total": elapsed}
+            self._record_tier("offline" if offline else "local", elapsed, progress)
+            return result
+
+        key = analysis_key(vitals_data, symptoms, details)
+        cached = self.cache.get(key)
+        metrics.ANALYSIS_CACHE.labels("miss" if cached is None else "hit").inc()
+        if cached is not None:
+            progress.update(emergency=cached[2], patient_advice=cached[0])
+            progress["timings"] = dict.fromkeys(("first_token", "verdict", "advice", "total"), 0.0)
+            self._record_tier("cache", time.perf_counter() - started, progress)
+            return cached
+
+        # Keep the variable parts bounded so the request size stays flat over hours of uptime
+        budget = self.max_context_chars
+        symptoms = str(symptoms)[:budget // 4]
+        trend = summarize_recent(recent)[:budget // 2] if recent else ""
+
+        prompt = f"""
+        Current Vitals: {vitals_data}
+        Recent Readings (oldest first):
+        {trend or "Not available"}
+        User Symptoms: {symptoms}
+
+        Reply with the JSON object described by the response schema:
+        - emergency: true only if an emergency alert is needed.
+        - patient_advice: directly address the patient. Be calming and concise. Give specific advice on what to do immediately.
+        - report_for_doctor: for medical professionals. Structured summary including Patient Condition Summary,
+          Vitals Analysis, Reported Symptoms and Recommended Urgency Level.
+        """
+
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return TIMEOUT_RESULT
+
+        llm_started = time.perf_counter()
+        timings = {"first_token": None, "verdict": None, "advice": None, "total": None}
+        fields = FieldStream(RESPONSE_FIELDS)
+        try:
+            for text in self._stream(prompt, timeout):
+                if deadline is not None and time.monotonic() >= deadline:
+                    # Nobody waits for the rest any more: dropping the stream frees this worker
+                    metrics.LLM_CALLS.labels("timeout").inc()
+                    return TIMEOUT_RESULT
+                elapsed = time.perf_counter() - llm_started
+                if timings["first_token"] is None:
+                    timings["first_token"] = elapsed
+                    metrics.STAGE_SECONDS.labels("llm_first_token").observe(elapsed)
+                for name, value in fields.feed(text).items():
+                    progress[name] = value
+                    if name == "emergency":
+                        timings["verdict"] = elapsed
+                        metrics.STAGE_SECONDS.labels("llm_verdict").observe(elapsed)
+                    elif name == "patient_advice":
+                        timings["advice"] = elapsed
         except Exception as e:
-            return f"Error communicating with AI: {e}", "", False
+            if deadline is not None and time.monotonic() >= deadline:
+                return TIMEOUT_RESULT
+            return f"Error communicating with AI: {e}", "", None
+        finally:
+            timings["total"] = time.perf_counter() - llm_started
+            self.last_timing = progress["timings"] = timings
+            self._record_tier("llm", time.perf_counter() - started, progress)
+
+        result = parse_response(fields.text)
+        if result is None:
+            # Keep whatever fields did arrive, but never guess the emergency verdict
+            return (fields.values.get("patient_advice", fields.text),
+                    fields.values.get("report_for_doctor", "Could not parse doctor report."),
+                    fields.values.get("emergency"))
+        # Only well-formed verdicts are worth repeating
+        self.cache.put(key, result)
+        return result
+
+    def _run(self, handle, vitals_data, symptoms, details, recent, thresholds):
+        return self.analyze(vitals_data, symptoms, details, recent, handle.progress, thresholds, handle.deadline)
+
+    def analyze_async(self, vitals_data, symptoms, patient_id=None, timeout=None, details=None, recent=None,
+                      thresholds=None):
+        """Starts analyze() in the background and returns an AnalysisHandle right away.
+        Returns None if an analysis for this patient is still queued or running within its timeout;
+        one past its timeout is cancelled and no longer blocks the patient."""
+        if recent is not None:
+            # Window views alias the live ring buffer, so snapshot them before leaving this thread
+            recent = {key: values.copy() for key, values in recent.items()}
+        with self._lock:
+            pending = self._in_flight.get(patient_id)
+            if pending is not None:
+                if not pending.done():
+                    return None
+                pending.cancel()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agent")
+            handle = AnalysisHandle(None, timeout or self.timeout)
+            handle.future = self._executor.submit(self._run, handle, vitals_data, symptoms, details, recent,
+                                                  thresholds)
+            self._in_flight[patient_id] = handle
+            return handle
+
+    def in_flight(self, patient_id=None):
+        with self._lock:
+            pending = self._in_flight.get(patient_id)
+            return pending is not None and not pending.done()
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from history import VitalsHistory
+from monitor import VitalsMonitor
+from simulator import VitalsSimulator, CohortSimulator, PPGSimulator
+from stubs import make_agent, make_notifier
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))  # where the fresh interpreters import the app from
+SECTIONS = ("stages", "batch", "ppg", "pipeline", "startup")
+
+
+def summarize(samples, count=1):
+    """Latency percentiles (microseconds) and throughput (items/s) for per-call timings in seconds."""
+    samples = np.asarray(samples)
+    total = samples.sum()
+    return {
+        "calls": len(samples),
+        "p50_us": float(np.percentile(samples, 50) * 1e6),
+        "p90_us": float(np.percentile(samples, 90) * 1e6),
+        "p99_us": float(np.percentile(samples, 99) * 1e6),
+        "max_us": float(samples.max() * 1e6),
+        "per_second": float(len(samples) * count / total) if total else 0.0
+    }
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def bench_stages(iterations, model_latency, transport_latency):
+    results = {}
+    simulator = VitalsSimulator()
+    monitor = VitalsMonitor()
+    vitals = simulator.generate_vitals()
+    abnormal = simulator.generate_vitals(abnormal_flags={"hr": True, "spo2": True})
+
+    results["simulator.generate_vitals"] = summarize(timed(simulator.generate_vitals, iterations))
+    results["simulator.generate_vitals (abnormal)"] = summarize(
+        timed(lambda: simulator.generate_vitals(abnormal_flags={"hr": True, "bp": True}), iterations))
+    results["monitor.check_vitals"] = summarize(timed(lambda: monitor.check_vitals(vitals), iterations))
+    results["monitor.check_vitals (abnormal)"] = summarize(timed(lambda: monitor.check_vitals(abnormal), iterations))
+
+    agent = make_agent(model_latency)
+    agent_iterations = max(1, iterations // 10)
+
+    def analyze_miss():
+        agent.cache.clear()
+        agent.analyze(abnormal, "Auto-detected abnormality. Patient has not provided symptoms yet.")
+
+    results["agent.analyze (cache miss)"] = summarize(timed(analyze_miss, agent_iterations))
+    results["agent.analyze (cache hit)"] = summarize(timed(
+        lambda: agent.analyze(abnormal, "Auto-detected abnormality. Patient has not provided symptoms yet."),
+        agent_iterations))
+    # A single mildly high temperature never leaves the process
+    feverish = dict(vitals, temperature=37.9)
+    feverish_details = monitor.check_vitals(feverish)["details"]
+    results["agent.analyze (local triage)"] = summarize(timed(
+        lambda: agent.analyze(feverish, "Auto-detected abnormality. Patient has not provided symptoms yet.",
+                              details=feverish_details),
+        iterations))
+
+    notifier = make_notifier(transport_latency)
+    results["notifier.send_whatsapp_message"] = summarize(
+        timed(lambda: notifier.send_whatsapp_message("Benchmark report", "+15550000000"), agent_iterations))
+    results["notifier.send_async (enqueue)"] = summarize(
+        timed(lambda: notifier.send_async("Benchmark report", "+15550000000"), agent_iterations))
+    started = time.perf_counter()
+    notifier.queue.flush()
+    results["notifier.queue (drain seconds)"] = time.perf_counter() - started
+    notifier.queue.close()
+    return results
+
+
+def bench_batch(patient_counts, ticks):
+    results = {}
+    monitor = VitalsMonitor()
+    for n in patient_counts:
+        cohort = CohortSimulator(n, seed=0)
+        cohort.set_abnormal("spo2", slice(0, n // 10))
+        step_samples = []
+        check_samples = []
+        for _ in range(ticks):
+            started = time.perf_counter()
+            columns = cohort.step()
+            step_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            monitor.check_vitals_batch(columns)
+            check_samples.append(time.perf_counter() - started)
+        results[f"cohort.step n={n}"] = summarize(step_samples, n)
+        results[f"monitor.check_vitals_batch n={n}"] = summarize(check_samples, n)
+    return results
+
+
+def bench_ppg(stream_counts, ticks):
+    """One tick = a 1 s chunk of 100 Hz red/ir/accel samples per stream, then one estimate for all of them."""
+    from ppg import PPGIngest
+
+    results = {}
+    for n in stream_counts:
+        waves = PPGSimulator(n, seed=0)
+        ingest = PPGIngest(n, sample_rate=waves.fs)
+        # Fill the window first so every timed estimate covers a full one
+        for _ in range(int(ingest.capacity / waves.fs)):
+            ingest.push_batch(*waves.chunk(1.0))
+        push_samples = []
+        estimate_samples = []
+        for _ in range(ticks):
+            chunk = waves.chunk(1.0)
+            started = time.perf_counter()
+            ingest.push_batch(*chunk)
+            push_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            ingest.estimate()
+            estimate_samples.append(time.perf_counter() - started)
+        results[f"ppg.push_batch n={n}"] = summarize(push_samples, n)
+        results[f"ppg.estimate n={n}"] = summarize(estimate_samples, n)
+    return results
+
+
+def bench_pipeline(patient_counts, history_sizes, ticks, model_latency, transport_latency):
+    """One tick = every patient goes simulator -> history -> monitor -> (agent -> notifier when abnormal)."""
+    results = {}
+    for n in patient_counts:
+        for size in history_sizes:
+            simulators = [VitalsSimulator() for _ in range(n)]
+            histories = [VitalsHistory(size) for _ in range(n)]
+            monitor = VitalsMonitor()
+            agent = make_agent(model_latency)
+            notifier = make_notifier(transport_latency)
+            flags = [{"spo2": True} if i % 10 == 0 else {} for i in range(n)]
+
+            samples = []
+            for _ in range(ticks):
+                started = time.perf_counter()
+                for i in range(n):
+                    vitals = simulators[i].generate_vitals(abnormal_flags=flags[i])
+                    histories[i].append(vitals)
+                    analysis = monitor.check_vitals(vitals)
+                    if analysis["status"] == "ABNORMAL":
+                        _, doctor_report, _ = agent.analyze(vitals, "Auto-detected abnormality.",
+                                                            details=analysis["details"],
+                                                            recent=histories[i].window(agent.context_readings))
+                        notifier.send_async(doctor_report, "+15550000000")
+                samples.append(time.perf_counter() - started)
+            notifier.queue.close(timeout=0)
+
+            stats = summarize(samples, n)
+            stats["cache"] = agent.cache.stats()
+            stats["tiers"] = agent.tier_stats()
+            results[f"pipeline n={n} history={size}"] = stats
+    return results
+
+
+STARTUP_SCRIPT = """
+import time
+started = time.perf_counter()
+from core import MonitoringCore
+imported = time.perf_counter()
+patient = MonitoringCore().patient("benchmark")
+patient.tick()
+print(imported - started, time.perf_counter() - started)
+"""
+
+
+def bench_startup(runs):
+    """Cold start in a fresh interpreter: app imports, then core + agent + notifier construction and a first tick."""
+    imports, first_tick, total = [], [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        process = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=REPO_DIR, capture_output=True, text=True)
+        total.append(time.perf_counter() - started)
+        if process.returncode:
+            raise RuntimeError(f"startup script failed: {process.stderr.strip().splitlines()[-1:]}")
+        import_seconds, tick_seconds = map(float, process.stdout.split()[-2:])
+        imports.append(import_seconds)
+        first_tick.append(tick_seconds)
+    return {
+        "startup.imports": summarize(imports),
+        "startup.first_tick": summarize(first_tick),
+        "startup.process": summarize(total)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(previous_path, current):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nChange vs {previous.get('commit')} (p50 latency, negative is faster):")
+    for section in SECTIONS:
+        for name, stats in current.get(section, {}).items():
+            old = previous.get(section, {}).get(name)
+            if isinstance(stats, dict) and isinstance(old, dict) and old.get("p50_us"):
+                change = (stats["p50_us"] - old["p50_us"]) / old["p50_us"] * 100
+                print(f"  {name:<45} {old['p50_us']:>12.1f} -> {stats['p50_us']:>12.1f} us  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vitalia pipeline benchmarks")
+    parser.add_argument("--iterations", type=int, default=10000, help="Calls per single-stage benchmark")
+    parser.add_argument("--patients", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--batch-patients", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--ppg-streams", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--history", type=int, nargs="+", default=[50, 3600])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--startup-runs", type=int, default=5, help="Fresh interpreters started for the cold-start benchmark")
+    parser.add_argument("--model-latency", type=float, default=0.0, help="Seconds the stub model takes per call")
+    parser.add_argument("--transport-latency", type=float, default=0.0, help="Seconds the stub transport takes per send")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "args": vars(args),
+        "errors": {}
+    }
+    suites = {
+        "stages": lambda: bench_stages(args.iterations, args.model_latency, args.transport_latency),
+        "batch": lambda: bench_batch(args.batch_patients, args.ticks),
+        "ppg": lambda: bench_ppg(args.ppg_streams, args.ticks),
+        "pipeline": lambda: bench_pipeline(args.patients, args.history, args.ticks, args.model_latency,
+                                           args.transport_latency),
+        "startup": lambda: bench_startup(args.startup_runs)
+    }
+    for section in SECTIONS:
+        try:
+            results[section] = suites[section]()
+        except Exception as e:
+            # Keep every other suite's numbers; the failure is reported and saved with them
+            results[section] = {}
+            results["errors"][section] = f"{type(e).__name__}: {e}"
+        # Saved after every suite, so an interrupted run still leaves what it measured
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for section in SECTIONS:
+        print(f"\n[{section}]")
+        if section in results["errors"]:
+            print(f"  FAILED: {results['errors'][section]}")
+        for name, stats in results[section].items():
+            if isinstance(stats, dict):
+                print(f"  {name:<45} p50 {stats['p50_us']:>12.1f} us  p99 {stats['p99_us']:>12.1f} us  "
+                      f"{stats['per_second']:>14,.0f}/s")
+            else:
+                print(f"  {name:<45} {stats:.3f}")
+
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from env import load_env
+
+load_env()
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "300"))  # seconds
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "")  # empty = memory only
+
+# Bucket width per vital; readings in the same bucket share a cached verdict
+VITAL_BUCKETS = {
+    "heart_rate": 5,
+    "spo2": 1,
+    "sys_bp": 5,
+    "dia_bp": 5,
+    "temperature": 0.2
+}
+
+
+def normalize_symptoms(symptoms):
+    text = re.sub(r"[^a-z0-9 ]+", " ", (symptoms or "").lower())
+    return " ".join(text.split())
+
+
+def analysis_key(vitals, symptoms, details):
+    """Cache key: abnormal vitals, bucketed vital values and normalized symptoms."""
+    abnormal = sorted(key for key, status in details.items() if status == "ABNORMAL")
+    buckets = [math.floor(vitals[key] / size + 1e-9) for key, size in VITAL_BUCKETS.items()]
+    return json.dumps([abnormal, buckets, normalize_symptoms(symptoms)])
+
+
+class AnalysisCache:
+    """LRU + TTL cache of MedicalAgent results, optionally backed by a SQLite file."""
+
+    def __init__(self, max_size=None, ttl=None, path=None, clock=None):
+        self.max_size = max_size or ANALYSIS_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else ANALYSIS_CACHE_TTL
+        self.path = path if path is not None else ANALYSIS_CACHE_PATH
+        self.clock = clock or time.time  # epoch seconds; entries persisted to the file are stamped with it
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (created, value)
+        self._lock = threading.Lock()
+        self._db = None
+        if self.path:
+            self._open()
+
+    def _open(self):
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS analyses (key TEXT PRIMARY KEY, created REAL, value TEXT)")
+        self._db.execute("DELETE FROM analyses WHERE created < ?", (self.clock() - self.ttl,))
+        self._db.commit()
+        rows = self._db.execute("SELECT key, created, value FROM analyses ORDER BY created").fetchall()
+        for key, created, value in rows[-self.max_size:]:
+            self._entries[key] = (created, tuple(json.loads(value)))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            created = self.clock()
+            self._entries[key] = (created, tuple(value))
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)", (key, created, json.dumps(value)))
+                self._db.commit()
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        if self._db is not None:
+            self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM analyses")
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from env import load_env
+
+load_env()
+
+CHART_POINTS = int(os.getenv("CHART_POINTS", "120"))  # most points drawn per chart, longer windows are downsampled
+
+
+def lttb(x, y, n_out):
+    """Indices of the n_out points Largest-Triangle-Three-Buckets keeps from the series (x, y).
+
+    The first and last points always stay; every bucket in between keeps the point forming the largest
+    triangle with the previously kept point and the mean of the next bucket, so spikes survive."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)  # n_out - 2 buckets between the end points
+    keep = np.empty(n_out, dtype=np.intp)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for k in range(n_out - 2):
+        start, end = edges[k], edges[k + 1]
+        if k == n_out - 3:
+            cx, cy = x[-1], y[-1]
+        else:
+            cx, cy = x[end:edges[k + 2]].mean(), y[end:edges[k + 2]].mean()
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        keep[k + 1] = a
+    return keep
+
+
+def chart_frame(history, last_tick, keys, max_points=None):
+    """DataFrame of history[keys] indexed by tick number, the newest reading being last_tick.
+
+    Windows longer than max_points (CHART_POINTS by default) are LTTB-downsampled on every key and the
+    union of the kept ticks is charted, so a spike in any series survives and the payload stays bounded."""
+    max_points = CHART_POINTS if max_points is None else max_points
+    columns = {key: history[key] for key in keys}
+    n = len(columns[keys[0]])
+    index = np.arange(last_tick - n + 1, last_tick + 1)
+    if n > max_points:
+        keep = lttb(index, columns[keys[0]], max_points)
+        for key in keys[1:]:
+            keep = np.union1d(keep, lttb(index, columns[key], max_points))
+        index = index[keep]
+        columns = {key: values[keep] for key, values in columns.items()}
+    return pd.DataFrame(columns, index=pd.Index(index, name="tick"))
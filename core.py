@@ -0,0 +1,282 @@
+import os
+import threading
+import time
+import traceback
+
+from agent import MedicalAgent
+from charts import chart_frame
+from detector import StreamingDetector, default_rules
+from env import load_env
+from history import VitalsHistory
+from incidents import IncidentManager, severity
+import metrics
+from monitor import VitalsMonitor
+from notifier import WhatsAppNotifier
+from profiles import ProfileRegistry
+from simulator import VitalsSimulator
+from triage import AUTO_SYMPTOMS
+
+load_env()
+
+
+def report_message(doctor_report, incident_id=None, reason=None):
+    """WhatsApp body for a doctor report, headed by its incident when an escalation produced it."""
+    body = f"{doctor_report}\n\nNo-reply: This is from vAItal"
+    return body if incident_id is None else f"Incident #{incident_id} ({reason})\n\n{body}"
+
+
+class PatientPipeline:
+    """The per-patient incident -> analyze -> notify half of the pipeline, fed one reading at a time
+    after the detector has seen it. The live PatientMonitor, the fleet shards and the replay backtest
+    all go through step(), so they escalate, collect analyses and text the doctor the same way."""
+
+    def __init__(self, patient_id, incidents, agent=None, notifier=None, doctor_phone="", history=None,
+                 auto_send=False):
+        self.patient_id = patient_id
+        self.incidents = incidents
+        self.agent = agent
+        self.notifier = notifier
+        self.doctor_phone = doctor_phone
+        self.history = history
+        self.auto_send = auto_send
+        self.ai_result = None
+        self.pending_analysis = None
+        self.pending_analysis_auto = False
+        self.pending_incident = None  # (incident id, escalation reason) of an auto analysis
+        self.counts = {"analyses": 0, "local_analyses": 0, "analysis_errors": 0, "notifications": 0}
+
+    @property
+    def notify(self):
+        """Whether an escalation also texts the doctor."""
+        return bool(self.auto_send and self.notifier is not None and self.doctor_phone)
+
+    def step(self, now, vitals, abnormal, breaching=(), level=0, details=None, thresholds=None, wait=False):
+        """Feeds one reading with the detector's verdict for it: abnormal (episode state), breaching
+        (vitals with a fired rule) and level (their severity).
+
+        Starts an analysis when the incident escalates and returns the reason, or None. Without an agent
+        the escalation itself is the alert. With one, the escalation only counts once the analysis has
+        started, so it is retried on the next reading while the patient's last analysis is in flight.
+        wait=True collects the analysis before returning, for callers that can't leave one running."""
+        self.collect_ai_result()
+        reason = self.incidents.observe(self.patient_id, now, abnormal, vitals, breaching, level, notify=self.notify)
+        if reason is None:
+            return None
+        if self.agent is not None:
+            recent = self.history.window(self.agent.context_readings) if self.history is not None else None
+            handle = self.agent.analyze_async(vitals, AUTO_SYMPTOMS, patient_id=self.patient_id, details=details,
+                                              recent=recent, thresholds=thresholds)
+            if handle is None:
+                return None
+            self.pending_analysis = handle
+            self.pending_analysis_auto = True
+            self.pending_incident = (self.incidents.current(self.patient_id).id, reason)
+        self.incidents.escalated(self.patient_id, now)
+        if wait:
+            self.collect_ai_result(wait=True)
+        return reason
+
+    def collect_ai_result(self, wait=False):
+        """Picks up a finished background analysis without blocking (unless wait) and, for an automatic
+        one, sends its report to the doctor. Returns the new ai_result, or None if nothing finished."""
+        handle = self.pending_analysis
+        if handle is None or not (wait or handle.done()):
+            return None
+
+        # Cleared first, so an analysis that raised is not collected again every tick
+        self.pending_analysis = None
+        try:
+            patient_advice, doctor_report, emergency = handle.result()
+        except Exception as e:
+            self.counts["analysis_errors"] += 1
+            print(f"Patient {self.patient_id}: analysis failed: {e!r}")
+            patient_advice, doctor_report, emergency = f"AI analysis failed: {e}", "", None
+        else:
+            self.counts["analyses"] += 1
+            if handle.progress.get("tier") in ("local", "offline"):
+                self.counts["local_analyses"] += 1
+        self.ai_result = {
+            "patient": patient_advice,
+            "doctor": doctor_report,
+            "emergency": emergency,
+            "timings": handle.progress.get("timings"),
+            "tier": handle.progress.get("tier")
+        }
+
+        if self.pending_analysis_auto and self.notify and doctor_report and not handle.timed_out():
+            incident_id, reason = self.pending_incident
+            self.notifier.send_async(report_message(doctor_report, incident_id, reason), self.doctor_phone)
+            self.counts["notifications"] += 1
+        return self.ai_result
+
+
+class PatientMonitor(PatientPipeline):
+    """The single producer for one patient: runs simulator -> monitor -> agent -> notifier at 1 Hz
+    on a background thread and publishes a read-only snapshot for any number of viewers."""
+
+    def __init__(self, patient_id, agent, notifier, store=None, doctor_phone="", profiles=None,
+                 incidents=None):
+        super().__init__(patient_id, incidents if incidents is not None else IncidentManager(), agent, notifier,
+                         doctor_phone, VitalsHistory())
+        self.store = store
+        self.simulator = VitalsSimulator()
+        self.monitor = VitalsMonitor()
+        self.detector = StreamingDetector(1)
+        self.profiles = profiles
+        self._profile_version = None
+        if profiles is not None:
+            self._apply_profile()
+
+        # Shared controls, set from any viewer like auto_send
+        self.monitoring = False
+        self.abnormal_flags = {'hr': False, 'spo2': False, 'bp': False, 'temp': False}
+
+        # Published state; snapshot is replaced wholesale each tick, never mutated
+        self.snapshot = None
+        self.ticks = 0
+        self.error = None  # last tick's exception as text, None once a tick succeeds again
+        self._chart_frames = (None, {})  # (tick, charted keys -> frame) for the latest snapshot
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self.monitoring = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"monitor-{self.patient_id}", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self.monitoring = False
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            try:
+                self.collect_ai_result()
+                if self.monitoring:
+                    self.tick()
+                self.error = None
+            except Exception as e:
+                # Keep producing: a dead thread would leave every viewer on a frozen snapshot
+                metrics.TICK_ERRORS.labels("monitor").inc()
+                print(f"Monitor {self.patient_id}: tick failed")
+                traceback.print_exc()
+                self.error = f"{type(e).__name__}: {e}"
+            next_tick += 1.0
+            remaining = next_tick - time.monotonic()
+            if remaining < 0:
+                metrics.TICK_OVERRUNS.labels("monitor").inc()
+                # Don't try to catch up with a burst of ticks
+                next_tick = time.monotonic()
+            time.sleep(max(0.0, remaining))
+
+    def _apply_profile(self):
+        # Swap thresholds in place: history, detector timers and episode state all carry over
+        thresholds = self.profiles.thresholds(self.patient_id)
+        self.monitor.thresholds = thresholds
+        self.detector.replace_rules(default_rules(thresholds))
+        self._profile_version = self.profiles.version
+
+    @metrics.timed("tick")
+    def tick(self):
+        if self.profiles is not None:
+            self.profiles.maybe_reload()
+            if self.profiles.version != self._profile_version:
+                self._apply_profile()
+
+        with metrics.timer("generate_vitals"):
+            vitals = self.simulator.generate_vitals(abnormal_flags=dict(self.abnormal_flags))
+        self.history.append(vitals)
+        if self.store is not None:
+            with metrics.timer("store_append"):
+                self.store.append(self.patient_id, vitals)
+
+        with metrics.timer("check_vitals"):
+            analysis = self.monitor.check_vitals(vitals)
+        # Episode state comes from the streaming detector (sustained breaches + hysteresis),
+        # so a single noisy sample can't reset the auto-analysis timer
+        with metrics.timer("detector"):
+            episode = self.detector.update_one(vitals)
+
+        # One incident per episode: analyze (and notify) when it opens, then only on real changes
+        breaching = self.detector.active_vitals(0)
+        level = severity(self.detector.smoothed(0, breaching), self.monitor.thresholds)
+        self.step(time.time(), vitals, episode["status"] == "ABNORMAL", breaching, level, analysis["details"],
+                  self.monitor.thresholds)
+        incident = self.incidents.current(self.patient_id)
+
+        self.ticks += 1
+        # Copy the chart window once here so every viewer can render it while the next tick writes
+        self.snapshot = {
+            "tick": self.ticks,
+            "vitals": vitals,
+            "analysis": analysis,
+            "episode": episode,
+            "incident": incident.summary() if incident is not None else None,
+            "history": {key: values.copy() for key, values in self.history.window().items()}
+        }
+
+    def chart_frame(self, snapshot, keys):
+        """Downsampled chart frame of keys from snapshot's history window.
+        Built once per tick and shared by every viewer, however many render it."""
+        tick, frames = self._chart_frames
+        if tick != snapshot["tick"]:
+            frames = {}
+            self._chart_frames = (snapshot["tick"], frames)
+        frame = frames.get(keys)
+        if frame is None:
+            frame = frames[keys] = chart_frame(snapshot["history"], snapshot["tick"], keys)
+        return frame
+
+    def request_analysis(self, symptoms):
+        """Analysis of user-reported symptoms against the latest vitals. False if one is already running."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return False
+        handle = self.agent.analyze_async(snapshot["vitals"], symptoms, patient_id=self.patient_id,
+                                          details=snapshot["analysis"]["details"],
+                                          recent=self.history.window(self.agent.context_readings),
+                                          thresholds=self.monitor.thresholds)
+        if handle is None:
+            return False
+        self.pending_analysis = handle
+        self.pending_analysis_auto = False
+        return True
+
+    def send_report(self, body):
+        if not self.doctor_phone:
+            return False, "Please enter a Doctor's WhatsApp number in the sidebar."
+        return self.notifier.send_async(body, self.doctor_phone)
+
+
+class MonitoringCore:
+    """Process-wide registry of patient producers. UI sessions only read from it,
+    so per-tick work stays the same no matter how many viewers are connected."""
+
+    def __init__(self, store=None, profiles=None):
+        self.store = store
+        metrics.start_server()
+        self.profiles = profiles if profiles is not None else ProfileRegistry()
+        self.incidents = IncidentManager()
+        self.doctor_phone = os.getenv("DOCTOR_PHONE_NUMBER", "")
+        self._agent = None
+        self._notifier = None
+        self._patients = {}
+        self._lock = threading.Lock()
+
+    def patient(self, patient_id):
+        with self._lock:
+            if patient_id not in self._patients:
+                # One agent and notifier for the whole process: one LLM client, one delivery queue
+                if self._agent is None:
+                    self._agent = MedicalAgent()
+                    self._notifier = WhatsAppNotifier()
+                self._patients[patient_id] = PatientMonitor(patient_id, self._agent, self._notifier,
+                                                            self.store, self.doctor_phone, self.profiles,
+                                                            self.incidents)
+            return self._patients[patient_id]
+
+    def patients(self):
+        return list(self._patients)
@@ -0,0 +1,242 @@
+import os
+
+import numpy as np
+
+from env import load_env
+from monitor import VitalsMonitor, VITAL_KEYS
+
+load_env()
+
+DETECTOR_WINDOW = int(os.getenv("DETECTOR_WINDOW", "60"))  # samples in the rolling min/max window
+DETECTOR_ALPHA = float(os.getenv("DETECTOR_ALPHA", "0.2"))  # EWMA smoothing factor
+DETECTOR_MIN_DURATION = float(os.getenv("DETECTOR_MIN_DURATION", "5"))  # seconds a range breach must last
+DETECTOR_CLEAR_DURATION = float(os.getenv("DETECTOR_CLEAR_DURATION", "10"))  # seconds all clear before leaving ABNORMAL
+
+# How far back inside the normal range a vital must come before its rule clears (hysteresis band)
+CLEAR_MARGINS = {
+    "heart_rate": 5,
+    "spo2": 1,
+    "sys_bp": 5,
+    "dia_bp": 5,
+    "temperature": 0.2
+}
+
+
+class RollingStats:
+    """O(1)-per-sample rolling statistics of one vital for many patients at once.
+
+    EWMA mean/variance are exponentially weighted. Min/max cover the last `window` samples exactly,
+    using the van Herk/Gil-Werman block trick: a suffix max/min of the previous block is computed
+    once per block and combined with a running max/min of the current one. The slope is a
+    least-squares fit over the same window, computed only when a trend rule asks for it."""
+
+    def __init__(self, n_patients, window=None, alpha=None):
+        self.window = window or DETECTOR_WINDOW
+        self.alpha = alpha or DETECTOR_ALPHA
+        self.count = 0
+        self.last = np.full(n_patients, np.nan)
+        self.mean = np.full(n_patients, np.nan)
+        self.var = np.zeros(n_patients)
+        self.dt = 1.0
+        self._slope = None
+        self.min = np.full(n_patients, np.nan)
+        self.max = np.full(n_patients, np.nan)
+        self._buffer = np.full((self.window, n_patients), np.nan)
+        self._suffix_max = np.full((self.window + 1, n_patients), np.nan)
+        self._suffix_min = np.full((self.window + 1, n_patients), np.nan)
+        self._block_max = None
+        self._block_min = None
+
+    def update(self, values, dt=1.0):
+        values = np.asarray(values, dtype=np.float64)
+        k = self.count % self.window
+
+        if self.count == 0:
+            self.mean = values.copy()
+        else:
+            diff = values - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.var = (1 - self.alpha) * (self.var + diff * increment)
+        self.last = values
+        self.dt = dt
+        self._slope = None
+
+        if k == 0:
+            # New block: the buffer now holds the previous block, so take its suffix extremes once
+            self._suffix_max[:-1] = np.fmax.accumulate(self._buffer[::-1], axis=0)[::-1]
+            self._suffix_min[:-1] = np.fmin.accumulate(self._buffer[::-1], axis=0)[::-1]
+            self._block_max = values.copy()
+            self._block_min = values.copy()
+        else:
+            np.fmax(self._block_max, values, out=self._block_max)
+            np.fmin(self._block_min, values, out=self._block_min)
+        self._buffer[k] = values
+        self.max = np.fmax(self._suffix_max[k + 1], self._block_max)
+        self.min = np.fmin(self._suffix_min[k + 1], self._block_min)
+        self.count += 1
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def slope(self):
+        """Least-squares slope over the window in units per second, 0 until the window has filled.
+
+        A fit over the whole window, unlike smoothed sample-to-sample differences, doesn't mistake
+        a few seconds of noise for a trend. Missing (NaN) samples are left out of the fit."""
+        if self._slope is None:
+            self._slope = self._fit_slope()
+        return self._slope
+
+    def _fit_slope(self):
+        n = self.window
+        if self.count < n or n < 2:
+            return np.zeros_like(self.last)
+        y = self._buffer[np.arange(self.count - n, self.count) % n]  # oldest first
+        t = np.arange(n, dtype=np.float64)[:, None] * self.dt
+        valid = ~np.isnan(y)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(valid, t - np.where(valid, t, 0).sum(axis=0) / valid.sum(axis=0), 0.0)
+            y = np.where(valid, y, 0.0)
+            slope = (t * y).sum(axis=0) / (t * t).sum(axis=0)
+        return np.nan_to_num(slope, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+class ThresholdRule:
+    """Fires once `vital op threshold` has held for `duration` seconds, e.g. SpO2 < 94 for 15 s.
+    Clears only when the value is back past `clear` (defaults to the threshold itself).
+
+    With op "outside", threshold and clear are (low, high) pairs: every sample out of range on
+    either side counts toward `duration`, and the rule clears only back inside the clear range,
+    so a vital swinging between too low and too high still fires."""
+
+    def __init__(self, vital, op, threshold, duration=0.0, clear=None, name=None):
+        if op not in ("<", ">", "outside"):
+            raise ValueError(f"Unsupported operator: {op}")
+        self.vital = vital
+        self.op = op
+        self.threshold = threshold
+        self.duration = duration
+        self.clear = threshold if clear is None else clear
+        if name is None:
+            name = (f"{vital} outside {threshold[0]:g}-{threshold[1]:g}" if op == "outside"
+                    else f"{vital} {op} {threshold}")
+            name += f" for {duration:g}s"
+        self.name = name
+
+    def breached(self, stats):
+        if self.op == "outside":
+            low, high = self.threshold
+            return (stats.last < low) | (stats.last > high)
+        return stats.last < self.threshold if self.op == "<" else stats.last > self.threshold
+
+    def cleared(self, stats):
+        if self.op == "outside":
+            low, high = self.clear
+            return (stats.last >= low) & (stats.last <= high)
+        return stats.last >= self.clear if self.op == "<" else stats.last <= self.clear
+
+
+class TrendRule:
+    """Fires when a vital's slope over the rolling window passes `per_minute` (negative for falling)
+    for `duration` seconds, e.g. HR rising 60 bpm/min."""
+
+    def __init__(self, vital, per_minute, duration=0.0, name=None):
+        self.vital = vital
+        self.per_minute = per_minute
+        self.duration = duration
+        direction = "rising" if per_minute > 0 else "falling"
+        self.name = name or f"{vital} {direction} {abs(per_minute):g}/min"
+
+    def breached(self, stats):
+        slope = stats.slope * 60
+        return slope > self.per_minute if self.per_minute > 0 else slope < self.per_minute
+
+    def cleared(self, stats):
+        # Clear once the trend has at least halved
+        slope = stats.slope * 60
+        return slope <= self.per_minute / 2 if self.per_minute > 0 else slope >= self.per_minute / 2
+
+
+def default_rules(thresholds=None, duration=None):
+    """One range rule per vital, built from VitalsMonitor thresholds. Trend rules are opt-in, e.g.
+    default_rules() + [TrendRule("heart_rate", 60, duration=15)].
+
+    thresholds may be a profiles.ThresholdTable; the rules then compare each patient to its own row."""
+    thresholds = thresholds if thresholds is not None else VitalsMonitor().thresholds
+    duration = DETECTOR_MIN_DURATION if duration is None else duration
+    rules = []
+    for vital in VITAL_KEYS:
+        low, high = thresholds[vital]
+        margin = CLEAR_MARGINS[vital]
+        # Per-patient thresholds don't fit in a rule name
+        per_patient = np.ndim(low) > 0
+        rules.append(ThresholdRule(vital, "outside", (low, high), duration, clear=(low + margin, high - margin),
+                                   name=f"{vital} out of range for {duration:g}s" if per_patient else None))
+    return rules
+
+
+class StreamingDetector:
+    """Incremental anomaly detector for many patients, one reading per patient per update().
+
+    Enters ABNORMAL as soon as any rule fires and leaves it only after every rule has been
+    cleared for `clear_duration` seconds, so a single noisy sample can't flip the state."""
+
+    def __init__(self, n_patients, rules=None, window=None, alpha=None, clear_duration=None):
+        self.n = n_patients
+        self.rules = rules if rules is not None else default_rules()
+        self.clear_duration = DETECTOR_CLEAR_DURATION if clear_duration is None else clear_duration
+        self.stats = {vital: RollingStats(n_patients, window, alpha) for vital in VITAL_KEYS}
+        self.abnormal = np.zeros(n_patients, dtype=bool)
+        self.fired = np.zeros((len(self.rules), n_patients), dtype=bool)
+        self._breach_time = np.zeros((len(self.rules), n_patients))
+        self._clear_time = np.zeros(n_patients)
+
+    def replace_rules(self, rules):
+        """Swaps in new rules (e.g. after a threshold profile reload) without losing state.
+        Rules are matched by position, so breach timers and fired flags carry over; a fired rule
+        then clears against its new clear level on the next update."""
+        if len(rules) != len(self.rules):
+            raise ValueError(f"Expected {len(self.rules)} rules, got {len(rules)}")
+        self.rules = rules
+
+    def update(self, columns, dt=1.0):
+        """columns: one array (length n_patients) per vital. Returns the ABNORMAL mask."""
+        for vital, stats in self.stats.items():
+            stats.update(columns[vital], dt)
+
+        all_cleared = np.ones(self.n, dtype=bool)
+        for r, rule in enumerate(self.rules):
+            stats = self.stats[rule.vital]
+            self._breach_time[r] = np.where(rule.breached(stats), self._breach_time[r] + dt, 0.0)
+            self.fired[r] = np.where(self.fired[r], ~rule.cleared(stats),
+                                     (self._breach_time[r] >= rule.duration) & (self._breach_time[r] > 0))
+            all_cleared &= ~self.fired[r]
+
+        entering = ~self.abnormal & ~all_cleared
+        self._clear_time = np.where(self.abnormal & all_cleared, self._clear_time + dt, 0.0)
+        leaving = self.abnormal & (self._clear_time >= self.clear_duration)
+        self.abnormal = (self.abnormal | entering) & ~leaving
+        return self.abnormal
+
+    def update_one(self, vitals, dt=1.0):
+        """Single-patient convenience for a detector created with n_patients=1."""
+        self.update({vital: [vitals[vital]] for vital in VITAL_KEYS}, dt)
+        return {
+            "status": "ABNORMAL" if self.abnormal[0] else "NORMAL",
+            "rules": self.active_rules(0)
+        }
+
+    def active_rules(self, i):
+        return [rule.name for r, rule in enumerate(self.rules) if self.fired[r, i]]
+
+    def active_vitals(self, i):
+        """Vitals with at least one fired rule for patient i, in VITAL_KEYS order."""
+        fired = {rule.vital for r, rule in enumerate(self.rules) if self.fired[r, i]}
+        return [vital for vital in VITAL_KEYS if vital in fired]
+
+    def smoothed(self, i, vitals=VITAL_KEYS):
+        """EWMA value of each vital for patient i."""
+        return {vital: float(self.stats[vital].mean[i]) for vital in vitals}
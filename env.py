@@ -0,0 +1,12 @@
+from dotenv import load_dotenv
+
+_loaded = False
+
+
+def load_env():
+    """Loads .env into os.environ once per process; later calls are free."""
+    global _loaded
+    if not _loaded:
+        # .env wins over inherited variables, as the agent has always required
+        load_dotenv(override=True)
+        _loaded = True
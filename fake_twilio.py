@@ -0,0 +1,127 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    """Local stand-in for Twilio's Messages API, for load-testing delivery.
+
+    Accepts POST /2010-04-01/Accounts/<sid>/Messages.json and answers like Twilio after an
+    optional artificial latency, failing a configurable fraction of requests with a 503."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=8099, latency=0.0, fail_rate=0.0):
+        super().__init__((host, port), FakeTwilioHandler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.messages = []
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="fake-twilio", daemon=True)
+        thread.start()
+        return self
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled client connections are reused
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        with server._lock:
+            server.requests += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not self.path.endswith("/Messages.json"):
+            return self._reply(404, {"message": "Not found"})
+        if random.random() < server.fail_rate:
+            return self._reply(503, {"message": "Service unavailable (simulated)"})
+
+        sid = "SM" + uuid.uuid4().hex
+        with server._lock:
+            server.messages.append({"sid": sid, "to": form.get("To", [""])[0], "body": form.get("Body", [""])[0]})
+        self._reply(201, {"sid": sid, "status": "queued"})
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_load_test(messages=1000, recipients=100, workers=8, latency=0.05, fail_rate=0.0):
+    """Pushes messages through NotificationQueue into a local fake server and reports throughput/latency."""
+    from notifier import HttpTransport, NotificationQueue
+
+    server = FakeTwilioServer(port=0, latency=latency, fail_rate=fail_rate).start()
+    transport = HttpTransport(server.base_url, "ACfake", "token", pool_size=workers)
+    queue = NotificationQueue(transport, "+10000000000", workers=workers, backoff=0.1,
+                              recipient_interval=0, path="")
+    started = time.perf_counter()
+    for i in range(messages):
+        queue.enqueue(f"Load test message {i}", f"+1555{i % recipients:07d}")
+    queue.flush()
+    elapsed = time.perf_counter() - started
+    queue.close()
+    server.shutdown()
+
+    latencies = sorted(queue.latencies)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+    return {
+        "messages": messages,
+        "sent": queue.stats["sent"],
+        "failed": queue.stats["failed"],
+        "retried": queue.stats["retried"],
+        "http_requests": server.requests,
+        "seconds": elapsed,
+        "messages_per_second": queue.stats["sent"] / elapsed if elapsed else 0.0,
+        "latency_p50": percentile(0.50),
+        "latency_p99": percentile(0.99)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Twilio server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--load-test", type=int, metavar="N", help="Send N messages through the queue and exit")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.load_test:
+        stats = run_load_test(args.load_test, workers=args.workers, latency=args.latency, fail_rate=args.fail_rate)
+        print(f"{stats['sent']}/{stats['messages']} delivered ({stats['failed']} failed, {stats['retried']} retries) "
+              f"in {stats['seconds']:.2f}s: {stats['messages_per_second']:.0f} msg/s, "
+              f"p50 {stats['latency_p50'] * 1000:.1f} ms, p99 {stats['latency_p99'] * 1000:.1f} ms")
+        return
+
+    server = FakeTwilioServer(port=args.port, latency=args.latency, fail_rate=args.fail_rate)
+    print(f"Fake Twilio listening on {server.base_url} (set TWILIO_BASE_URL to use it)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
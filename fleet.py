@@ -0,0 +1,306 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+import zlib
+
+from core import PatientPipeline
+from detector import StreamingDetector, default_rules
+from env import load_env
+from history import VitalsHistory
+from incidents import IncidentManager, severity
+from monitor import VitalsMonitor, VITAL_KEYS
+from profiles import ProfileRegistry
+from simulator import CohortSimulator, VitalsSimulator
+from store import VitalsStore
+
+load_env()
+
+SHARD_POLL_SECONDS = 1.0  # how often run() checks whether a shard died without reporting
+
+
+def shard_for(patient_id, n_shards):
+    """Stable shard index for a patient id (same on every run and process)."""
+    return zlib.crc32(str(patient_id).encode()) % n_shards
+
+
+class PatientState(PatientPipeline):
+    """Everything the pipeline remembers about one patient. Lives only inside its shard."""
+
+    def __init__(self, patient_id, incidents, agent=None, notifier=None, doctor_phone="", history_size=None):
+        # Every escalation is reported when the shard has a notifier
+        super().__init__(patient_id, incidents, agent, notifier, doctor_phone, VitalsHistory(history_size),
+                         auto_send=True)
+        self.simulator = VitalsSimulator()
+        self.abnormal_flags = {}
+        self.ts_offset = 0.0  # epoch of tick 0 when writing to a VitalsStore
+
+
+def _publish(viewer, item):
+    # Viewers are best-effort: a slow consumer must never stall the shard
+    try:
+        viewer.put_nowait(item)
+    except queue.Full:
+        pass
+
+
+def _run_shard(shard_id, patient_ids, ticks, options, viewers, results):
+    for viewer in viewers.values():
+        # Don't block shard exit on a viewer that stopped reading
+        viewer.cancel_join_thread()
+    profiles = ProfileRegistry(options["profiles_path"])
+    thresholds = profiles.compile(patient_ids)
+    monitor = VitalsMonitor(thresholds)
+    agent = None
+    notifier = None
+    if options["analyze"]:
+        from agent import MedicalAgent
+        agent = MedicalAgent()
+    if options["notify"]:
+        from notifier import WhatsAppNotifier, outbox_path
+        # Shards are stable for a given --workers, so a rerun picks up exactly its own undelivered messages
+        notifier = WhatsAppNotifier(outbox_path=outbox_path(f"shard{shard_id}"))
+    doctor_phone = os.getenv("DOCTOR_PHONE_NUMBER", "")
+
+    incidents = IncidentManager()
+    patients = [PatientState(pid, incidents, agent, notifier, doctor_phone, options["history_size"])
+                for pid in patient_ids]
+    detector = StreamingDetector(len(patients), rules=default_rules(thresholds))
+    store = VitalsStore(options["store_path"]) if options["store_path"] else None
+    if store:
+        # Logical ticks run ahead of the wall clock, so continue after whatever an earlier run wrote
+        epoch = time.time()
+        for patient in patients:
+            patient.ts_offset = max(epoch, store.series(patient.patient_id).last_ts + 1)
+    for patient in patients:
+        patient.abnormal_flags = options["abnormal_flags"].get(patient.patient_id, {})
+
+    stats = {"shard": shard_id, "patients": len(patients), "readings": 0, "abnormal": 0,
+             "analyses": 0, "local_analyses": 0, "analysis_errors": 0, "notifications": 0}
+    started = time.perf_counter()
+
+    for tick in range(ticks):
+        tick_started = time.perf_counter()
+        # Logical clock: one reading per patient per second, regardless of how fast we run
+        now = tick * 1.0
+
+        if profiles.maybe_reload():
+            # Recompile the shard's table; detector timers and patient state are kept
+            thresholds = profiles.compile(patient_ids)
+            monitor.thresholds = thresholds
+            detector.replace_rules(default_rules(thresholds))
+
+        readings = [p.simulator.generate_vitals(abnormal_flags=p.abnormal_flags) for p in patients]
+        columns = {key: [r[key] for r in readings] for key in VITAL_KEYS}
+        batch = monitor.check_vitals_batch(columns)
+        episodes = detector.update(batch.columns)
+
+        for i, patient in enumerate(patients):
+            vitals = readings[i]
+            patient.history.append(vitals)
+            if store:
+                store.append(patient.patient_id, vitals, ts=patient.ts_offset + now)
+
+            if batch.abnormal[i]:
+                stats["abnormal"] += 1
+
+            # Patients with nothing open or in flight are skipped: step() would be a no-op for them
+            if episodes[i] or patient.patient_id in incidents.open:
+                breaching = detector.active_vitals(i)
+                level = severity(detector.smoothed(i, breaching), thresholds.row(i)) if breaching else 0
+                patient.step(now, vitals, bool(episodes[i]), breaching, level,
+                             batch.row(i, values=vitals)["details"], thresholds.row(i))
+            elif patient.pending_analysis is not None:
+                patient.collect_ai_result()
+
+            viewer = viewers.get(patient.patient_id)
+            if viewer is not None:
+                _publish(viewer, {
+                    "patient_id": patient.patient_id,
+                    "vitals": vitals,
+                    "analysis": batch.row(i, values=vitals),
+                    "episode": "ABNORMAL" if episodes[i] else "NORMAL",
+                    "ai_result": patient.ai_result
+                })
+
+        stats["readings"] += len(patients)
+
+        if options["realtime"]:
+            remaining = 1.0 - (time.perf_counter() - tick_started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+    stats["seconds"] = time.perf_counter() - started
+    for patient in patients:
+        for key, count in patient.counts.items():
+            stats[key] += count
+    stats.update(incidents.stats())
+    if store:
+        store.close()
+    if notifier and notifier.queue:
+        # Whatever doesn't go out in time stays in the outbox for the next run
+        notifier.queue.close(timeout=5)
+    results.put(stats)
+
+
+class FleetEngine:
+    """Runs the simulator -> monitor -> agent -> notifier pipeline for many patients.
+
+    Patients are sharded by id across worker processes; each shard owns its patients' state."""
+
+    def __init__(self, n_patients, workers=None, history_size=None, analyze=False, notify=False, realtime=False,
+                 store_path=None, profiles_path=None):
+        self.patient_ids = list(range(n_patients))
+        self.workers = workers or os.cpu_count() or 1
+        self.history_size = history_size
+        self.analyze = analyze
+        self.notify = notify
+        self.realtime = realtime
+        self.store_path = store_path
+        self.profiles_path = profiles_path
+        self.abnormal_flags = {}
+        self.viewers = {}
+        self._ctx = mp.get_context()
+
+    def set_abnormal_flags(self, patient_id, flags):
+        """Same flags as VitalsSimulator.generate_vitals, applied to one patient for the whole run."""
+        self.abnormal_flags[patient_id] = flags
+
+    def spread_abnormal(self, count):
+        """Makes count patients, evenly spaced over the ids, abnormal for the whole run.
+        They cycle through the simulator's abnormalities (hr, spo2, bp, temp)."""
+        count = min(count, len(self.patient_ids))
+        for k in range(count):
+            patient_id = self.patient_ids[k * len(self.patient_ids) // count]
+            self.set_abnormal_flags(patient_id, {CohortSimulator.FLAGS[k % len(CohortSimulator.FLAGS)]: True})
+
+    def watch(self, patient_id, maxsize=100):
+        """Returns a queue that receives every reading (and AI result) of one patient during run()."""
+        viewer = self._ctx.Queue(maxsize=maxsize)
+        self.viewers[patient_id] = viewer
+        return viewer
+
+    def shards(self):
+        shards = [[] for _ in range(self.workers)]
+        for pid in self.patient_ids:
+            shards[shard_for(pid, self.workers)].append(pid)
+        return shards
+
+    def run(self, ticks):
+        """Runs every patient for the given number of one-second ticks and returns throughput stats."""
+        # Fail here on a broken profiles file rather than inside every shard
+        ProfileRegistry(self.profiles_path)
+        options = {
+            "history_size": self.history_size,
+            "analyze": self.analyze,
+            "notify": self.notify,
+            "realtime": self.realtime,
+            "store_path": self.store_path,
+            "profiles_path": self.profiles_path,
+            "abnormal_flags": self.abnormal_flags
+        }
+        results = self._ctx.Queue()
+        processes = {}
+        started = time.perf_counter()
+        for shard_id, patient_ids in enumerate(self.shards()):
+            if not patient_ids:
+                continue
+            viewers = {pid: self.viewers[pid] for pid in patient_ids if pid in self.viewers}
+            process = self._ctx.Process(target=_run_shard,
+                                        args=(shard_id, patient_ids, ticks, options, viewers, results),
+                                        daemon=True)
+            process.start()
+            processes[shard_id] = process
+
+        shard_stats, failed = self._collect(processes, results)
+        for process in processes.values():
+            process.join()
+        seconds = time.perf_counter() - started
+
+        readings = sum(s["readings"] for s in shard_stats)
+        return {
+            "patients": len(self.patient_ids),
+            "workers": len(processes),
+            "failed_shards": failed,
+            "readings": readings,
+            "abnormal": sum(s["abnormal"] for s in shard_stats),
+            "analyses": sum(s["analyses"] for s in shard_stats),
+            "local_analyses": sum(s["local_analyses"] for s in shard_stats),
+            "analysis_errors": sum(s["analysis_errors"] for s in shard_stats),
+            "notifications": sum(s["notifications"] for s in shard_stats),
+            "incidents": sum(s["opened"] for s in shard_stats),
+            "escalations": sum(s["escalations"] for s in shard_stats),
+            "suppressed_analyses": sum(s["suppressed_analyses"] for s in shard_stats),
+            "suppressed_notifications": sum(s["suppressed_notifications"] for s in shard_stats),
+            "seconds": seconds,
+            "readings_per_second": readings / seconds if seconds else 0.0,
+            "shards": sorted(shard_stats, key=lambda s: s["shard"])
+        }
+
+    def _collect(self, processes, results):
+        """Waits for every shard's stats. A shard that exits without reporting them (crash, OOM kill)
+        is returned in the failed list with its exit code instead of blocking the run forever."""
+        stats = {}
+        failed = []
+        while len(stats) + len(failed) < len(processes):
+            try:
+                shard = results.get(timeout=SHARD_POLL_SECONDS)
+                stats[shard["shard"]] = shard
+                continue
+            except queue.Empty:
+                pass
+            exited = [shard_id for shard_id, process in processes.items()
+                      if process.exitcode is not None and shard_id not in stats
+                      and shard_id not in (f["shard"] for f in failed)]
+            # A shard that exited cleanly has already flushed its stats into the queue
+            while exited:
+                try:
+                    shard = results.get(timeout=SHARD_POLL_SECONDS)
+                except queue.Empty:
+                    break
+                stats[shard["shard"]] = shard
+                exited = [shard_id for shard_id in exited if shard_id != shard["shard"]]
+            for shard_id in exited:
+                failed.append({"shard": shard_id, "exitcode": processes[shard_id].exitcode,
+                               "patients": len(self.shards()[shard_id])})
+        return list(stats.values()), failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless fleet monitoring engine")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--ticks", type=int, default=60)
+    parser.add_argument("--abnormal", type=float, default=0,
+                        help="Patients with a simulated abnormality: a count, or a fraction of --patients below 1")
+    parser.add_argument("--analyze", action="store_true", help="Call MedicalAgent for abnormal patients")
+    parser.add_argument("--notify", action="store_true", help="Send WhatsApp reports after analyses")
+    parser.add_argument("--realtime", action="store_true", help="Pace ticks at 1 Hz instead of running flat out")
+    parser.add_argument("--store", metavar="PATH", help="Persist every reading to a VitalsStore at PATH")
+    parser.add_argument("--profiles", metavar="PATH", help="Threshold profiles JSON (default THRESHOLD_PROFILES_PATH)")
+    args = parser.parse_args()
+
+    engine = FleetEngine(args.patients, workers=args.workers, analyze=args.analyze,
+                         notify=args.notify, realtime=args.realtime, store_path=args.store,
+                         profiles_path=args.profiles)
+    engine.spread_abnormal(round(args.abnormal * args.patients) if args.abnormal < 1 else int(args.abnormal))
+    stats = engine.run(args.ticks)
+    print(f"{stats['readings']} readings from {stats['patients']} patients on {stats['workers']} workers "
+          f"in {stats['seconds']:.2f}s: {stats['readings_per_second']:.0f} readings/s")
+    print(f"{stats['incidents']} incidents, {stats['escalations']} escalations, "
+          f"{stats['suppressed_analyses']} repeat analyses suppressed")
+    print(f"{stats['analyses']} analyses, {stats['local_analyses']} answered by local triage, "
+          f"{stats['analysis_errors']} failed, {stats['notifications']} reports sent")
+    for shard in stats["failed_shards"]:
+        print(f"  shard {shard['shard']} FAILED (exit code {shard['exitcode']}): "
+              f"{shard['patients']} patients have no results")
+    for shard in stats["shards"]:
+        rate = shard["readings"] / shard["seconds"] if shard["seconds"] else 0.0
+        print(f"  shard {shard['shard']}: {shard['patients']} patients, {rate:.0f} readings/s")
+    if stats["failed_shards"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
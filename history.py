@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+
+from env import load_env
+
+load_env()
+
+DEFAULT_HISTORY_SIZE = int(os.getenv("VITALS_HISTORY_SIZE", "50"))
+
+HISTORY_DTYPES = {
+    "timestamp": object,
+    "heart_rate": np.int16,
+    "spo2": np.int16,
+    "sys_bp": np.int16,
+    "dia_bp": np.int16,
+    "temperature": np.float64
+}
+
+
+class VitalsHistory:
+    """Fixed-size ring buffer of vitals readings with one typed column per vital.
+
+    Every value is written twice, at slot i and i + size, so the last n readings are always
+    one contiguous slice and window views never copy."""
+
+    def __init__(self, size=None):
+        self.size = size or DEFAULT_HISTORY_SIZE
+        self._columns = {key: np.zeros(2 * self.size, dtype=dtype) for key, dtype in HISTORY_DTYPES.items()}
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, vitals):
+        i = self._next
+        j = i + self.size
+        for key, column in self._columns.items():
+            column[i] = column[j] = vitals[key]
+        self._next = (i + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def _bounds(self, n):
+        n = self._count if n is None else min(n, self._count)
+        end = self._next + self.size if self._count == self.size else self._next
+        return end - n, end
+
+    def column(self, key, n=None):
+        """Read-only view of the last n values of one column, oldest first."""
+        start, end = self._bounds(n)
+        view = self._columns[key][start:end]
+        view.flags.writeable = False
+        return view
+
+    def window(self, n=None, keys=None):
+        """Dict of read-only views over the last n readings."""
+        return {key: self.column(key, n) for key in (keys or self._columns)}
+
+    def latest(self):
+        """Most recent reading as a plain dict, shaped like VitalsSimulator.generate_vitals output."""
+        if not self._count:
+            return None
+        i = (self._next - 1) % self.size
+        return {key: column[i].item() if key != "timestamp" else column[i] for key, column in self._columns.items()}
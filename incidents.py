@@ -0,0 +1,178 @@
+import itertools
+import os
+import threading
+from collections import deque
+
+from env import load_env
+from monitor import VITAL_KEYS
+
+load_env()
+
+INCIDENT_ESCALATION_INTERVAL = float(os.getenv("INCIDENT_ESCALATION_INTERVAL", "10"))  # seconds between escalations
+INCIDENT_QUIET_PERIOD = float(os.getenv("INCIDENT_QUIET_PERIOD", "60"))  # seconds of normal vitals before closing
+INCIDENT_MAX_READINGS = int(os.getenv("INCIDENT_MAX_READINGS", "3600"))  # readings kept per incident
+INCIDENT_HISTORY = int(os.getenv("INCIDENT_HISTORY", "100"))  # closed incidents kept per manager
+
+SEVERITY_LEVELS = ("normal", "mild", "moderate", "severe")
+
+# How far past the range one severity step is; e.g. SpO2 3 points below range is moderate, 6 is severe
+SEVERITY_STEPS = {
+    "heart_rate": 20,
+    "spo2": 3,
+    "sys_bp": 20,
+    "dia_bp": 10,
+    "temperature": 1.0
+}
+
+
+def severity(values, thresholds):
+    """Severity level (index into SEVERITY_LEVELS) of the breaching vitals in values.
+    values: {vital: value} for the vitals currently breaching, ideally smoothed; thresholds: {vital: (low, high)}."""
+    level = 0
+    for key, value in values.items():
+        low, high = thresholds[key]
+        excess = max(low - value, value - high, 0)
+        level = max(level, min(len(SEVERITY_LEVELS) - 1, 1 + int(excess // SEVERITY_STEPS[key])))
+    return level
+
+
+class Incident:
+    """One abnormal episode of one patient, from the first sustained breach until a quiet period has passed."""
+
+    def __init__(self, incident_id, patient_id, opened_at):
+        self.id = incident_id
+        self.patient_id = patient_id
+        self.opened_at = opened_at
+        self.closed_at = None
+        self.last_abnormal = opened_at
+        self.readings = deque(maxlen=INCIDENT_MAX_READINGS)
+        self.vitals = set()  # every vital that breached during the incident
+        self.breaching = set()
+        self.severity = 0
+        self.peak_severity = 0
+        self.escalations = 0
+        self.escalated_severity = 0
+        self.escalated_vitals = set()
+        self.last_escalation = None
+        self.reason = None
+        self.suppressed_analyses = 0
+        self.suppressed_notifications = 0
+        self._last_due = opened_at
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "patient_id": self.patient_id,
+            "opened_at": self.opened_at,
+            "closed_at": self.closed_at,
+            "readings": len(self.readings),
+            "vitals": sorted(self.vitals, key=VITAL_KEYS.index),
+            "severity": SEVERITY_LEVELS[self.severity],
+            "peak_severity": SEVERITY_LEVELS[self.peak_severity],
+            "escalations": self.escalations,
+            "suppressed_analyses": self.suppressed_analyses,
+            "suppressed_notifications": self.suppressed_notifications
+        }
+
+
+class IncidentManager:
+    """Coalesces abnormal readings into one incident per episode and decides when to escalate.
+
+    An incident escalates (LLM analysis, then a doctor notification if enabled) once after it has lasted
+    `interval` seconds, and after that only when severity rises above what was last escalated or a new
+    vital starts breaching, at most once per `interval`. Each `interval` without an escalation is counted
+    as a suppressed analysis (and notification), i.e. what the old fixed 10 s timer would have sent."""
+
+    def __init__(self, interval=None, quiet_period=None):
+        self.interval = INCIDENT_ESCALATION_INTERVAL if interval is None else interval
+        self.quiet_period = INCIDENT_QUIET_PERIOD if quiet_period is None else quiet_period
+        self.open = {}  # patient_id -> Incident
+        self.closed = deque(maxlen=INCIDENT_HISTORY)
+        self.opened = 0
+        self.escalations = 0
+        self.suppressed_analyses = 0
+        self.suppressed_notifications = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def observe(self, patient_id, now, abnormal, vitals, breaching=(), level=0, notify=False):
+        """Feeds one reading. Returns the escalation reason, or None when nothing should be sent.
+
+        abnormal: episode state from the detector; breaching: vitals with a sustained breach;
+        level: severity() of those vitals; notify: whether an escalation would also text the doctor.
+        Call escalated() once the analysis has actually been started."""
+        with self._lock:
+            incident = self.open.get(patient_id)
+            if incident is None:
+                if not abnormal:
+                    return None
+                incident = self.open[patient_id] = Incident(next(self._ids), patient_id, now)
+                self.opened += 1
+
+            incident.readings.append(vitals)
+            if not abnormal:
+                if now - incident.last_abnormal >= self.quiet_period:
+                    self._close(incident, now)
+                return None
+
+            incident.last_abnormal = now
+            incident.breaching = set(breaching)
+            incident.vitals.update(breaching)
+            incident.severity = level
+            incident.peak_severity = max(incident.peak_severity, level)
+
+            reason = None
+            since = now - (incident.opened_at if incident.last_escalation is None else incident.last_escalation)
+            if since > self.interval:
+                reason = self._reason(incident)
+            if now - incident._last_due > self.interval:
+                incident._last_due = now
+                if reason is None:
+                    incident.suppressed_analyses += 1
+                    self.suppressed_analyses += 1
+                    if notify:
+                        incident.suppressed_notifications += 1
+                        self.suppressed_notifications += 1
+            incident.reason = reason
+            return reason
+
+    @staticmethod
+    def _reason(incident):
+        if not incident.escalations:
+            return "opened"
+        if incident.severity > incident.escalated_severity:
+            return f"severity rose to {SEVERITY_LEVELS[incident.severity]}"
+        new = incident.breaching - incident.escalated_vitals
+        if new:
+            return f"new breach: {', '.join(sorted(new, key=VITAL_KEYS.index))}"
+        return None
+
+    def escalated(self, patient_id, now):
+        """Records that the escalation returned by observe() went out."""
+        with self._lock:
+            incident = self.open.get(patient_id)
+            if incident is None:
+                return
+            incident.escalations += 1
+            incident.escalated_severity = max(incident.escalated_severity, incident.severity)
+            incident.escalated_vitals |= incident.breaching
+            incident.last_escalation = now
+            incident._last_due = now
+            self.escalations += 1
+
+    def _close(self, incident, now):
+        incident.closed_at = now
+        del self.open[incident.patient_id]
+        self.closed.append(incident)
+
+    def current(self, patient_id):
+        return self.open.get(patient_id)
+
+    def stats(self):
+        return {
+            "open": len(self.open),
+            "opened": self.opened,
+            "escalations": self.escalations,
+            "suppressed_analyses": self.suppressed_analyses,
+            "suppressed_notifications": self.suppressed_notifications
+        }
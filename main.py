@@ -1,47 +1,40 @@
-import streamlit as st
 import time
-import pandas as pd
-from simulator import VitalsSimulator
-from monitor import VitalsMonitor
-from agent import MedicalAgent
-from notifier import WhatsAppNotifier
+
+# Taken before the app imports so a cold worker's first render includes them
+SCRIPT_STARTED = time.perf_counter()
+
+import streamlit as st
+from core import MonitoringCore, report_message
+from store import VitalsStore
+import metrics
 import os
-from dotenv import load_dotenv
+from env import load_env
 
-load_dotenv()
+load_env()
+
+PATIENT_ID = os.getenv("PATIENT_ID", "patient-1")
 
 # Page Config
 st.set_page_config(page_title="Vitalia - AI Health Monitor", page_icon="❤️", layout="wide")
 
-# Initialize Session State
-if 'simulator' not in st.session_state:
-    st.session_state.simulator = VitalsSimulator()
-if 'monitor' not in st.session_state:
-    st.session_state.monitor = VitalsMonitor()
-if 'agent' not in st.session_state:
-    st.session_state.agent = MedicalAgent()
-if 'notifier' not in st.session_state:
-    st.session_state.notifier = WhatsAppNotifier()
-if 'vitals_history' not in st.session_state:
-    st.session_state.vitals_history = []
-if 'monitoring' not in st.session_state:
-    st.session_state.monitoring = False
-if 'abnormal_detected' not in st.session_state:
-    st.session_state.abnormal_detected = False
-if 'abnormal_start_time' not in st.session_state:
-    st.session_state.abnormal_start_time = None
-if 'ai_result' not in st.session_state:
-    st.session_state.ai_result = None
-
-# Simulation State
-if 'sim_hr' not in st.session_state:
-    st.session_state.sim_hr = False
-if 'sim_spo2' not in st.session_state:
-    st.session_state.sim_spo2 = False
-if 'sim_bp' not in st.session_state:
-    st.session_state.sim_bp = False
-if 'sim_temp' not in st.session_state:
-    st.session_state.sim_temp = False
+
+@st.cache_resource
+def get_monitoring_core():
+    # One core per server process: every browser session views the same producers
+    return MonitoringCore(store=VitalsStore())
+
+
+patient = get_monitoring_core().patient(PATIENT_ID)
+
+
+def set_flag(flag, key):
+    # Only write on change, so one viewer's rerun never overrides another viewer's toggle
+    patient.abnormal_flags[flag] = st.session_state[key]
+
+
+def set_auto_send():
+    patient.auto_send = st.session_state.auto_send
+
 
 # Sidebar
 st.sidebar.title("Vitalia Controls")
@@ -56,13 +49,13 @@ if doctor_phone:
 else:
     st.sidebar.error("No Number Configured")
 
-auto_send = st.sidebar.checkbox("Auto-send Reports", value=False,
-                                help="Automatically send report to doctor when abnormality is detected")
+st.sidebar.checkbox("Auto-send Reports", value=patient.auto_send, key="auto_send", on_change=set_auto_send,
+                    help="Automatically send report to doctor when abnormality is detected")
 
 if start_btn:
-    st.session_state.monitoring = True
+    patient.start()
 if stop_btn:
-    st.session_state.monitoring = False
+    patient.stop()
 
 # Custom CSS for Vitals Cards
 st.markdown("""
@@ -109,157 +102,166 @@ st.title("Vitalia")
 col1, col2 = st.columns([2, 1])
 
 
-@st.fragment(run_every=1)
-def run_vitals_monitor():
-    if st.session_state.monitoring:
-        # Generate Vitals
-        abnormal_flags = {
-            'hr': st.session_state.sim_hr,
-            'spo2': st.session_state.sim_spo2,
-            'bp': st.session_state.sim_bp,
-            'temp': st.session_state.sim_temp
-        }
-        vitals = st.session_state.simulator.generate_vitals(abnormal_flags=abnormal_flags)
-        st.session_state.vitals_history.append(vitals)
-
-        # Keep history manageable
-        if len(st.session_state.vitals_history) > 50:
-            st.session_state.vitals_history.pop(0)
-
-        # Monitor Check
-        analysis = st.session_state.monitor.check_vitals(vitals)
-        details = analysis.get("details", {})  # Get per-vital status
-
-        if analysis["status"] == "ABNORMAL":
-            st.error(f"⚠️ ABNORMAL DETECTED: {', '.join(analysis['abnormalities'])}")
-            st.session_state.abnormal_detected = True
-
-            # Auto-Analysis Logic
-            if st.session_state.abnormal_start_time is None:
-                st.session_state.abnormal_start_time = time.time()
-                # Initialize last run time to start time so we wait 10s first
-                st.session_state.last_auto_analysis_time = st.session_state.abnormal_start_time
-
-            # Check if 10 seconds have passed since the last analysis (or start)
-            if time.time() - st.session_state.last_auto_analysis_time > 10:
-                patient_advice, doctor_report, emergency = st.session_state.agent.analyze(vitals,
-                                                                                          "Auto-detected abnormality. Patient has not provided symptoms yet.")
-                st.session_state.ai_result = {
-                    "patient": patient_advice,
-                    "doctor": doctor_report,
-                    "emergency": emergency
-                }
-
-                # Auto-send logic
-                if auto_send and doctor_phone:
-                    msg_body = f"{doctor_report}\n\nNo-reply: This is from vAItal"
-                    st.session_state.notifier.send_whatsapp_message(msg_body, doctor_phone)
-
-                # Update last run time to NOW to reset the 10s timer
-                st.session_state.last_auto_analysis_time = time.time()
+# (detail key, label, unit, simulate flag, charted vitals, chart color)
+CARDS = (
+    ("heart_rate", "Heart Rate", "bpm", "hr", ("heart_rate",), "#FF4B4B"),
+    ("spo2", "SpO2", "%", "spo2", ("spo2",), "#00CC96"),
+    ("bp", "Blood Pressure", "mmHg", "bp", ("sys_bp", "dia_bp"), None),
+    ("temperature", "Temperature", "°C", "temp", ("temperature",), "#FFA15A")
+)
 
-        else:
-            st.success("Status: Normal")
-            st.session_state.abnormal_detected = False
-            st.session_state.abnormal_start_time = None
-            st.session_state.auto_analysis_done = False
-
-        # Display Vitals with Custom Cards and Graphs
-        df = pd.DataFrame(st.session_state.vitals_history)
-
-        # Helper to get class based on status
-        def get_status_class(vital_key):
-            return "vital-abnormal" if details.get(vital_key) == "ABNORMAL" else "vital-normal"
-
-        # Row 1
-        r1_c1, r1_c2 = st.columns(2)
-
-        with r1_c1:
-            with st.container(border=True):
-                st.markdown(f"""
-                <div class="vital-card">
-                    <div class="vital-label">Heart Rate</div>
-                    <div class="vital-value {get_status_class('heart_rate')}">{vitals['heart_rate']}</div>
-                    <div class="vital-unit">bpm</div>
-                </div>
-                """, unsafe_allow_html=True)
-                st.line_chart(df["heart_rate"], height=150, color="#FF4B4B")
-                st.session_state.sim_hr = st.checkbox("Simulate", key="chk_hr", value=st.session_state.sim_hr, label_visibility="collapsed")
-
-        with r1_c2:
-            with st.container(border=True):
-                st.markdown(f"""
-                <div class="vital-card">
-                    <div class="vital-label">SpO2</div>
-                    <div class="vital-value {get_status_class('spo2')}">{vitals['spo2']}</div>
-                    <div class="vital-unit">%</div>
-                </div>
-                """, unsafe_allow_html=True)
-                st.line_chart(df["spo2"], height=150, color="#00CC96")
-                st.session_state.sim_spo2 = st.checkbox("Simulate", key="chk_spo2", value=st.session_state.sim_spo2, label_visibility="collapsed")
-
-        # Row 2
-        r2_c1, r2_c2 = st.columns(2)
-
-        with r2_c1:
-            with st.container(border=True):
-                st.markdown(f"""
-                <div class="vital-card">
-                    <div class="vital-label">Blood Pressure</div>
-                    <div class="vital-value {get_status_class('bp')}">{vitals['sys_bp']}/{vitals['dia_bp']}</div>
-                    <div class="vital-unit">mmHg</div>
-                </div>
-                """, unsafe_allow_html=True)
-                st.line_chart(df[["sys_bp", "dia_bp"]], height=150)
-                st.session_state.sim_bp = st.checkbox("Simulate", key="chk_bp", value=st.session_state.sim_bp, label_visibility="collapsed")
-
-        with r2_c2:
-            with st.container(border=True):
-                st.markdown(f"""
-                <div class="vital-card">
-                    <div class="vital-label">Temperature</div>
-                    <div class="vital-value {get_status_class('temperature')}">{vitals['temperature']}</div>
-                    <div class="vital-unit">°C</div>
-                </div>
-                """, unsafe_allow_html=True)
-                st.line_chart(df["temperature"], height=150, color="#FFA15A")
-                st.session_state.sim_temp = st.checkbox("Simulate", key="chk_temp", value=st.session_state.sim_temp, label_visibility="collapsed")
-    else:
-        st.info("Monitoring Stopped. Press 'Start Monitoring' to begin.")
 
+def simulate_checkbox(flag, key):
+    st.checkbox("Simulate", key=key, value=patient.abnormal_flags[flag], on_change=set_flag, args=(flag, key),
+                label_visibility="collapsed")
 
-@st.fragment(run_every=1)
-def display_ai_results():
-    if st.session_state.ai_result:
-        res = st.session_state.ai_result
 
-        st.markdown("## Advising Patient")
-        st.info(res["patient"])
+def show(view, name, *blocks):
+    """Draws blocks into placeholder `name`.
+    Every fragment run has to draw every placeholder again: Streamlit clears what a run leaves out."""
+    draw_blocks(view["slots"][name].container(), blocks)
 
-        st.markdown("## Reporting Doctor")
-        st.warning(res["doctor"])
 
-        if res["emergency"]:
-            st.error("🚨 EMERGENCY ALERT SENT TO HOSPITAL 🚨")
+def draw_blocks(container, blocks):
+    """Draws blocks of (st method, body) into container."""
+    for method, body in blocks:
+        if method == "html":
+            container.markdown(body, unsafe_allow_html=True)
         else:
-            st.success("Situation Is Stable. Follow advice.")
-
-        if st.button("Send Report to Doctor via WhatsApp"):
-            if doctor_phone:
-                with st.spinner("Sending WhatsApp message..."):
-                    msg_body = f"{res['doctor']}\n\nNo-reply: This is from vAItal"
-                    success, msg = st.session_state.notifier.send_whatsapp_message(msg_body, doctor_phone)
-                    if success:
-                        st.success(msg)
-                    else:
-                        st.error(msg)
-            else:
-                st.warning("Please enter a Doctor's WhatsApp number in the sidebar.")
+            getattr(container, method)(body)
+
+
+def card_html(label, value, unit, abnormal):
+    status_class = "vital-abnormal" if abnormal else "vital-normal"
+    return f"""
+    <div class="vital-card">
+        <div class="vital-label">{label}</div>
+        <div class="vital-value {status_class}">{value}</div>
+        <div class="vital-unit">{unit}</div>
+    </div>
+    """
+
+
+def build_live_view():
+    """Lays out the placeholders refresh_live_view() draws into. Cards, charts and checkboxes only
+    exist while monitoring, so starting or stopping needs a full rerun to rebuild the layout.
+    The AI panel is drawn by the full run alone and stays untouched until its blocks change."""
+    view = {
+        "live": bool(patient.monitoring and patient.snapshot is not None),
+        "ai": ai_blocks(),
+        "slots": {"status": st.empty()}
+    }
+    if view["live"]:
+        view["slots"]["incident"] = st.empty()
+        for row in (CARDS[:2], CARDS[2:]):
+            for column, (key, _, _, flag, _, _) in zip(st.columns(2), row):
+                with column, st.container(border=True):
+                    view["slots"][key] = st.empty()
+                    view["slots"][f"{key}_chart"] = st.empty()
+                    simulate_checkbox(flag, f"chk_{flag}")
+    return view
+
+
+def draw_vitals(view):
+    # Read-only view of the shared producer: no simulation, checks or AI calls happen here
+    snapshot = patient.snapshot
+    error = ("error", f"Monitoring error, retrying every second: {patient.error}") if patient.error else None
+    if not view["live"]:
+        show(view, "status", error or ("info", "Starting monitoring..." if patient.monitoring
+                                       else "Monitoring Stopped. Press 'Start Monitoring' to begin."))
+        return
+
+    vitals = snapshot["vitals"]
+    analysis = snapshot["analysis"]
+    episode = snapshot["episode"]
+    details = analysis.get("details", {})  # Get per-vital status
+
+    if error:
+        show(view, "status", error)
+    elif analysis["status"] == "ABNORMAL":
+        show(view, "status", ("error", f"⚠️ ABNORMAL DETECTED: {', '.join(analysis['abnormalities'])}"))
+    elif episode["status"] == "ABNORMAL":
+        show(view, "status", ("warning", f"Readings back in range, still watching: {', '.join(episode['rules'])}"))
+    else:
+        show(view, "status", ("success", "Status: Normal"))
+
+    incident = snapshot["incident"]
+    if incident is not None:
+        show(view, "incident", ("caption", f"Incident #{incident['id']}: severity {incident['severity']} "
+                                           f"(peak {incident['peak_severity']}), {incident['escalations']} escalated, "
+                                           f"{incident['suppressed_analyses']} repeat analyses and "
+                                           f"{incident['suppressed_notifications']} messages suppressed"))
+    else:
+        show(view, "incident")
+
+    for key, label, unit, _, chart_keys, color in CARDS:
+        value = "/".join(str(vitals[vital]) for vital in chart_keys)
+        show(view, key, ("html", card_html(label, value, unit, details.get(key) == "ABNORMAL")))
+        view["slots"][f"{key}_chart"].line_chart(patient.chart_frame(snapshot, chart_keys), height=150, color=color)
+
+
+def emergency_block(emergency):
+    if emergency:
+        return "error", "🚨 EMERGENCY ALERT SENT TO HOSPITAL 🚨"
+    if emergency is None:
+        return "warning", "Could not determine the emergency status. Please review the vitals."
+    return "success", "Situation Is Stable. Follow advice."
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+def ai_blocks():
+    blocks = []
+    handle = patient.pending_analysis
+    if handle is not None:
+        # The verdict and the advice stream in before the full doctor report is done
+        progress = dict(handle.progress)
+        if "emergency" in progress or "patient_advice" in progress:
+            if "patient_advice" in progress:
+                blocks += [("markdown", "## Advising Patient"), ("info", progress["patient_advice"])]
+            if "emergency" in progress:
+                blocks.append(emergency_block(progress["emergency"]))
+            blocks.append(("caption", "Vitalia is writing the doctor report..."))
+            return tuple(blocks)
+        blocks.append(("caption", "Vitalia is analyzing..."))
+
+    res = patient.ai_result
+    if res:
+        blocks += [("markdown", "## Advising Patient"), ("info", res["patient"]),
+                   ("markdown", "## Reporting Doctor"), ("warning", res["doctor"]),
+                   emergency_block(res["emergency"])]
+
+        usage = patient.agent.last_usage
+        if usage:
+            blocks.append(("caption", f"Last AI request: {usage['prompt_tokens']} prompt / "
+                                      f"{usage['output_tokens']} output tokens"))
+        timings = res.get("timings")
+        if res.get("tier") in ("local", "offline"):
+            source = "offline triage (no AI key)" if res["tier"] == "offline" else "local triage"
+            blocks.append(("caption", f"Answered by {source} in {timings['total'] * 1e6:.0f} µs"))
+        elif timings:
+            blocks.append(("caption", f"First token {format_seconds(timings['first_token'])}, "
+                                      f"verdict {format_seconds(timings['verdict'])}, "
+                                      f"complete {format_seconds(timings['total'])}"))
+    return tuple(blocks)
+
+
+@st.fragment(run_every=1)
+@metrics.timed("render_vitals", budget=1.0)  # longer than the refresh period counts as an overrun
+@metrics.profiled  # stack samples at /profile when METRICS_PROFILE=1
+def refresh_live_view(view):
+    # Redraws the placeholders only; the layout and the AI panel are left alone
+    if (view["live"] != bool(patient.monitoring and patient.snapshot is not None)
+            or view["ai"] != ai_blocks()):
+        st.rerun()
+    draw_vitals(view)
 
 
 with col1:
     st.subheader("Monitoring Live Vitals")
-    run_vitals_monitor()
+    live_view = build_live_view()
 
 with col2:
     st.subheader("Vitalia Support")
@@ -269,23 +271,28 @@ with col2:
         submit_symptoms = st.form_submit_button("Analyze")
 
         if submit_symptoms:
-            if not st.session_state.monitoring:
+            if not patient.monitoring:
                 st.warning("Please start monitoring first.")
-            elif not st.session_state.vitals_history:
+            elif patient.snapshot is None:
                 st.warning("No vitals data yet.")
+            elif not patient.request_analysis(symptoms):
+                st.warning("Vitalia is still working on the previous analysis. Please try again shortly.")
             else:
-                # Use the latest vitals
-                latest_vitals = st.session_state.vitals_history[-1]
-
-                with st.spinner("Vitalia is analyzing..."):
-                    patient_advice, doctor_report, emergency = st.session_state.agent.analyze(latest_vitals, symptoms)
+                st.info("Vitalia is analyzing...")
+
+    with metrics.timer("render_ai"):
+        draw_blocks(st.container(), live_view["ai"])
+    if patient.ai_result and st.button("Send Report to Doctor via WhatsApp"):
+        success, msg = patient.send_report(report_message(patient.ai_result['doctor']))
+        if success:
+            st.success(msg)
+        else:
+            st.error(msg)
 
-                    st.session_state.ai_result = {
-                        "patient": patient_advice,
-                        "doctor": doctor_report,
-                        "emergency": emergency
-                    }
-                    st.session_state.auto_analysis_done = True  # Mark as done so auto doesn't overwrite immediately
-                    st.rerun()
+refresh_live_view(live_view)
 
-    display_ai_results()
+# Startup timing: how long a new viewer waited for the first complete page
+if "first_render_seconds" not in st.session_state:
+    st.session_state.first_render_seconds = time.perf_counter() - SCRIPT_STARTED
+    print(f"First render for new session in {st.session_state.first_render_seconds:.3f}s")
+st.sidebar.caption(f"First render: {st.session_state.first_render_seconds:.2f}s")
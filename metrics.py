@@ -0,0 +1,310 @@
+import bisect
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounts
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from env import load_env
+
+load_env()
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "9108")  # empty = no HTTP endpoint
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "") == "1"  # sample stacks of profiled code paths
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # seconds between profiler samples
+
+# Seconds; covers a ~100 us vitals check up to a slow LLM call
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """A named metric with optional labels; labels(...) returns the child that holds the values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_label_text(self.labelnames, values)} {child.value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        names = self.labelnames + ("le",)
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f"{self.name}_bucket{_label_text(names, values + (le,))} {cumulative}")
+        labels = _label_text(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram("vitalia_stage_seconds", "Latency of each pipeline stage", ("stage",))
+LLM_CALLS = REGISTRY.counter("vitalia_llm_calls_total", "Requests sent to the LLM", ("result",))
+LLM_TOKENS = REGISTRY.counter("vitalia_llm_tokens_total", "LLM tokens used", ("kind",))
+ANALYSIS_CACHE = REGISTRY.counter("vitalia_analysis_cache_total", "Analysis cache lookups", ("result",))
+TRIAGE_DECISIONS = REGISTRY.counter("vitalia_triage_total", "Analyses answered by each tier", ("tier",))
+NOTIFICATIONS = REGISTRY.counter("vitalia_notifications_total", "WhatsApp delivery attempts", ("result",))
+TICK_OVERRUNS = REGISTRY.counter("vitalia_tick_overruns_total", "Loop iterations that took longer than their period",
+                                 ("loop",))
+TICK_ERRORS = REGISTRY.counter("vitalia_tick_errors_total", "Loop iterations that raised an exception", ("loop",))
+
+
+@contextmanager
+def timer(stage):
+    """Records the duration of the with-block under vitalia_stage_seconds{stage=...}."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed(stage, budget=None):
+    """Decorator version of timer(). With a budget (seconds), runs longer than it count as overruns of `stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                STAGE_SECONDS.labels(stage).observe(elapsed)
+                if budget is not None and elapsed > budget:
+                    TICK_OVERRUNS.labels(stage).inc()
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """Low-overhead statistical profiler for chosen code paths.
+
+    A daemon thread samples the stacks of threads currently inside profile() every `interval`
+    seconds and counts them in collapsed-stack format (one "a;b;c count" line per stack),
+    ready for flamegraph.pl or speedscope."""
+
+    def __init__(self, interval=None):
+        self.interval = interval or PROFILE_INTERVAL
+        self.samples = StackCounts()
+        self._targets = {}  # thread id -> nesting depth
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                targets = list(self._targets)
+            if not targets:
+                continue
+            frames = sys._current_frames()
+            for thread_id in targets:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    with self._lock:
+                        self.samples[";".join(reversed(stack))] += 1
+
+    @contextmanager
+    def profile(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._targets[thread_id] = self._targets.get(thread_id, 0) + 1
+            self._start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._targets[thread_id] -= 1
+                if not self._targets[thread_id]:
+                    del self._targets[thread_id]
+
+    def collapsed(self):
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+PROFILER = SamplingProfiler() if METRICS_PROFILE else None
+
+
+def profile():
+    """Context manager sampling the block when METRICS_PROFILE=1, otherwise a no-op."""
+    return PROFILER.profile() if PROFILER is not None else nullcontext()
+
+
+def profiled(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profile():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = REGISTRY.render().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/profile" and PROFILER is not None:
+            body = PROFILER.collapsed().encode()
+            content_type = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(port=None, host=None):
+    """Serves /metrics (and /profile when profiling) on a background thread, once per process.
+    Returns the server, or None when disabled or the port is taken."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    if port in ("", None):
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host or METRICS_HOST, int(port)), MetricsHandler)
+            except OSError as e:
+                print(f"Metrics endpoint not started on port {port}: {e}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+            print(f"Metrics on http://{_server.server_address[0]}:{_server.server_address[1]}/metrics")
+        return _server
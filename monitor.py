@@ -1,59 +1,142 @@
-class VitalsMonitor:
-    def __init__(self):
-        self.thresholds = {
-            "heart_rate": (60, 100),
-            "spo2": (95, 100),
-            "sys_bp": (90, 140),  # Simplified
-            "dia_bp": (60, 90),  # Simplified
-            "temperature": (36.1, 37.5)
+import numpy as np
+
+VITAL_KEYS = ("heart_rate", "spo2", "sys_bp", "dia_bp", "temperature")
+
+# Per-vital status keys reported in "details"; BP is one card backed by two vitals
+DETAIL_KEYS = {
+    "heart_rate": ("heart_rate",),
+    "spo2": ("spo2",),
+    "bp": ("sys_bp", "dia_bp"),
+    "temperature": ("temperature",)
+}
+
+# Adult resting ranges, used for any patient without a profile (see profiles.py)
+DEFAULT_THRESHOLDS = {
+    "heart_rate": (60, 100),
+    "spo2": (95, 100),
+    "sys_bp": (90, 140),  # Simplified
+    "dia_bp": (60, 90),  # Simplified
+    "temperature": (36.1, 37.5)
+}
+
+# (label, value format) used when describing a breach
+ABNORMALITY_FORMATS = {
+    "heart_rate": ("Heart Rate", "{} bpm"),
+    "spo2": ("SpO2", "{}%"),
+    "sys_bp": ("Systolic BP", "{} mmHg"),
+    "dia_bp": ("Diastolic BP", "{} mmHg"),
+    "temperature": ("Temperature", "{}°C")
+}
+
+
+def describe_abnormality(key, value, low, high):
+    """The text check_vitals() and BatchResult both report for one out-of-range vital."""
+    label, unit = ABNORMALITY_FORMATS[key]
+    return f"{label}: {unit.format(value)} (Normal: {low:g}-{high:g})"
+
+
+class BatchResult:
+    """Result of a vectorized check over many readings.
+
+    Masks are computed eagerly; abnormality strings are only built on request for a row."""
+
+    def __init__(self, columns, masks, thresholds):
+        self.columns = columns
+        self.masks = masks
+        self.thresholds = thresholds
+        self.abnormal = np.zeros(np.shape(next(iter(masks.values()))), dtype=bool)
+        for mask in masks.values():
+            self.abnormal |= mask
+        self._details = None
+
+    def __len__(self):
+        return len(self.abnormal)
+
+    @property
+    def status(self):
+        return np.where(self.abnormal, "ABNORMAL", "NORMAL")
+
+    @property
+    def details(self):
+        """Per-card abnormal masks keyed like check_vitals()["details"]."""
+        if self._details is not None:
+            return self._details
+        details = {}
+        for detail_key, vital_keys in DETAIL_KEYS.items():
+            mask = self.masks[vital_keys[0]]
+            for key in vital_keys[1:]:
+                mask = mask | self.masks[key]
+            details[detail_key] = mask
+        self._details = details
+        return details
+
+    def abnormal_rows(self):
+        return np.flatnonzero(self.abnormal)
+
+    def abnormalities(self, i, values=None):
+        """Builds the abnormality strings for row i. values overrides the row's raw values for formatting."""
+        abnormalities = []
+        for key in VITAL_KEYS:
+            if self.masks[key][i]:
+                value = values[key] if values is not None else self.columns[key][i].item()
+                low, high = self.thresholds[key]
+                if np.ndim(low):
+                    # Per-patient ThresholdTable
+                    low, high = low[i], high[i]
+                abnormalities.append(describe_abnormality(key, value, low, high))
+        return abnormalities
+
+    def row(self, i, values=None):
+        """Returns row i in the same shape as check_vitals()."""
+        details = {key: "ABNORMAL" if mask[i] else "NORMAL" for key, mask in self.details.items()}
+        abnormalities = self.abnormalities(i, values) if self.abnormal[i] else []
+        return {
+            "status": "ABNORMAL" if self.abnormal[i] else "NORMAL",
+            "abnormalities": abnormalities,
+            "details": details
         }
 
+
+class VitalsMonitor:
+    def __init__(self, thresholds=None):
+        # {vital: (low, high)} for one patient, or a profiles.ThresholdTable with one row per patient
+        self.thresholds = thresholds if thresholds is not None else dict(DEFAULT_THRESHOLDS)
+
+    def check_vitals_batch(self, columns):
+        """Checks many readings at once.
+        columns: mapping (dict of arrays or DataFrame) with one column per vital in VITAL_KEYS.
+        With a ThresholdTable, row i is checked against the table's row i; 2-D (time, patient)
+        columns work too, with the table broadcast along the last axis."""
+        arrays = {key: np.asarray(columns[key]) for key in VITAL_KEYS}
+        masks = {}
+        for key in VITAL_KEYS:
+            low, high = self.thresholds[key]
+            values = arrays[key]
+            masks[key] = ~((values >= low) & (values <= high))
+        return BatchResult(arrays, masks, self.thresholds)
+
     def check_vitals(self, vitals):
         """Checks vitals against thresholds. Returns status, analysis, and per-vital details."""
-        status = "NORMAL"
+        if not isinstance(self.thresholds, dict):
+            # ThresholdTable: broadcast the reading over the table like a batch
+            result = self.check_vitals_batch({key: [vitals[key]] for key in VITAL_KEYS})
+            return result.row(0, values=vitals)
+
+        # One reading is cheapest in plain Python; numpy only pays off for batches
+        thresholds = self.thresholds
         abnormalities = []
         details = {}
-
-        # Check Heart Rate
-        if not (self.thresholds["heart_rate"][0] <= vitals["heart_rate"] <= self.thresholds["heart_rate"][1]):
-            abnormalities.append(f"Heart Rate: {vitals['heart_rate']} bpm (Normal: 60-100)")
-            details["heart_rate"] = "ABNORMAL"
-        else:
-            details["heart_rate"] = "NORMAL"
-
-        # Check SpO2
-        if not (self.thresholds["spo2"][0] <= vitals["spo2"] <= self.thresholds["spo2"][1]):
-            abnormalities.append(f"SpO2: {vitals['spo2']}% (Normal: 95-100)")
-            details["spo2"] = "ABNORMAL"
-        else:
-            details["spo2"] = "NORMAL"
-
-        # Check BP (Check both sys and dia)
-        sys_abnormal = not (self.thresholds["sys_bp"][0] <= vitals["sys_bp"] <= self.thresholds["sys_bp"][1])
-        dia_abnormal = not (self.thresholds["dia_bp"][0] <= vitals["dia_bp"] <= self.thresholds["dia_bp"][1])
-
-        if sys_abnormal:
-            abnormalities.append(f"Systolic BP: {vitals['sys_bp']} mmHg (Normal: 90-140)")
-        if dia_abnormal:
-            abnormalities.append(f"Diastolic BP: {vitals['dia_bp']} mmHg (Normal: 60-90)")
-
-        if sys_abnormal or dia_abnormal:
-            details["bp"] = "ABNORMAL"
-        else:
-            details["bp"] = "NORMAL"
-
-        # Check Temperature
-        if not (self.thresholds["temperature"][0] <= vitals["temperature"] <= self.thresholds["temperature"][1]):
-            abnormalities.append(f"Temperature: {vitals['temperature']}°C (Normal: 36.1-37.5)")
-            details["temperature"] = "ABNORMAL"
-        else:
-            details["temperature"] = "NORMAL"
-
-        if abnormalities:
-            status = "ABNORMAL"
-
+        for detail_key, vital_keys in DETAIL_KEYS.items():
+            status = "NORMAL"
+            for key in vital_keys:
+                low, high = thresholds[key]
+                value = vitals[key]
+                if not low <= value <= high:
+                    status = "ABNORMAL"
+                    abnormalities.append(describe_abnormality(key, value, low, high))
+            details[detail_key] = status
         return {
-            "status": status,
+            "status": "ABNORMAL" if abnormalities else "NORMAL",
             "abnormalities": abnormalities,
             "details": details
         }
@@ -1,26 +1,260 @@
+import heapq
+import itertools
 import os
-from twilio.rest import Client
-from dotenv import load_dotenv
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+import metrics
+from env import load_env
 
-load_dotenv()
+load_env()
+
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+NOTIFY_BACKOFF = float(os.getenv("NOTIFY_BACKOFF", "2"))  # seconds, doubled on each retry
+NOTIFY_RECIPIENT_INTERVAL = float(os.getenv("NOTIFY_RECIPIENT_INTERVAL", "5"))  # min seconds between messages to one number
+# Kept with the app's other data, next to the vitals store; empty = memory only
+NOTIFY_OUTBOX_PATH = os.getenv("NOTIFY_OUTBOX_PATH", os.path.join(os.getenv("VITALS_STORE_PATH", "vitals_data"),
+                                                                  "outbox.db"))
+TWILIO_BASE_URL = os.getenv("TWILIO_BASE_URL", "")  # e.g. a local fake_twilio server
+
+
+def outbox_path(name):
+    """Outbox file for one of several processes: vitals_data/outbox.db -> vitals_data/outbox-<name>.db.
+    Each process restores only its own file, so no message is delivered by two of them."""
+    if not NOTIFY_OUTBOX_PATH:
+        return ""
+    root, ext = os.path.splitext(NOTIFY_OUTBOX_PATH)
+    return f"{root}-{name}{ext}"
+
+
+class TwilioTransport:
+    """Sends through the official Twilio client (which keeps one pooled HTTP session)."""
+
+    def __init__(self, account_sid, auth_token):
+        from twilio.rest import Client  # slow import, only paid when the first message goes out
+
+        self.client = Client(account_sid, auth_token)
+
+    def send(self, body, from_, to):
+        return self.client.messages.create(body=body, from_=from_, to=to).sid
+
+
+class HttpTransport:
+    """Posts to a Twilio-compatible Messages endpoint over a pooled requests session."""
+
+    def __init__(self, base_url, account_sid, auth_token, pool_size=None, timeout=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token)
+        pool_size = pool_size or NOTIFY_WORKERS
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def send(self, body, from_, to):
+        response = self.session.post(self.url, data={"Body": body, "From": from_, "To": to}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["sid"]
+
+
+class LazyTransport:
+    """Builds the real transport on the first send, which happens on a queue worker thread."""
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def send(self, body, from_, to):
+        transport = self.factory()
+        if transport is None:
+            raise RuntimeError("Twilio client not initialized. Check credentials.")
+        return transport.send(body, from_, to)
+
+
+class NotificationQueue:
+    """Background delivery queue: worker pool, per-recipient rate limit, retry with backoff.
+
+    Undelivered messages are kept in a SQLite outbox and re-queued on restart."""
+
+    def __init__(self, transport, from_number, workers=None, max_retries=None, backoff=None,
+                 recipient_interval=None, path=None):
+        self.transport = transport
+        self.from_number = from_number
+        self.workers = workers or NOTIFY_WORKERS
+        self.max_retries = max_retries if max_retries is not None else NOTIFY_MAX_RETRIES
+        self.backoff = backoff if backoff is not None else NOTIFY_BACKOFF
+        self.recipient_interval = recipient_interval if recipient_interval is not None else NOTIFY_RECIPIENT_INTERVAL
+        self.path = path if path is not None else NOTIFY_OUTBOX_PATH
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "retried": 0}
+        self.latencies = deque(maxlen=10000)  # seconds from enqueue to delivery
+
+        self._heap = []  # (ready_at, seq, message)
+        self._seq = itertools.count()
+        self._next_allowed = {}  # recipient -> earliest time the next message may go out
+        self._active = 0
+        self._cond = threading.Condition()
+        self._db_lock = threading.Lock()
+        self._running = True
+        self._db = None
+        if self.path:
+            self._open()
+        self._threads = [threading.Thread(target=self._worker, name=f"notifier-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS outbox "
+                         "(id TEXT PRIMARY KEY, to_number TEXT, body TEXT, attempts INTEGER, created REAL, status TEXT)")
+        self._db.commit()
+        rows = self._db.execute("SELECT id, to_number, body, attempts, created FROM outbox "
+                                "WHERE status = 'pending' ORDER BY created").fetchall()
+        for message_id, to_number, body, attempts, created in rows:
+            self._push({"id": message_id, "to": to_number, "body": body, "attempts": attempts,
+                        "created": created}, time.time())
+        if rows:
+            print(f"Notifier restored {len(rows)} undelivered messages")
+
+    def _store(self, sql, params):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(sql, params)
+                self._db.commit()
+
+    def _push(self, message, ready_at):
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, next(self._seq), message))
+            self._cond.notify()
+
+    def enqueue(self, body, to_number):
+        """Queues a message and returns its id immediately."""
+        message = {"id": uuid.uuid4().hex, "to": to_number, "body": body, "attempts": 0, "created": time.time()}
+        self._store("INSERT INTO outbox VALUES (?, ?, ?, 0, ?, 'pending')",
+                    (message["id"], to_number, body, message["created"]))
+        with self._cond:
+            self.stats["queued"] += 1
+        self._push(message, time.time())
+        return message["id"]
+
+    def _take(self):
+        with self._cond:
+            while self._running:
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    _, _, message = heapq.heappop(self._heap)
+                    allowed = self._next_allowed.get(message["to"], 0)
+                    if allowed > now:
+                        # Rate limited: put it back for when this recipient frees up
+                        heapq.heappush(self._heap, (allowed, next(self._seq), message))
+                        continue
+                    self._next_allowed[message["to"]] = now + self.recipient_interval
+                    self._active += 1
+                    return message
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._cond.wait(timeout)
+            return None
+
+    def _worker(self):
+        while True:
+            message = self._take()
+            if message is None:
+                return
+            outcome = "sent"
+            try:
+                with metrics.timer("send_whatsapp"):
+                    self.transport.send(message["body"], f"whatsapp:{self.from_number}", f"whatsapp:{message['to']}")
+            except Exception as e:
+                message["attempts"] += 1
+                if message["attempts"] > self.max_retries:
+                    print(f"Giving up on message to {message['to']}: {e}")
+                    outcome = "failed"
+                    self._store("UPDATE outbox SET status = 'failed', attempts = ? WHERE id = ?",
+                                (message["attempts"], message["id"]))
+                else:
+                    outcome = "retried"
+                    self._store("UPDATE outbox SET attempts = ? WHERE id = ?", (message["attempts"], message["id"]))
+                    self._push(message, time.time() + self.backoff * 2 ** (message["attempts"] - 1))
+            else:
+                self._store("DELETE FROM outbox WHERE id = ?", (message["id"],))
+            finally:
+                metrics.NOTIFICATIONS.labels(outcome).inc()
+                with self._cond:
+                    self.stats[outcome] += 1
+                    if outcome == "sent":
+                        self.latencies.append(time.time() - message["created"])
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) + self._active
+
+    def flush(self, timeout=None):
+        """Waits until everything queued so far is delivered or given up. Returns True if drained."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._heap or self._active:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+            return True
+
+    def close(self, timeout=5):
+        """Drains for up to timeout seconds, then stops the workers. Leftovers stay in the outbox."""
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
 
 
 class WhatsAppNotifier:
-    def __init__(self):
+    def __init__(self, transport=None, outbox_path=None):
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN")
         self.from_number = os.getenv("TWILIO_FROM_NUMBER")
+        self.queue = None
 
-        if self.account_sid and self.auth_token and self.from_number:
-            try:
-                self.client = Client(self.account_sid, self.auth_token)
-                print("Twilio Client Initialized")
-            except Exception as e:
-                print(f"Error initializing Twilio client: {e}")
-                self.client = None
-        else:
+        # The transport is built on first send, so construction stays instant
+        self._client = transport
+        self._client_failed = False
+        self._lock = threading.Lock()
+        if transport is None and not (self.account_sid and self.auth_token and self.from_number):
             print("Twilio credentials missing in .env")
-            self.client = None
+        else:
+            # Started right away so messages left in the outbox by a previous run go out now,
+            # not whenever the next report happens to be sent
+            self.queue = NotificationQueue(LazyTransport(lambda: self.client), self.from_number, path=outbox_path)
+
+    @property
+    def client(self):
+        if self._client is None and not self._client_failed and self.account_sid and self.auth_token and self.from_number:
+            with self._lock:
+                if self._client is None and not self._client_failed:
+                    try:
+                        if TWILIO_BASE_URL:
+                            self._client = HttpTransport(TWILIO_BASE_URL, self.account_sid, self.auth_token)
+                        else:
+                            self._client = TwilioTransport(self.account_sid, self.auth_token)
+                        print("Twilio Client Initialized")
+                    except Exception as e:
+                        print(f"Error initializing Twilio client: {e}")
+                        self._client_failed = True
+        return self._client
+
+    @client.setter
+    def client(self, transport):
+        self._client = transport
 
     def send_whatsapp_message(self, body, to_number):
         if not self.client:
@@ -31,11 +265,18 @@ class WhatsAppNotifier:
             from_whatsapp = f"whatsapp:{self.from_number}"
             to_whatsapp = f"whatsapp:{to_number}"
 
-            message = self.client.messages.create(
-                body=body,
-                from_=from_whatsapp,
-                to=to_whatsapp
-            )
-            return True, f"Message sent! SID: {message.sid}"
+            with metrics.timer("send_whatsapp"):
+                sid = self.client.send(body, from_whatsapp, to_whatsapp)
+            metrics.NOTIFICATIONS.labels("sent").inc()
+            return True, f"Message sent! SID: {sid}"
         except Exception as e:
+            metrics.NOTIFICATIONS.labels("failed").inc()
             return False, f"Failed to send message: {str(e)}"
+
+    def send_async(self, body, to_number):
+        """Queues the message for background delivery. Returns (queued, status message) without blocking."""
+        # Credentials only: the client itself is built by a queue worker, never on the caller's thread
+        if self.queue is None or self._client_failed:
+            return False, "Twilio client not initialized. Check credentials."
+        self.queue.enqueue(body, to_number)
+        return True, "Report queued for delivery."
@@ -0,0 +1,308 @@
+import argparse
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from env import load_env
+from monitor import VitalsMonitor, VITAL_KEYS
+
+load_env()
+
+PPG_SAMPLE_RATE = float(os.getenv("PPG_SAMPLE_RATE", "100"))  # Hz
+PPG_WINDOW_SECONDS = float(os.getenv("PPG_WINDOW_SECONDS", "8"))  # waveform behind each estimate
+PPG_MIN_SECONDS = float(os.getenv("PPG_MIN_SECONDS", "4"))  # buffered waveform needed for a first estimate
+PPG_MOTION_THRESHOLD = float(os.getenv("PPG_MOTION_THRESHOLD", "0.1"))  # accelerometer std (g) that voids a window
+
+MAX_HEART_RATE = 220  # bpm; sets the minimum spacing between two beats
+SPO2_CALIBRATION = (110.0, 25.0)  # SpO2 = a - b * R, the usual empirical ratio-of-ratios fit
+
+# Vitals a wristband can't measure optically; used until a cuff or thermometer reports via set_vitals()
+DEFAULT_OTHER_VITALS = {"sys_bp": 120, "dia_bp": 80, "temperature": 37.0}
+
+
+def _box(total, width):
+    """Centered moving average along the last axis from cumulative sums (total[..., 0] == 0),
+    one sample shorter than total; windows shrink at the edges."""
+    n = total.shape[-1] - 1
+    width = max(1, min(int(width), n))
+    half = width // 2
+    out = np.empty(total.shape[:-1] + (n,), dtype=total.dtype)
+    # Full windows are two shifted slices; only the edges need per-sample window bounds
+    middle = out[..., half:n - width + half + 1]
+    np.subtract(total[..., width:], total[..., :n - width + 1], out=middle)
+    middle /= width
+    for edge in (np.arange(half), np.arange(n - width + half + 1, n)):
+        lo = np.clip(edge - half, 0, n)
+        hi = np.clip(edge - half + width, 0, n)
+        out[..., edge] = (total[..., hi] - total[..., lo]) / (hi - lo)
+    return out
+
+
+def _running_max(x, half):
+    """Centered running maximum over 2 * half + 1 samples along the last axis, in O(log half) passes."""
+    n = x.shape[-1]
+    width = 2 * half + 1
+    pad = np.full(x.shape[:-1] + (half,), -np.inf, dtype=x.dtype)
+    m = np.concatenate([pad, x, pad], axis=-1)
+    span = 1
+    while span * 2 <= width:
+        # m[j] becomes the max of the next 2 * span samples
+        m = np.maximum(m[..., :-span], m[..., span:])
+        span *= 2
+    if span < width:
+        m = np.maximum(m[..., :m.shape[-1] - (width - span)], m[..., width - span:])
+    return m[..., :n]
+
+
+def bandpass(x, sample_rate):
+    """Pulse band of PPG windows (rows) with their mean already removed: a ~1.5 s moving average takes
+    out baseline and respiration, a ~1/8 s one high-frequency noise."""
+    total = np.zeros(x.shape[:-1] + (x.shape[-1] + 1,), dtype=x.dtype)
+    np.cumsum(x, axis=-1, out=total[..., 1:])
+    return _box(total, sample_rate / 8) - _box(total, sample_rate * 1.5)
+
+
+def heart_rates(pulse, sample_rate, spread=None):
+    """Beats per minute from band-passed windows (rows) by peak detection; NaN where under 3 beats were found.
+
+    A sample is a beat if it is the maximum within the shortest possible beat interval around it and
+    clearly above the window's spread (its std, pass it if already known), so noise ripples and the
+    dicrotic wave don't count. Of a flat top (equal samples, common with integer ADC counts) only the
+    first sample counts."""
+    half = int(sample_rate * 60 / MAX_HEART_RATE / 2)
+    spread = pulse.std(axis=-1) if spread is None else spread
+    threshold = 0.5 * spread[..., None]
+    peaks = (pulse == _running_max(pulse, half)) & (pulse > threshold)
+    peaks[..., 1:] &= pulse[..., 1:] > pulse[..., :-1]
+    count = peaks.sum(axis=-1)
+    n = pulse.shape[-1]
+    first = np.argmax(peaks, axis=-1)
+    last = n - 1 - np.argmax(peaks[..., ::-1], axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = 60.0 * sample_rate * (count - 1) / (last - first)
+    return np.where(count >= 3, rate, np.nan)
+
+
+def spo2_estimates(red_ac, red_dc, ir_ac, ir_dc):
+    """SpO2 (%) from the ratio of ratios R = (AC/DC red) / (AC/DC ir); AC is the pulse band's std, DC the mean."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = (red_ac / red_dc) / (ir_ac / ir_dc)
+    a, b = SPO2_CALIBRATION
+    return np.clip(a - b * ratio, 0.0, 100.0)
+
+
+class PPGIngest:
+    """Raw wristband samples for a cohort of patients, turned into vitals readings.
+
+    Red/infrared PPG and accelerometer magnitude chunks of any length are written into preallocated
+    per-patient ring buffers. Like VitalsHistory every sample is written twice, at slot i and
+    i + capacity, so each patient's window is one contiguous slice. estimate() runs the filtering, peak detection and ratio-of-ratios over
+    the last window of every patient at once, and reading(i)/columns() emit the same vitals the rest
+    of the pipeline consumes. Windows spoiled by motion keep the previous estimate."""
+
+    def __init__(self, n_patients, sample_rate=None, window_seconds=None, motion_threshold=None):
+        self.n = n_patients
+        self.fs = PPG_SAMPLE_RATE if sample_rate is None else float(sample_rate)
+        window_seconds = PPG_WINDOW_SECONDS if window_seconds is None else window_seconds
+        self.motion_threshold = PPG_MOTION_THRESHOLD if motion_threshold is None else motion_threshold
+        self.capacity = int(round(window_seconds * self.fs))
+        self.min_samples = min(self.capacity, int(round(PPG_MIN_SECONDS * self.fs)))
+        self.red = np.zeros((n_patients, 2 * self.capacity), dtype=np.float32)
+        self.ir = np.zeros((n_patients, 2 * self.capacity), dtype=np.float32)
+        self.accel = np.ones((n_patients, 2 * self.capacity), dtype=np.float32)
+        self._next = np.zeros(n_patients, dtype=np.intp)
+        self._count = np.zeros(n_patients, dtype=np.intp)
+
+        self.heart_rate = np.full(n_patients, np.nan)
+        self.spo2 = np.full(n_patients, np.nan)
+        self.fresh = np.zeros(n_patients, dtype=bool)  # last estimate() updated this patient
+        self.other = {key: np.full(n_patients, value, dtype=np.float64)
+                      for key, value in DEFAULT_OTHER_VITALS.items()}
+
+    def push(self, i, red, ir, accel=None):
+        """Appends one patient's chunk of samples (1-D arrays of equal length)."""
+        red = np.asarray(red, dtype=np.float32)[-self.capacity:]
+        ir = np.asarray(ir, dtype=np.float32)[-self.capacity:]
+        index = (self._next[i] + np.arange(len(red))) % self.capacity
+        accel = 1.0 if accel is None else np.asarray(accel, dtype=np.float32)[-self.capacity:]
+        for buffer, values in ((self.red, red), (self.ir, ir), (self.accel, accel)):
+            buffer[i, index] = values
+            buffer[i, index + self.capacity] = values
+        self._next[i] = (self._next[i] + len(red)) % self.capacity
+        self._count[i] = min(self.capacity, self._count[i] + len(red))
+
+    def push_batch(self, red, ir, accel=None):
+        """Appends a chunk for every patient at once: arrays of shape (n_patients, samples)."""
+        red = np.asarray(red, dtype=np.float32)[:, -self.capacity:]
+        ir = np.asarray(ir, dtype=np.float32)[:, -self.capacity:]
+        m = red.shape[1]
+        accel = 1.0 if accel is None else np.asarray(accel, dtype=np.float32)[:, -self.capacity:]
+        start = self._next[0]
+        if (self._next == start).all() and start + m <= self.capacity:
+            # Cohort pushed in lockstep (the usual case): plain slice writes
+            for buffer, values in ((self.red, red), (self.ir, ir), (self.accel, accel)):
+                buffer[:, start:start + m] = values
+                buffer[:, start + self.capacity:start + self.capacity + m] = values
+        else:
+            index = (self._next[:, None] + np.arange(m)) % self.capacity
+            for buffer, values in ((self.red, red), (self.ir, ir), (self.accel, accel)):
+                values = np.broadcast_to(values, index.shape)
+                np.put_along_axis(buffer, index, values, axis=1)
+                np.put_along_axis(buffer, index + self.capacity, values, axis=1)
+        self._next = (self._next + m) % self.capacity
+        np.minimum(self._count + m, self.capacity, out=self._count)
+
+    def set_vitals(self, i, **values):
+        """Latest readings of the vitals PPG can't give (sys_bp, dia_bp, temperature) for patient i."""
+        for key, value in values.items():
+            self.other[key][i] = value
+
+    def _windows(self, buffer, rows, samples):
+        # The newest `samples` of each row, oldest first; a view when the cohort is in lockstep
+        end = self._next[rows] + self.capacity
+        if (end == end[0]).all():
+            if len(rows) == self.n:
+                return buffer[:, end[0] - samples:end[0]]
+            return buffer[rows, end[0] - samples:end[0]]
+        index = end[:, None] - samples + np.arange(samples)
+        return np.take_along_axis(buffer[rows], index, axis=1)
+
+    def estimate(self):
+        """Re-estimates heart rate and SpO2 for every patient with enough buffered samples.
+        Returns the mask of patients that got a new estimate."""
+        self.fresh[:] = False
+        rows = np.flatnonzero(self._count >= self.min_samples)
+        if not len(rows):
+            return self.fresh
+        # Only the samples actually received; a partly filled ring is analysed over its newest part
+        samples = int(self._count[rows].min())
+        red = self._windows(self.red, rows, samples)
+        ir = self._windows(self.ir, rows, samples)
+        accel = self._windows(self.accel, rows, samples)
+
+        # Filter with the DC removed, so float32 keeps the small pulse exact
+        red_dc = red.mean(axis=1, keepdims=True)
+        ir_dc = ir.mean(axis=1, keepdims=True)
+        red_pulse = bandpass(red - red_dc, self.fs)
+        ir_pulse = bandpass(ir - ir_dc, self.fs)
+        ir_ac = ir_pulse.std(axis=1)
+        rate = heart_rates(ir_pulse, self.fs, spread=ir_ac)
+        spo2 = spo2_estimates(red_pulse.std(axis=1), red_dc[:, 0], ir_ac, ir_dc[:, 0])
+
+        still = accel.std(axis=1) <= self.motion_threshold
+        valid = still & np.isfinite(rate) & np.isfinite(spo2)
+        updated = rows[valid]
+        self.heart_rate[updated] = rate[valid]
+        self.spo2[updated] = spo2[valid]
+        self.fresh[updated] = True
+        return self.fresh
+
+    def columns(self):
+        """Current readings of every patient keyed like CohortSimulator.step(), for check_vitals_batch().
+        Patients without an estimate yet are NaN."""
+        columns = {"heart_rate": np.round(self.heart_rate), "spo2": np.round(self.spo2)}
+        columns.update(self.other)
+        return columns
+
+    def reading(self, i):
+        """Patient i's vitals as a generate_vitals style dict, or None until a first estimate exists."""
+        if np.isnan(self.heart_rate[i]):
+            return None
+        return {
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "heart_rate": int(round(self.heart_rate[i])),
+            "spo2": int(round(self.spo2[i])),
+            "sys_bp": int(self.other["sys_bp"][i]),
+            "dia_bp": int(self.other["dia_bp"][i]),
+            "temperature": float(self.other["temperature"][i])
+        }
+
+
+def run(patients, seconds, chunk_seconds=1.0, sample_rate=None, motion=0.0, seed=None):
+    """Streams synthetic waveforms for `patients` through PPGIngest -> VitalsMonitor as fast as possible.
+    Returns throughput and the estimates' error against the simulated truth."""
+    from simulator import CohortSimulator, PPGSimulator
+
+    sample_rate = PPG_SAMPLE_RATE if sample_rate is None else sample_rate
+    cohort = CohortSimulator(patients, seed=seed)
+    waves = PPGSimulator(patients, sample_rate, seed=seed)
+    ingest = PPGIngest(patients, sample_rate)
+    monitor = VitalsMonitor()
+    rng = np.random.default_rng(seed)
+
+    hr_errors, spo2_errors = [], []
+    stats = {"patients": patients, "sample_rate": sample_rate, "samples": 0, "estimates": 0, "abnormal": 0,
+             "ingest_seconds": 0.0, "estimate_seconds": 0.0}
+    window = deque(maxlen=max(1, int(round(ingest.capacity / sample_rate))))  # true values behind the window
+    started = time.perf_counter()
+    for step in range(int(round(seconds / chunk_seconds))):
+        if step * chunk_seconds >= cohort.t:
+            # The vitals themselves change once a second, like every other simulator here
+            truth = cohort.step()
+            window.append((truth["heart_rate"].astype(np.float64), truth["spo2"].astype(np.float64)))
+            ingest.set_vitals(slice(None), sys_bp=truth["sys_bp"], dia_bp=truth["dia_bp"],
+                              temperature=truth["temperature"])
+        waves.set_vitals(truth["heart_rate"], truth["spo2"])
+        waves.motion = rng.random(patients) < motion
+        red, ir, accel = waves.chunk(chunk_seconds)
+
+        t = time.perf_counter()
+        ingest.push_batch(red, ir, accel)
+        stats["ingest_seconds"] += time.perf_counter() - t
+        stats["samples"] += red.size
+
+        t = time.perf_counter()
+        fresh = ingest.estimate()
+        columns = ingest.columns()
+        batch = monitor.check_vitals_batch({key: columns[key] for key in VITAL_KEYS})
+        stats["estimate_seconds"] += time.perf_counter() - t
+        stats["estimates"] += int(fresh.sum())
+        stats["abnormal"] += int((batch.abnormal & fresh).sum())
+        if fresh.any():
+            # An estimate describes its whole window, so score it against the window's mean truth
+            true_hr = np.mean([hr for hr, _ in window], axis=0)
+            true_spo2 = np.mean([spo2 for _, spo2 in window], axis=0)
+            hr_errors.append(np.abs(ingest.heart_rate[fresh] - true_hr[fresh]))
+            spo2_errors.append(np.abs(ingest.spo2[fresh] - true_spo2[fresh]))
+    wall = time.perf_counter() - started
+
+    stats["seconds"] = wall
+    stats["simulated_seconds"] = seconds
+    stats["samples_per_second"] = stats["samples"] / wall if wall else 0.0
+    # Processing time per second of signal, excluding the synthetic generator; below 1 keeps up in real time
+    stats["load"] = (stats["ingest_seconds"] + stats["estimate_seconds"]) / seconds
+    if hr_errors:
+        hr_errors, spo2_errors = np.concatenate(hr_errors), np.concatenate(spo2_errors)
+        stats["hr_mae"] = float(hr_errors.mean())
+        stats["hr_p95_error"] = float(np.percentile(hr_errors, 95))
+        stats["spo2_mae"] = float(spo2_errors.mean())
+        stats["spo2_p95_error"] = float(np.percentile(spo2_errors, 95))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Derive vitals from synthetic PPG waveforms")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=30.0, help="Seconds of signal per patient")
+    parser.add_argument("--chunk", type=float, default=1.0, help="Seconds of samples per pushed chunk")
+    parser.add_argument("--sample-rate", type=float, default=None, help=f"Hz (default {PPG_SAMPLE_RATE:g})")
+    parser.add_argument("--motion", type=float, default=0.0, help="Share of chunks with arm movement")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stats = run(args.patients, args.seconds, args.chunk, args.sample_rate, args.motion, args.seed)
+    print(f"{stats['patients']} streams at {stats['sample_rate']:g} Hz for {stats['simulated_seconds']:g}s: "
+          f"{stats['samples_per_second']:,.0f} samples/s end to end")
+    print(f"Ingest {stats['ingest_seconds']:.2f}s, estimate + check {stats['estimate_seconds']:.2f}s: "
+          f"{stats['load']:.1%} of real time")
+    if "hr_mae" in stats:
+        print(f"Heart rate error: mean {stats['hr_mae']:.1f} bpm, p95 {stats['hr_p95_error']:.1f} bpm")
+        print(f"SpO2 error: mean {stats['spo2_mae']:.1f}%, p95 {stats['spo2_p95_error']:.1f}%")
+    print(f"{stats['estimates']} estimates, {stats['abnormal']} abnormal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from env import load_env
+from monitor import DEFAULT_THRESHOLDS, VITAL_KEYS
+
+load_env()
+
+THRESHOLD_PROFILES_PATH = os.getenv("THRESHOLD_PROFILES_PATH", "profiles.json")
+PROFILE_RELOAD_INTERVAL = float(os.getenv("PROFILE_RELOAD_INTERVAL", "2"))  # seconds between file checks
+
+# Example profiles.json; every level only lists the vitals it overrides:
+# {
+#     "defaults": {"temperature": [36.0, 37.5]},
+#     "cohorts": {
+#         "athlete": {"heart_rate": [40, 100]},
+#         "copd": {"spo2": [88, 100]}
+#     },
+#     "patients": {
+#         "patient-1": {"cohort": "copd"},
+#         "patient-7": {"cohort": "athlete", "thresholds": {"sys_bp": [85, 135]}}
+#     }
+# }
+
+
+def _parse_ranges(ranges, where):
+    parsed = {}
+    for key, bounds in (ranges or {}).items():
+        if key not in VITAL_KEYS:
+            raise ValueError(f"{where}: unknown vital '{key}'")
+        if len(bounds) != 2 or not bounds[0] < bounds[1]:
+            raise ValueError(f"{where}: {key} needs [low, high] with low < high, got {bounds}")
+        parsed[key] = (bounds[0], bounds[1])
+    return parsed
+
+
+class ThresholdTable:
+    """Per-patient (low, high) ranges compiled into one contiguous array per vital, indexed by patient position.
+
+    table[key] returns (low_array, high_array), so it drops into VitalsMonitor.thresholds and
+    default_rules() in place of the scalar dict and the checks broadcast across patients."""
+
+    def __init__(self, patient_ids, low, high):
+        self.patient_ids = list(patient_ids)
+        self.low = low
+        self.high = high
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def __getitem__(self, key):
+        return self.low[key], self.high[key]
+
+    def row(self, i):
+        """{vital: (low, high)} of the patient at position i."""
+        return {key: (self.low[key][i].item(), self.high[key][i].item()) for key in VITAL_KEYS}
+
+
+class ProfileRegistry:
+    """Threshold profiles from a JSON config: defaults <- cohort <- patient overrides.
+
+    maybe_reload() re-reads the file when its mtime changes. `version` bumps on every successful
+    reload so consumers know to recompile; a broken edit is reported and the previous profiles stay."""
+
+    def __init__(self, path=None, reload_interval=None):
+        self.path = path if path is not None else THRESHOLD_PROFILES_PATH
+        self.reload_interval = PROFILE_RELOAD_INTERVAL if reload_interval is None else reload_interval
+        self.version = 0
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._defaults = dict(DEFAULT_THRESHOLDS)
+        self._cohorts = {}
+        self._patients = {}
+        # A bad config at startup should be loud, not silently fall back to defaults
+        self._load(self._stat())
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except FileNotFoundError:
+            return None
+
+    def _load(self, mtime):
+        config = {}
+        if mtime is not None:
+            with open(self.path) as f:
+                config = json.load(f)
+
+        defaults = dict(DEFAULT_THRESHOLDS)
+        defaults.update(_parse_ranges(config.get("defaults"), "defaults"))
+        cohorts = {name: _parse_ranges(ranges, f"cohort '{name}'")
+                   for name, ranges in config.get("cohorts", {}).items()}
+        patients = {}
+        for patient_id, profile in config.get("patients", {}).items():
+            cohort = profile.get("cohort")
+            if cohort is not None and cohort not in cohorts:
+                raise ValueError(f"patient '{patient_id}': unknown cohort '{cohort}'")
+            patients[str(patient_id)] = (cohort, _parse_ranges(profile.get("thresholds"), f"patient '{patient_id}'"))
+
+        self._defaults, self._cohorts, self._patients = defaults, cohorts, patients
+        self._mtime = mtime
+        self.version += 1
+
+    def maybe_reload(self):
+        """Reloads if the file changed. Cheap enough to call every tick; returns True on reload."""
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            mtime = self._stat()
+            if mtime == self._mtime:
+                return False
+            try:
+                self._load(mtime)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                # Remember the broken version so we don't retry it every tick
+                self._mtime = mtime
+                print(f"Keeping previous threshold profiles, {self.path} is invalid: {e}")
+                return False
+            print(f"Reloaded threshold profiles from {self.path} (version {self.version})")
+            return True
+
+    def thresholds(self, patient_id):
+        """Resolved {vital: (low, high)} for one patient."""
+        cohort, overrides = self._patients.get(str(patient_id), (None, {}))
+        resolved = dict(self._defaults)
+        if cohort is not None:
+            resolved.update(self._cohorts[cohort])
+        resolved.update(overrides)
+        return resolved
+
+    def compile(self, patient_ids):
+        """ThresholdTable for patient_ids, row i belonging to patient_ids[i]."""
+        resolved = [self.thresholds(patient_id) for patient_id in patient_ids]
+        low = {key: np.array([r[key][0] for r in resolved], dtype=np.float64) for key in VITAL_KEYS}
+        high = {key: np.array([r[key][1] for r in resolved], dtype=np.float64) for key in VITAL_KEYS}
+        return ThresholdTable(patient_ids, low, high)
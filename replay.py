@@ -0,0 +1,479 @@
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from core import PatientPipeline
+from detector import StreamingDetector, default_rules
+from env import load_env
+from incidents import IncidentManager, severity
+from monitor import VitalsMonitor, VITAL_KEYS
+from profiles import ProfileRegistry
+from simulator import CohortSimulator
+from stubs import make_agent
+
+load_env()
+
+REPLAY_CHUNK_SIZE = int(os.getenv("REPLAY_CHUNK_SIZE", "10000"))  # rows read from a recording at a time
+REPLAY_MAX_FILL = int(os.getenv("REPLAY_MAX_FILL", "5"))  # missing samples in a row carried forward; longer gaps are skipped
+
+# Values of the label column that mark a reading as truly abnormal (case-insensitive)
+TRUE_LABELS = {"1", "true", "yes", "abnormal"}
+
+
+def _timestamps(column):
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=np.float64)  # epoch seconds
+    parsed = pd.to_datetime(column, utc=True)
+    return ((parsed - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+def _labels(column):
+    if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return column.to_numpy() != 0
+    return column.astype(str).str.strip().str.lower().isin(TRUE_LABELS).to_numpy()
+
+
+def _fill_gaps(chunk, state, max_fill):
+    """Forward-fills missing (NaN) vitals from the last reading of the same vital, at most max_fill
+    samples in a row. Returns (rows to keep, rows with a filled value); rows that can't be filled
+    (gap too long, nothing to carry forward, or no timestamp) are dropped."""
+    keep = ~np.isnan(chunk["ts"])
+    filled = np.zeros(len(keep), dtype=bool)
+    positions = np.arange(1, len(keep) + 1)
+    for key in VITAL_KEYS:
+        values = chunk[key]
+        missing = np.isnan(values)
+        last, age = state.get(key, (np.nan, 0))
+        if missing.any():
+            # Position of the last valid value at or before each row; 0 = the one carried in from earlier
+            valid_at = np.maximum.accumulate(np.where(missing, 0, positions))
+            source = np.concatenate([[last], values])[valid_at]
+            gap = np.where(valid_at == 0, age + positions, positions - valid_at)
+            usable = ~missing | ((gap <= max_fill) & ~np.isnan(source))
+            chunk[key] = np.where(missing, source, values)
+            filled |= missing & usable
+            keep &= usable
+            state[key] = (source[-1], int(gap[-1]))
+        elif len(values):
+            state[key] = (values[-1], 0)
+    return keep, filled & keep
+
+
+def read_chunks(path, chunksize=None, label_column="label", gaps=None, max_fill=None):
+    """Yields a recording as column chunks {"ts", vitals..., ["label"]} of at most chunksize rows.
+
+    CSV is read with pandas in chunks and Parquet batch by batch, so the whole file is never in memory.
+    Expected columns: the VITAL_KEYS, plus optional timestamp (epoch seconds or ISO text; 1 Hz from 0
+    when absent) and an optional ground-truth label column.
+    Missing samples are forward-filled or skipped (see _fill_gaps); gaps, if given, counts them
+    as "filled" and "skipped" readings."""
+    chunksize = chunksize or REPLAY_CHUNK_SIZE
+    max_fill = REPLAY_MAX_FILL if max_fill is None else max_fill
+    gaps = gaps if gaps is not None else {}
+    gaps.setdefault("filled", 0)
+    gaps.setdefault("skipped", 0)
+    state = {}
+    if path.endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet replay needs pyarrow: pip install pyarrow")
+        frames = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+    else:
+        frames = pd.read_csv(path, chunksize=chunksize)
+
+    offset = 0
+    for frame in frames:
+        missing = [key for key in VITAL_KEYS if key not in frame]
+        if missing:
+            raise ValueError(f"{path} is missing columns: {', '.join(missing)}")
+        chunk = {key: frame[key].to_numpy(dtype=np.float64) for key in VITAL_KEYS}
+        if "timestamp" in frame:
+            chunk["ts"] = _timestamps(frame["timestamp"])
+        else:
+            chunk["ts"] = np.arange(offset, offset + len(frame), dtype=np.float64)
+        if label_column and label_column in frame:
+            chunk["label"] = _labels(frame[label_column])
+        offset += len(frame)
+        keep, filled = _fill_gaps(chunk, state, max_fill)
+        gaps["filled"] += int(filled.sum())
+        if not keep.all():
+            gaps["skipped"] += int(len(keep) - keep.sum())
+            chunk = {key: values[keep] for key, values in chunk.items()}
+        yield chunk
+
+
+class Pacer:
+    """Sleeps so readings come out at their recorded pace, sped up `speed` times."""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self._origin = None
+
+    def wait(self, ts):
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (ts, now)
+        delay = (ts - self._origin[0]) / self.speed - (now - self._origin[1])
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _reading(chunk, i):
+    vitals = {"timestamp": datetime.fromtimestamp(chunk["ts"][i]).strftime("%H:%M:%S")}
+    for key in VITAL_KEYS:
+        value = chunk[key][i].item()
+        vitals[key] = value if key == "temperature" else int(value)
+    return vitals
+
+
+def replay(path, realtime=False, speed=1.0, chunksize=None):
+    """Streams a recording as generate_vitals style dicts, a drop-in for VitalsSimulator.
+    realtime paces readings by their timestamps (divided by speed); otherwise as fast as they are consumed."""
+    pacer = Pacer(speed) if realtime else None
+    for chunk in read_chunks(path, chunksize):
+        for i in range(len(chunk["ts"])):
+            if pacer:
+                pacer.wait(chunk["ts"][i])
+            yield _reading(chunk, i)
+
+
+def _number(value, spec=".2f", unit=""):
+    return "-" if value is None else f"{value:{spec}}{unit}"
+
+
+def _percentiles(values):
+    if not values:
+        return {"mean": None, "p50": None, "p90": None, "max": None}
+    values = np.asarray(values)
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "max": float(values.max())
+    }
+
+
+class Recording:
+    """Row-buffered reader over read_chunks, so files with any chunking can be consumed in lockstep."""
+
+    def __init__(self, path, chunksize=None, label_column="label"):
+        self.path = path
+        self.gaps = {"filled": 0, "skipped": 0}
+        self._chunks = read_chunks(path, chunksize, label_column, self.gaps)
+        self._buffer = None
+
+    def take(self, n):
+        """Next n rows (fewer at the end of the file), or None once exhausted."""
+        parts = []
+        have = 0
+        while have < n:
+            if self._buffer is None:
+                self._buffer = next(self._chunks, None)
+                if self._buffer is None:
+                    break
+            size = len(self._buffer["ts"])
+            need = n - have
+            if size <= need:
+                parts.append(self._buffer)
+                self._buffer = None
+                have += size
+            else:
+                parts.append({key: values[:need] for key, values in self._buffer.items()})
+                self._buffer = {key: values[need:] for key, values in self._buffer.items()}
+                have = n
+        if not parts:
+            return None
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def _file_report(path):
+    return {"file": path, "readings": 0, "filled_readings": 0, "skipped_readings": 0,
+            "abnormal_readings": 0, "incidents": 0, "alerts": 0,
+            "suppressed_alerts": 0, "analyses": 0, "labelled": False, "episodes": 0, "detected": 0,
+            "false_alarms": 0, "time_to_detect_samples": []}
+
+
+def backtest(paths, options):
+    """Replays a group of recordings through monitor -> detector -> incidents (-> stub agent) and scores each.
+
+    The files are stepped in lockstep as one StreamingDetector cohort, row k of every file per update,
+    so the per-update numpy cost is shared by the whole group. Each file is still its own patient
+    with its own clock, thresholds (profile id = file name) and incidents.
+
+    With a label column, labelled runs of abnormal readings are the ground truth: time-to-detect is
+    from the start of a run to the detector going ABNORMAL, and incidents that never overlap a
+    labelled reading are false alarms."""
+    n = len(paths)
+    patient_ids = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    thresholds = ProfileRegistry(options["profiles_path"]).compile(patient_ids)
+    monitor = VitalsMonitor(thresholds)
+    detector = StreamingDetector(n, rules=default_rules(thresholds, options["min_duration"]),
+                                 clear_duration=options["clear_duration"])
+    incidents = IncidentManager(quiet_period=options["quiet_period"])
+    agent = make_agent(options["agent_latency"]) if options["analyze"] else None
+    pipelines = [PatientPipeline(path, incidents, agent) for path in paths]
+    pacer = Pacer(options["speed"]) if options["realtime"] else None
+    chunksize = options["chunksize"] or REPLAY_CHUNK_SIZE
+
+    recordings = [Recording(path, chunksize, options["label_column"]) for path in paths]
+    reports = [_file_report(path) for path in paths]
+    first_ts = np.full(n, np.nan)
+    last_ts = np.full(n, np.nan)
+    episode_start = np.full(n, np.nan)  # ts where each file's current labelled run started
+    episode_detected = np.zeros(n, dtype=bool)
+    current = [None] * n  # open Incident per file
+    has_incident = np.zeros(n, dtype=bool)
+    incident_true = np.zeros(n, dtype=bool)  # the open incident overlapped a labelled reading
+    started = time.perf_counter()
+
+    def leave_incident(j):
+        reports[j]["suppressed_alerts"] += current[j].suppressed_analyses
+        if not incident_true[j]:
+            reports[j]["false_alarms"] += 1
+
+    while True:
+        chunks = [recording.take(chunksize) for recording in recordings]
+        if all(chunk is None for chunk in chunks):
+            break
+        rows = max(len(chunk["ts"]) for chunk in chunks if chunk is not None)
+        block = {key: np.full((rows, n), np.nan) for key in ("ts",) + VITAL_KEYS}
+        labels = np.zeros((rows, n), dtype=bool)
+        active = np.zeros((rows, n), dtype=bool)
+        for j, chunk in enumerate(chunks):
+            if chunk is None:
+                continue
+            size = len(chunk["ts"])
+            for key in block:
+                block[key][:size, j] = chunk[key]
+            active[:size, j] = True
+            if "label" in chunk:
+                labels[:size, j] = chunk["label"]
+                reports[j]["labelled"] = True
+
+        # Raw threshold breaches for the whole block at once
+        breaches = monitor.check_vitals_batch({key: block[key] for key in VITAL_KEYS}).abnormal & active
+        for j in range(n):
+            reports[j]["readings"] += int(active[:, j].sum())
+            reports[j]["abnormal_readings"] += int(breaches[:, j].sum())
+
+        for k in range(rows):
+            ts = block["ts"][k]
+            act = active[k]
+            first_ts = np.where(act & np.isnan(first_ts), ts, first_ts)
+            if pacer:
+                # Every file runs on its own clock from its first reading
+                pacer.wait(np.nanmin(np.where(act, ts - first_ts, np.nan)))
+            dt = np.where(act & ~np.isnan(last_ts), ts - last_ts, 1.0)
+            np.maximum(dt, 1e-3, out=dt)
+            last_ts = np.where(act, ts, last_ts)
+
+            columns = {key: block[key][k] for key in VITAL_KEYS}
+            abnormal = detector.update(columns, dt) & act
+
+            lab = labels[k]
+            opened = lab & np.isnan(episode_start)
+            episode_start[opened] = ts[opened]
+            episode_detected[opened] = False
+            episode_start[~lab] = np.nan
+            for j in np.flatnonzero(opened):
+                reports[j]["episodes"] += 1
+            for j in np.flatnonzero(~np.isnan(episode_start) & abnormal & ~episode_detected):
+                episode_detected[j] = True
+                reports[j]["detected"] += 1
+                reports[j]["time_to_detect_samples"].append(float(ts[j] - episode_start[j]))
+
+            candidates = np.flatnonzero(act & (abnormal | has_incident))
+            if not len(candidates):
+                continue
+            batch = monitor.check_vitals_batch(columns)
+            for j in candidates:
+                breaching = detector.active_vitals(j)
+                limits = thresholds.row(j)
+                level = severity(detector.smoothed(j, breaching), limits)
+                vitals = _reading(dict(columns, ts=ts), j)
+                # Recorded time runs far ahead of the wall clock, so each analysis is waited for
+                reason = pipelines[j].step(ts[j], vitals, bool(abnormal[j]), breaching, level,
+                                           batch.row(j, values=vitals)["details"], limits, wait=True)
+                if reason is not None:
+                    reports[j]["alerts"] += 1
+
+                incident = incidents.current(paths[j])
+                if incident is not current[j]:
+                    if current[j] is not None:
+                        leave_incident(j)
+                    if incident is not None:
+                        reports[j]["incidents"] += 1
+                    current[j], has_incident[j], incident_true[j] = incident, incident is not None, False
+                if lab[j]:
+                    incident_true[j] = True
+
+    seconds = time.perf_counter() - started
+    for j, report in enumerate(reports):
+        if current[j] is not None:
+            leave_incident(j)
+        report["analyses"] = pipelines[j].counts["analyses"]
+        report["filled_readings"] = recordings[j].gaps["filled"]
+        report["skipped_readings"] = recordings[j].gaps["skipped"]
+        report["recording_hours"] = (last_ts[j] - first_ts[j]).item() / 3600 if report["readings"] else 0.0
+        report["seconds"] = seconds
+        report["readings_per_second"] = report["readings"] / seconds if seconds else 0.0
+        report["time_to_detect"] = _percentiles(report["time_to_detect_samples"])
+        if not report["labelled"]:
+            # No ground truth: detection and false-alarm figures would be meaningless
+            for key in ("episodes", "detected", "false_alarms"):
+                report[key] = None
+    return reports
+
+
+def _run(args):
+    paths, options = args
+    return backtest(paths, options)
+
+
+def summarize_reports(reports, seconds):
+    """Totals over all files; rates are over labelled files only."""
+    readings = sum(r["readings"] for r in reports)
+    labelled = [r for r in reports if r["labelled"]]
+    incidents = sum(r["incidents"] for r in labelled)
+    hours = sum(r["recording_hours"] for r in labelled)
+    episodes = sum(r["episodes"] for r in labelled)
+    false_alarms = sum(r["false_alarms"] for r in labelled)
+    return {
+        "files": len(reports),
+        "readings": readings,
+        "seconds": seconds,
+        "readings_per_second": readings / seconds if seconds else 0.0,
+        "filled_readings": sum(r["filled_readings"] for r in reports),
+        "skipped_readings": sum(r["skipped_readings"] for r in reports),
+        "abnormal_readings": sum(r["abnormal_readings"] for r in reports),
+        "incidents": sum(r["incidents"] for r in reports),
+        "alerts": sum(r["alerts"] for r in reports),
+        "suppressed_alerts": sum(r["suppressed_alerts"] for r in reports),
+        "analyses": sum(r["analyses"] for r in reports),
+        "labelled_files": len(labelled),
+        "episodes": episodes,
+        "detected": sum(r["detected"] for r in labelled),
+        "detection_rate": sum(r["detected"] for r in labelled) / episodes if episodes else None,
+        "false_alarms": false_alarms,
+        "false_alarm_rate": false_alarms / incidents if incidents else None,
+        "false_alarms_per_hour": false_alarms / hours if hours else None,
+        "time_to_detect": _percentiles([t for r in labelled for t in r["time_to_detect_samples"]])
+    }
+
+
+def run_backtest(paths, workers=None, **options):
+    """Backtests every recording, split across `workers` processes. Returns (summary, per-file reports)."""
+    defaults = {"profiles_path": None, "min_duration": None, "clear_duration": None, "quiet_period": None,
+                "analyze": False, "agent_latency": 0.0, "realtime": False, "speed": 1.0, "chunksize": None,
+                "label_column": "label"}
+    defaults.update(options)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    started = time.perf_counter()
+    if workers == 1:
+        reports = backtest(paths, defaults)
+    else:
+        # Each worker replays its share of the files in lockstep
+        groups = [(paths[i::workers], defaults) for i in range(workers)]
+        with mp.get_context().Pool(workers) as pool:
+            reports = [report for group in pool.imap_unordered(_run, groups) for report in group]
+    reports.sort(key=lambda r: r["file"])
+    return summarize_reports(reports, time.perf_counter() - started), reports
+
+
+def write_samples(directory, files=4, seconds=3600, seed=None, episodes=3):
+    """Writes labelled CSV recordings from CohortSimulator with a few random abnormal episodes each,
+    so the backtest can be exercised without real device data."""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    cohort = CohortSimulator(files, seed=seed)
+    labels = np.zeros((seconds, files), dtype=bool)
+    for patient in range(files):
+        for _ in range(episodes):
+            start = int(rng.integers(0, max(1, seconds - 120)))
+            end = start + int(rng.integers(15, 120))
+            cohort.add_scenario(str(rng.choice(CohortSimulator.FLAGS)), start, end, patients=[patient])
+            labels[start:end, patient] = True
+
+    epoch = time.time() - seconds
+    rows = {key: np.empty((seconds, files)) for key in VITAL_KEYS}
+    for t in range(seconds):
+        columns = cohort.step()
+        for key in VITAL_KEYS:
+            rows[key][t] = columns[key]
+    paths = []
+    for patient in range(files):
+        frame = pd.DataFrame({"timestamp": epoch + np.arange(seconds)})
+        for key in VITAL_KEYS:
+            frame[key] = rows[key][:, patient] if key == "temperature" else rows[key][:, patient].astype(int)
+        frame["label"] = labels[:, patient].astype(int)
+        path = os.path.join(directory, f"sample-{patient}.csv")
+        frame.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded vitals and backtest alerting")
+    parser.add_argument("paths", nargs="*", help="CSV/Parquet recordings or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="Files replayed in parallel (default: CPU count)")
+    parser.add_argument("--realtime", action="store_true", help="Pace readings by their timestamps")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up factor for --realtime")
+    parser.add_argument("--profiles", metavar="PATH", help="Threshold profiles JSON; patient id = file name")
+    parser.add_argument("--min-duration", type=float, default=None, help="Seconds a breach must last")
+    parser.add_argument("--clear-duration", type=float, default=None, help="Seconds all clear before recovery")
+    parser.add_argument("--quiet-period", type=float, default=None, help="Seconds before an incident closes")
+    parser.add_argument("--analyze", action="store_true", help="Run a stubbed MedicalAgent on every alert")
+    parser.add_argument("--agent-latency", type=float, default=0.0, help="Seconds the stub model takes per call")
+    parser.add_argument("--label-column", default="label")
+    parser.add_argument("--chunksize", type=int, default=None)
+    parser.add_argument("--write-samples", metavar="DIR", help="Write labelled sample recordings to DIR and exit")
+    parser.add_argument("--sample-seconds", type=int, default=3600)
+    parser.add_argument("--output", help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    if args.write_samples:
+        for path in write_samples(args.write_samples, seconds=args.sample_seconds):
+            print(path)
+        return
+
+    paths = sorted({path for pattern in args.paths for path in (glob.glob(pattern) or [pattern])})
+    if not paths:
+        parser.error("no recordings given")
+    summary, reports = run_backtest(paths, workers=args.workers, profiles_path=args.profiles,
+                                    min_duration=args.min_duration, clear_duration=args.clear_duration,
+                                    quiet_period=args.quiet_period, analyze=args.analyze,
+                                    agent_latency=args.agent_latency, realtime=args.realtime, speed=args.speed,
+                                    chunksize=args.chunksize, label_column=args.label_column)
+
+    for report in reports:
+        print(f"  {report['file']}: {report['readings']} readings, {report['incidents']} incidents, "
+              f"{report['alerts']} alerts, {report['readings_per_second']:.0f} readings/s")
+    print(f"{summary['readings']} readings from {summary['files']} files in {summary['seconds']:.2f}s: "
+          f"{summary['readings_per_second']:.0f} readings/s")
+    if summary["filled_readings"] or summary["skipped_readings"]:
+        print(f"Gaps: {summary['filled_readings']} readings forward-filled, "
+              f"{summary['skipped_readings']} skipped")
+    print(f"Alerts: {summary['alerts']} ({summary['suppressed_alerts']} suppressed) over {summary['incidents']} incidents")
+    if summary["labelled_files"]:
+        ttd = summary["time_to_detect"]
+        print(f"Detected {summary['detected']}/{summary['episodes']} labelled episodes, "
+              f"time-to-detect p50 {_number(ttd['p50'], '.1f', 's')} p90 {_number(ttd['p90'], '.1f', 's')}")
+        print(f"False alarms: {summary['false_alarms']} (rate {_number(summary['false_alarm_rate'])}, "
+              f"per hour {_number(summary['false_alarms_per_hour'])})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "files": reports}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,7 @@
 import random
 import time
 from datetime import datetime
-from dotenv import load_dotenv
-
-load_dotenv()
+import numpy as np
 
 
 class VitalsSimulator:
@@ -55,3 +53,154 @@ class VitalsSimulator:
             "dia_bp": self.dia_bp,
             "temperature": self.temperature
         }
+
+
+class CohortSimulator:
+    """Vectorized VitalsSimulator for a whole cohort of patients.
+
+    Keeps one state array per vital and advances every patient by one second per step(),
+    using the same ranges and random walks as VitalsSimulator.generate_vitals."""
+
+    FLAGS = ("hr", "spo2", "bp", "temp")
+
+    def __init__(self, n_patients, seed=None):
+        self.n = n_patients
+        self.rng = np.random.default_rng(seed)
+        self.t = 0  # seconds since start
+        self.heart_rate = np.full(n_patients, 75, dtype=np.int16)
+        self.spo2 = np.full(n_patients, 98, dtype=np.int16)
+        self.sys_bp = np.full(n_patients, 120, dtype=np.int16)
+        self.dia_bp = np.full(n_patients, 80, dtype=np.int16)
+        self.temperature = np.full(n_patients, 37.0)
+        self.abnormal_flags = {flag: np.zeros(n_patients, dtype=bool) for flag in self.FLAGS}
+        self.scenarios = []  # (flag, start, end, patient mask)
+
+    def set_abnormal(self, flag, patients, value=True):
+        """Turns a simulated abnormality on/off for the given patient indices (or boolean mask)."""
+        self.abnormal_flags[flag][patients] = value
+
+    def add_scenario(self, flag, start, end=None, patients=None):
+        """Makes flag abnormal from t=start until t=end (forever if None), e.g. ("spo2", 300) for an SpO2 drop at 300s.
+        patients: indices or boolean mask; defaults to the whole cohort."""
+        mask = np.zeros(self.n, dtype=bool)
+        mask[slice(None) if patients is None else patients] = True
+        self.scenarios.append((flag, start, end, mask))
+
+    def _active_flags(self):
+        flags = dict(self.abnormal_flags)
+        for flag, start, end, mask in self.scenarios:
+            if start <= self.t and (end is None or self.t < end):
+                flags[flag] = flags[flag] | mask
+        return flags
+
+    def _integers(self, low, high):
+        # Inclusive bounds, like random.randint
+        return self.rng.integers(low, high + 1, size=self.n, dtype=np.int16)
+
+    def _either(self, a, b):
+        return np.where(self.rng.random(self.n) < 0.5, a, b)
+
+    def step(self):
+        """Advances every patient by one reading. Returns columns keyed like generate_vitals (no timestamp)."""
+        flags = self._active_flags()
+
+        # Heart Rate
+        normal = np.clip(self.heart_rate + self._integers(-5, 5), 60, 100)
+        abnormal = self._either(self._integers(40, 55), self._integers(110, 150))
+        self.heart_rate = np.where(flags["hr"], abnormal, normal).astype(np.int16)
+
+        # SpO2
+        normal = np.clip(self.spo2 + self._integers(-1, 1), 95, 100)
+        self.spo2 = np.where(flags["spo2"], self._integers(85, 94), normal).astype(np.int16)
+
+        # BP
+        normal = np.clip(self.sys_bp + self._integers(-2, 2), 110, 130)
+        self.sys_bp = np.where(flags["bp"], self._integers(140, 180), normal).astype(np.int16)
+        normal = np.clip(self.dia_bp + self._integers(-2, 2), 70, 85)
+        self.dia_bp = np.where(flags["bp"], self._integers(90, 110), normal).astype(np.int16)
+
+        # Temperature
+        normal = np.clip(self.temperature + self.rng.uniform(-0.1, 0.1, self.n), 36.5, 37.5)
+        abnormal = self._either(self.rng.uniform(38.0, 40.0, self.n), self.rng.uniform(35.0, 36.0, self.n))
+        self.temperature = np.round(np.where(flags["temp"], abnormal, normal), 1)
+
+        self.t += 1
+        return {
+            "heart_rate": self.heart_rate,
+            "spo2": self.spo2,
+            "sys_bp": self.sys_bp,
+            "dia_bp": self.dia_bp,
+            "temperature": self.temperature
+        }
+
+    def reading(self, i):
+        """Current vitals of patient i as a generate_vitals style dict."""
+        return {
+            "timestamp": datetime.now().strftime("%H:%M:%S"),
+            "heart_rate": int(self.heart_rate[i]),
+            "spo2": int(self.spo2[i]),
+            "sys_bp": int(self.sys_bp[i]),
+            "dia_bp": int(self.dia_bp[i]),
+            "temperature": float(self.temperature[i])
+        }
+
+
+class PPGSimulator:
+    """Synthetic raw wristband streams for a cohort: red and infrared PPG plus accelerometer magnitude.
+
+    Each patient's pulse follows their current heart_rate and spo2 (set them directly, or from
+    CohortSimulator.step() columns), so estimates from the waveform can be checked against the truth.
+    The pulse phase carries over between chunks, so consecutive chunks join into one continuous signal."""
+
+    def __init__(self, n_patients, sample_rate=100.0, seed=None, noise=0.02):
+        self.n = n_patients
+        self.fs = float(sample_rate)
+        self.rng = np.random.default_rng(seed)
+        self.noise = noise  # relative to the pulse amplitude
+        self.heart_rate = np.full(n_patients, 75.0)
+        self.spo2 = np.full(n_patients, 98.0)
+        self.perfusion = self.rng.uniform(0.01, 0.03, n_patients)  # AC/DC of the infrared channel
+        self.motion = np.zeros(n_patients, dtype=bool)  # patients whose wrist is moving right now
+        self.dc_red = self.rng.uniform(40000, 60000, n_patients)
+        self.dc_ir = self.rng.uniform(60000, 90000, n_patients)
+        self._phase = self.rng.uniform(0, 2 * np.pi, n_patients)
+        self._breath = self.rng.uniform(0, 2 * np.pi, n_patients)
+        self.t = 0.0  # seconds generated so far
+
+    def set_vitals(self, heart_rate=None, spo2=None):
+        """Sets the true vitals the waveforms encode, e.g. from CohortSimulator.step() columns."""
+        if heart_rate is not None:
+            self.heart_rate = np.asarray(heart_rate, dtype=np.float64)
+        if spo2 is not None:
+            self.spo2 = np.asarray(spo2, dtype=np.float64)
+
+    def chunk(self, seconds=1.0):
+        """Next `seconds` of samples for every patient: (red, ir, accel) arrays of shape (n_patients, samples)."""
+        m = int(round(seconds * self.fs))
+        dt = 1.0 / self.fs
+        # Cumulative phase per patient; a pulse peaks once per 2*pi
+        step = 2 * np.pi * self.heart_rate / 60.0 * dt
+        phase = self._phase[:, None] + step[:, None] * np.arange(1, m + 1)
+        self._phase = phase[:, -1] % (2 * np.pi)
+        # Sharp systolic upstroke with a smaller dicrotic wave after it
+        pulse = np.sin(phase) + 0.25 * np.sin(2 * phase - 1.0)
+
+        breath_phase = self._breath[:, None] + 2 * np.pi * 0.25 * dt * np.arange(1, m + 1)
+        self._breath = breath_phase[:, -1] % (2 * np.pi)
+        wander = 0.5 * np.sin(breath_phase)  # respiration drifts the baseline
+
+        shape = (self.n, m)
+        noise = self.noise * self.rng.standard_normal(shape)
+        accel = 1.0 + 0.02 * self.rng.standard_normal(shape)
+        if self.motion.any():
+            # Arm movement: large broadband artifacts on both the PPG and the accelerometer
+            noise[self.motion] += 3.0 * self.rng.standard_normal((int(self.motion.sum()), m))
+            accel[self.motion] += 0.8 * self.rng.standard_normal((int(self.motion.sum()), m))
+
+        # Ratio of ratios R = (AC/DC red) / (AC/DC ir), inverting the usual SpO2 = 110 - 25 R calibration
+        ratio = (110.0 - self.spo2) / 25.0
+        ac_ir = self.perfusion[:, None]
+        ir = self.dc_ir[:, None] * (1 + ac_ir * (pulse + wander + noise))
+        red = self.dc_red[:, None] * (1 + ac_ir * ratio[:, None] * (pulse + wander) + ac_ir * noise)
+        self.t += m * dt
+        return red.astype(np.float32), ir.astype(np.float32), accel.astype(np.float32)
@@ -0,0 +1,345 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from env import load_env
+from monitor import VITAL_KEYS
+
+load_env()
+
+VITALS_STORE_PATH = os.getenv("VITALS_STORE_PATH", "vitals_data")
+SEGMENT_SIZE = int(os.getenv("VITALS_SEGMENT_SIZE", "86400"))  # readings per segment (one day at 1 Hz)
+MAX_MAPPED_SERIES = int(os.getenv("VITALS_MAX_MAPPED_SERIES", "64"))  # patients whose active segment stays mapped
+WRITE_BUFFER = int(os.getenv("VITALS_WRITE_BUFFER", "60"))  # readings held in memory per patient between segment writes
+
+COLUMN_DTYPES = {
+    "ts": np.float64,  # epoch seconds, strictly increasing; 0 marks unwritten slots
+    "heart_rate": np.int16,
+    "spo2": np.int16,
+    "sys_bp": np.int16,
+    "dia_bp": np.int16,
+    "temperature": np.float32
+}
+
+ROLLUP_DTYPE = np.dtype([("start", np.float64), ("count", np.int32)] +
+                        [(f"{key}_{stat}", np.float32) for key in VITAL_KEYS for stat in ("min", "max", "mean")])
+
+RESOLUTIONS = {"1m": 60, "1h": 3600}
+
+
+class Bucket:
+    """Running min/max/sum of every vital over one rollup interval."""
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+        self.min = np.full(len(VITAL_KEYS), np.inf)
+        self.max = np.full(len(VITAL_KEYS), -np.inf)
+        self.sum = np.zeros(len(VITAL_KEYS))
+
+    def add(self, values, count=1, mins=None, maxs=None):
+        """Adds one reading, or a pre-aggregated (count, sum, min, max) when mins/maxs are given."""
+        self.count += count
+        self.sum += values
+        np.minimum(self.min, values if mins is None else mins, out=self.min)
+        np.maximum(self.max, values if maxs is None else maxs, out=self.max)
+
+    def record(self):
+        row = np.zeros(1, dtype=ROLLUP_DTYPE)
+        row["start"] = self.start
+        row["count"] = self.count
+        for i, key in enumerate(VITAL_KEYS):
+            row[f"{key}_min"] = self.min[i]
+            row[f"{key}_max"] = self.max[i]
+            row[f"{key}_mean"] = self.sum[i] / self.count
+        return row
+
+
+class MappedSegments:
+    """LRU of the series that currently keep their active segment memory-mapped.
+
+    Each mapped segment holds one file descriptor per column, so a store with many patients only
+    keeps the most recently written max_open of them mapped and unmaps the rest."""
+
+    def __init__(self, max_open=None):
+        self.max_open = max_open or MAX_MAPPED_SERIES
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def touch(self, series):
+        """Marks series as most recently used and unmaps the least recently used ones beyond max_open.
+        Called with series._lock held; a series busy in another thread is skipped rather than waited on."""
+        with self._lock:
+            self._series[series] = None
+            self._series.move_to_end(series)
+            for other in list(self._series):
+                if len(self._series) <= self.max_open:
+                    break
+                if other is series or not other._lock.acquire(blocking=False):
+                    continue
+                try:
+                    other._unmap()
+                finally:
+                    other._lock.release()
+                del self._series[other]
+
+    def discard(self, series):
+        with self._lock:
+            self._series.pop(series, None)
+
+
+class PatientSeries:
+    """Append-only vitals series of one patient.
+
+    Raw readings live in fixed-size segment directories with one memory-mapped file per column.
+    1-minute and 1-hour rollups are appended to their own files whenever an interval closes.
+    Appends collect in a buffer of buffer_size readings that is written to the segment in one block,
+    so the segment is only mapped once per block; see MappedSegments. Queries include the buffer,
+    but readings still in it are lost if the process dies before flush() or close()."""
+
+    def __init__(self, path, segment_size=None, mapped=None, buffer_size=None):
+        self.path = path
+        self.segment_size = segment_size or SEGMENT_SIZE
+        self.buffer_size = buffer_size or WRITE_BUFFER
+        self._mapped = mapped if mapped is not None else MappedSegments()
+        self._pending = {key: np.zeros(self.buffer_size, dtype=dtype) for key, dtype in COLUMN_DTYPES.items()}
+        self._pending_count = 0
+        os.makedirs(os.path.join(path, "raw"), exist_ok=True)
+        self._segments = sorted(int(name) for name in os.listdir(os.path.join(path, "raw")) if name.isdigit())
+        self._maps = {}  # active segment number -> {column: memmap}, while this series is in _mapped
+        self._buckets = {}
+        self._count = 0  # readings written to the last segment
+        self._lock = threading.Lock()
+        self.last_ts = 0.0
+        if self._segments:
+            # Opened only for the scan; the segment is mapped again by the first append
+            ts = self._open_segment(self._segments[-1])["ts"]
+            self._count = self._filled(ts)
+            if self._count:
+                self.last_ts = float(ts[self._count - 1])
+        self._restore_buckets()
+
+    @staticmethod
+    def _filled(ts):
+        # Unwritten slots are zero and ts only grows, so binary search for the first zero
+        lo, hi = 0, len(ts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[mid] > 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _segment_path(self, number):
+        return os.path.join(self.path, "raw", f"{number:06d}")
+
+    def _open_segment(self, number, create=False):
+        directory = self._segment_path(number)
+        if create:
+            os.makedirs(directory, exist_ok=True)
+        maps = {}
+        for key, dtype in COLUMN_DTYPES.items():
+            filename = os.path.join(directory, f"{key}.bin")
+            mode = "w+" if create and not os.path.exists(filename) else "r+"
+            maps[key] = np.memmap(filename, dtype=dtype, mode=mode, shape=(self.segment_size,))
+        return maps
+
+    def _columns(self, number, create=False):
+        # Only the active segment stays mapped; older ones are opened per query
+        if number not in self._maps:
+            self._flush_maps()
+            self._maps = {number: self._open_segment(number, create)}
+        self._mapped.touch(self)
+        return self._maps[number]
+
+    def _flush_maps(self):
+        for maps in self._maps.values():
+            for column in maps.values():
+                column.flush()
+
+    def _unmap(self):
+        # The memmaps close their file descriptors once the last reference goes away
+        self._flush_maps()
+        self._maps = {}
+
+    def _rollup_path(self, resolution):
+        return os.path.join(self.path, f"rollup_{resolution}.bin")
+
+    def _read_rollups(self, resolution):
+        filename = self._rollup_path(resolution)
+        if not os.path.exists(filename) or not os.path.getsize(filename):
+            return np.zeros(0, dtype=ROLLUP_DTYPE)
+        return np.memmap(filename, dtype=ROLLUP_DTYPE, mode="r")
+
+    def _restore_buckets(self):
+        # Rebuild the still-open intervals from what is already on disk
+        if not self.last_ts:
+            return
+        minute = self._bucket_start(self.last_ts, "1m")
+        hour = self._bucket_start(self.last_ts, "1h")
+        self._buckets["1m"] = Bucket(minute)
+        self._buckets["1h"] = Bucket(hour)
+        raw = self.query(minute, self.last_ts + 1)
+        for i in range(len(raw["ts"])):
+            self._buckets["1m"].add(np.array([raw[key][i] for key in VITAL_KEYS], dtype=np.float64))
+        minutes = self._read_rollups("1m")
+        for row in minutes[(minutes["start"] >= hour) & (minutes["start"] < minute)]:
+            self._merge_into_hour(row)
+        current = self._buckets["1m"]
+        if current.count:
+            self._buckets["1h"].add(current.sum, current.count, current.min, current.max)
+
+    def _merge_into_hour(self, row):
+        mins = np.array([row[f"{key}_min"] for key in VITAL_KEYS], dtype=np.float64)
+        maxs = np.array([row[f"{key}_max"] for key in VITAL_KEYS], dtype=np.float64)
+        sums = np.array([row[f"{key}_mean"] for key in VITAL_KEYS], dtype=np.float64) * row["count"]
+        self._buckets["1h"].add(sums, int(row["count"]), mins, maxs)
+
+    @staticmethod
+    def _bucket_start(ts, resolution):
+        width = RESOLUTIONS[resolution]
+        return ts - ts % width
+
+    def _roll(self, resolution, ts, values):
+        start = self._bucket_start(ts, resolution)
+        bucket = self._buckets.get(resolution)
+        if bucket is not None and bucket.start != start:
+            if bucket.count:
+                with open(self._rollup_path(resolution), "ab") as f:
+                    f.write(bucket.record().tobytes())
+            bucket = None
+        if bucket is None:
+            bucket = self._buckets[resolution] = Bucket(start)
+        bucket.add(values)
+
+    def append(self, vitals, ts=None):
+        with self._lock:
+            self._append(vitals, time.time() if ts is None else ts)
+
+    def _append(self, vitals, ts):
+        if ts <= self.last_ts:
+            raise ValueError(f"Timestamps must increase: {ts} <= {self.last_ts}")
+
+        n = self._pending_count
+        for key in VITAL_KEYS:
+            self._pending[key][n] = vitals[key]
+        self._pending["ts"][n] = ts
+        self._pending_count = n + 1
+        self.last_ts = ts
+        if self._pending_count == self.buffer_size:
+            self._write_pending()
+
+        values = np.array([vitals[key] for key in VITAL_KEYS], dtype=np.float64)
+        self._roll("1m", ts, values)
+        self._roll("1h", ts, values)
+
+    def _write_pending(self):
+        written = 0
+        while written < self._pending_count:
+            if not self._segments or self._count == self.segment_size:
+                self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+                self._count = 0
+            n = min(self._pending_count - written, self.segment_size - self._count)
+            columns = self._columns(self._segments[-1], create=True)
+            for key in VITAL_KEYS:
+                columns[key][self._count:self._count + n] = self._pending[key][written:written + n]
+            # ts last: a slot only counts as written once its timestamp is set
+            columns["ts"][self._count:self._count + n] = self._pending["ts"][written:written + n]
+            self._count += n
+            written += n
+        self._pending_count = 0
+
+    def query(self, start, end, resolution="raw", keys=None):
+        """Readings (or rollups) with start <= ts < end as a dict of arrays.
+        Only the pages covering the range are touched: segments are binary-searched on ts."""
+        if resolution != "raw":
+            return self._query_rollups(start, end, resolution)
+        with self._lock:
+            return self._query_raw(start, end, list(keys or VITAL_KEYS))
+
+    def _query_raw(self, start, end, keys):
+        parts = {key: [] for key in ["ts"] + keys}
+        for position, number in enumerate(self._segments):
+            columns = self._maps.get(number) or self._open_segment(number)
+            ts = columns["ts"]
+            filled = self._count if position == len(self._segments) - 1 else self.segment_size
+            if not filled or ts[0] >= end or ts[filled - 1] < start:
+                continue
+            lo = np.searchsorted(ts[:filled], start, side="left")
+            hi = np.searchsorted(ts[:filled], end, side="left")
+            for key in parts:
+                parts[key].append(np.array(columns[key][lo:hi]))
+        if self._pending_count:
+            ts = self._pending["ts"][:self._pending_count]
+            lo = np.searchsorted(ts, start, side="left")
+            hi = np.searchsorted(ts, end, side="left")
+            for key in parts:
+                parts[key].append(self._pending[key][lo:hi].copy())
+        return {key: np.concatenate(chunks) if chunks else np.zeros(0, dtype=COLUMN_DTYPES[key])
+                for key, chunks in parts.items()}
+
+    def _query_rollups(self, start, end, resolution):
+        rows = self._read_rollups(resolution)
+        lo = np.searchsorted(rows["start"], start, side="left")
+        hi = np.searchsorted(rows["start"], end, side="left")
+        rows = np.array(rows[lo:hi])
+        # Include the interval that is still open
+        bucket = self._buckets.get(resolution)
+        if bucket is not None and bucket.count and start <= bucket.start < end:
+            rows = np.concatenate([rows, bucket.record()])
+        return {name: rows[name] for name in ROLLUP_DTYPE.names}
+
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+            self._flush_maps()
+
+    def close(self):
+        with self._lock:
+            self._write_pending()
+            self._unmap()
+        self._mapped.discard(self)
+
+
+class VitalsStore:
+    """On-disk vitals store with one PatientSeries directory per patient.
+    At most max_mapped patients (VITALS_MAX_MAPPED_SERIES) hold open files at a time."""
+
+    def __init__(self, root=None, segment_size=None, max_mapped=None, buffer_size=None):
+        self.root = root or VITALS_STORE_PATH
+        self.segment_size = segment_size
+        self.buffer_size = buffer_size
+        self.mapped = MappedSegments(max_mapped)
+        self._series = {}
+        os.makedirs(self.root, exist_ok=True)
+        # Write out buffered readings when the app exits without closing the store
+        atexit.register(self.flush)
+
+    def series(self, patient_id):
+        if patient_id not in self._series:
+            self._series[patient_id] = PatientSeries(os.path.join(self.root, str(patient_id)), self.segment_size,
+                                                     self.mapped, self.buffer_size)
+        return self._series[patient_id]
+
+    def append(self, patient_id, vitals, ts=None):
+        self.series(patient_id).append(vitals, ts)
+
+    def query(self, patient_id, start, end, resolution="raw", keys=None):
+        return self.series(patient_id).query(start, end, resolution, keys)
+
+    def flush(self):
+        for series in self._series.values():
+            series.flush()
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
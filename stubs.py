@@ -0,0 +1,86 @@
+# Deterministic local stand-ins for the Gemini model and the Twilio transport, shared by the
+# benchmark, the replay backtest and the tests so none of them needs network access or API keys.
+import json
+import time
+
+STUB_RESPONSE = json.dumps({
+    "emergency": False,
+    "patient_advice": "Please sit down, breathe slowly and stay calm.",
+    "report_for_doctor": "- Patient Condition Summary: benchmark stub\n- Recommended Urgency Level: Routine"
+})
+STUB_CHUNK_SIZE = 24  # characters per streamed chunk
+
+
+class StubUsage:
+    prompt_token_count = 200
+    candidates_token_count = 80
+    total_token_count = 280
+
+
+class StubChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubResponse:
+    """Streams STUB_RESPONSE in small chunks, spreading the model latency across them."""
+
+    text = STUB_RESPONSE
+    usage_metadata = StubUsage()
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def __iter__(self):
+        chunks = [STUB_RESPONSE[i:i + STUB_CHUNK_SIZE] for i in range(0, len(STUB_RESPONSE), STUB_CHUNK_SIZE)]
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield StubChunk(chunk)
+
+
+class StubModel:
+    """Deterministic local stand-in for the Gemini model."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.request_options = None  # of the last call
+
+    def generate_content(self, prompt, stream=False, generation_config=None, request_options=None):
+        self.request_options = request_options
+        response = StubResponse(self.latency)
+        if not stream:
+            list(response)
+        return response
+
+
+class StubTransport:
+    """Notifier transport that accepts every message without any I/O."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = 0
+
+    def send(self, body, from_, to):
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent += 1
+        return f"SM{self.sent:032d}"
+
+
+def make_agent(model_latency):
+    from agent import MedicalAgent
+    from cache import AnalysisCache
+
+    agent = MedicalAgent(cache=AnalysisCache(path=""), mode="stateless")
+    agent.model = StubModel(model_latency)
+    return agent
+
+
+def make_notifier(transport_latency):
+    from notifier import WhatsAppNotifier
+
+    notifier = WhatsAppNotifier(transport=StubTransport(transport_latency), outbox_path="")
+    notifier.from_number = notifier.queue.from_number = "+10000000000"
+    notifier.queue.recipient_interval = 0
+    return notifier
@@ -0,0 +1,94 @@
+import json
+import time
+
+from agent import RESPONSE_FIELDS, TIMEOUT_RESULT, FieldStream, parse_response
+from stubs import STUB_RESPONSE, make_agent
+
+NORMAL = {"heart_rate": 75, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+REPLY = json.dumps({"emergency": True, "patient_advice": 'Sit down, say "help" if needed.\nBreathe.',
+                    "report_for_doctor": "HR 150 {sustained}"})
+
+
+def feed_in_pieces(text, size):
+    stream = FieldStream(RESPONSE_FIELDS)
+    completed = []
+    for i in range(0, len(text), size):
+        completed += list(stream.feed(text[i:i + size]))
+    return stream, completed
+
+
+def test_fields_complete_in_stream_order_at_any_chunking():
+    for size in (1, 3, 17, len(REPLY)):
+        stream, completed = feed_in_pieces(REPLY, size)
+        assert completed == list(RESPONSE_FIELDS)
+        assert stream.values == json.loads(REPLY)
+
+
+def test_string_is_not_reported_until_its_closing_quote():
+    stream = FieldStream(RESPONSE_FIELDS)
+    assert stream.feed('{"emergency": false, "patient_advice": "Sit down, say \\"hel') == {"emergency": False}
+    assert stream.feed('p\\" now."') == {"patient_advice": 'Sit down, say "help" now.'}
+
+
+def test_number_waits_for_a_delimiter():
+    stream = FieldStream(("score",))
+    assert stream.feed('{"score": 12') == {}
+    assert stream.feed('3, ') == {"score": 123}
+
+
+def test_parse_response():
+    assert parse_response(REPLY) == ('Sit down, say "help" if needed.\nBreathe.', "HR 150 {sustained}", True)
+    # The emergency verdict must be a real boolean
+    assert parse_response(json.dumps({"emergency": "yes", "patient_advice": "", "report_for_doctor": ""})) is None
+    sections = "SECTION 1 (Patient Advice): rest\n---\nSECTION 2 (Doctor Report): ok\n---\nSECTION 3 (Emergency Status): NO"
+    assert parse_response(sections) == ("rest", "ok", False)
+    assert parse_response("no structure at all") is None
+
+
+def test_analyze_streams_progress_and_caches():
+    agent = make_agent(0.0)
+    progress = {}
+    result = agent.analyze(NORMAL, "I feel dizzy", progress=progress)
+    expected = json.loads(STUB_RESPONSE)
+    assert result == (expected["patient_advice"], expected["report_for_doctor"], expected["emergency"])
+    assert progress["tier"] == "llm"
+    assert progress["emergency"] is expected["emergency"]
+    timings = progress["timings"]
+    assert timings["first_token"] <= timings["verdict"] <= timings["advice"] <= timings["total"]
+
+    progress = {}
+    assert agent.analyze(NORMAL, "I feel dizzy", progress=progress) == result
+    assert progress["tier"] == "cache"
+
+
+def test_deadline_counts_time_spent_queued():
+    agent = make_agent(0.5)
+    agent.max_workers = 1
+    running = agent.analyze_async(NORMAL, "I feel dizzy", patient_id="p1", timeout=5)
+    queued = agent.analyze_async(NORMAL, "I feel dizzy", patient_id="p2", timeout=0.1)
+    started = time.monotonic()
+    assert queued.result() == TIMEOUT_RESULT
+    assert time.monotonic() - started < 0.3
+    # Never reached a worker, so it is dropped instead of running late
+    assert queued.future.cancelled() and queued.timed_out()
+    assert running.result() == make_agent(0.0).analyze(NORMAL, "I feel dizzy")
+    assert not running.timed_out()
+
+
+def test_timed_out_call_is_abandoned_and_frees_the_patient():
+    agent = make_agent(2.0)
+    handle = agent.analyze_async(NORMAL, "I feel dizzy", patient_id="p1", timeout=0.3)
+    assert agent.analyze_async(NORMAL, "I feel dizzy", patient_id="p1") is None
+    assert agent.in_flight("p1") and not handle.done()
+
+    time.sleep(0.35)
+    assert handle.done() and handle.timed_out()
+    # The remaining time rode along as the request timeout
+    assert 0 < agent.model.request_options["timeout"] <= 0.3
+    assert not agent.in_flight("p1")
+    # The worker stops at the next streamed chunk instead of reading the whole 2 s response
+    assert handle.future.result(timeout=0.5) is TIMEOUT_RESULT
+
+    agent.model.latency = 0.0
+    retry = agent.analyze_async(NORMAL, "I feel dizzy", patient_id="p1")
+    assert retry is not None and retry.result()[2] is False
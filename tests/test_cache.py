@@ -0,0 +1,51 @@
+from cache import AnalysisCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnalysisCache(max_size=2, ttl=60, path="", clock=FakeClock())
+    cache.put("a", ["A"])
+    cache.put("b", ["B"])
+    assert cache.get("a") == ("A",)  # "b" is now the least recently used
+    cache.put("c", ["C"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ("A",) and cache.get("c") == ("C",)
+    assert cache.stats()["evictions"] == 1 and len(cache) == 2
+
+
+def test_entries_expire_after_the_ttl():
+    clock = FakeClock()
+    cache = AnalysisCache(ttl=60, path="", clock=clock)
+    cache.put("a", ["A"])
+    clock.now += 60
+    assert cache.get("a") == ("A",)
+    clock.now += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_sqlite_tier_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "analyses.db")
+    clock = FakeClock()
+    cache = AnalysisCache(max_size=2, ttl=60, path=path, clock=clock)
+    cache.put("old", ["0"])
+    clock.now += 30
+    cache.put("a", ["A", True])
+    cache.put("b", ["B", False])  # evicts "old" from memory and from the file
+
+    restarted = AnalysisCache(max_size=2, ttl=60, path=path, clock=clock)
+    assert len(restarted) == 2
+    assert restarted.get("a") == ("A", True) and restarted.get("b") == ("B", False)
+    assert restarted.get("old") is None
+
+    # Expired rows are dropped when the file is opened
+    clock.now += 61
+    assert len(AnalysisCache(ttl=60, path=path, clock=clock)) == 0
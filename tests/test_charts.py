@@ -0,0 +1,29 @@
+import numpy as np
+
+from charts import chart_frame, lttb
+
+
+def test_lttb_keeps_the_ends_and_a_spike():
+    y = np.zeros(1000)
+    y[437] = 50.0
+    keep = lttb(np.arange(1000), y, 20)
+    assert len(keep) == 20
+    assert keep[0] == 0 and keep[-1] == 999
+    assert 437 in keep
+
+
+def test_short_windows_are_charted_whole():
+    history = {"heart_rate": np.arange(50, 60)}
+    frame = chart_frame(history, 30, ("heart_rate",), max_points=20)
+    assert frame.index.tolist() == list(range(21, 31))
+    assert frame["heart_rate"].tolist() == list(range(50, 60))
+
+
+def test_every_series_of_a_chart_keeps_its_spikes():
+    sys_bp = np.full(1000, 120.0)
+    dia_bp = np.full(1000, 80.0)
+    sys_bp[200] = 180.0
+    dia_bp[700] = 40.0
+    frame = chart_frame({"sys_bp": sys_bp, "dia_bp": dia_bp}, 999, ("sys_bp", "dia_bp"), max_points=20)
+    assert frame["sys_bp"].max() == 180.0 and frame["dia_bp"].min() == 40.0
+    assert frame.index.is_monotonic_increasing and len(frame) <= 40
@@ -0,0 +1,76 @@
+from core import PatientMonitor, PatientPipeline, report_message
+from incidents import IncidentManager
+from stubs import make_agent, make_notifier
+
+VITALS = {"heart_rate": 130, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+
+
+class RecordingNotifier:
+    def __init__(self):
+        self.sent = []
+
+    def send_async(self, body, to):
+        self.sent.append((body, to))
+        return True, "queued"
+
+
+def feed(pipeline, times, **options):
+    reasons = {}
+    for now in times:
+        reason = pipeline.step(now, VITALS, True, ["heart_rate"], 1, **options)
+        if reason is not None:
+            reasons[now] = reason
+    return reasons
+
+
+def test_escalation_without_an_agent_is_the_alert():
+    incidents = IncidentManager(interval=10)
+    pipeline = PatientPipeline("p", incidents)
+    assert feed(pipeline, range(0, 30)) == {11: "opened"}
+    assert incidents.current("p").escalations == 1
+
+
+def test_escalation_waits_for_the_analysis_in_flight():
+    incidents = IncidentManager(interval=10)
+    agent = make_agent(0.0)
+    pipeline = PatientPipeline("p", incidents, agent)
+    # The same patient already has an analysis running: nothing escalates until it finishes
+    blocker = agent.analyze_async(VITALS, "I feel dizzy", patient_id="p", timeout=5)
+    agent.model.latency = 0.0
+    assert feed(pipeline, range(0, 12)) == {}
+    assert incidents.current("p").escalations == 0
+    blocker.result()
+    assert feed(pipeline, [12]) == {12: "opened"}
+    assert pipeline.pending_analysis is not None and incidents.current("p").escalations == 1
+
+
+def test_only_automatic_analyses_text_the_doctor():
+    notifier = RecordingNotifier()
+    pipeline = PatientPipeline("p", IncidentManager(interval=10), make_agent(0.0), notifier, "+100",
+                               auto_send=True)
+    feed(pipeline, range(0, 12), wait=True)
+    assert pipeline.counts["analyses"] == 1 and pipeline.counts["notifications"] == 1
+    body, to = notifier.sent[0]
+    assert to == "+100"
+    assert body == report_message(pipeline.ai_result["doctor"], 1, "opened")
+    assert body.startswith("Incident #1 (opened)\n\n")
+
+    # An analysis the patient asked for is shown, not sent
+    pipeline.pending_analysis = pipeline.agent.analyze_async(VITALS, "I feel dizzy", patient_id="p")
+    pipeline.pending_analysis_auto = False
+    assert pipeline.collect_ai_result(wait=True) is pipeline.ai_result
+    assert len(notifier.sent) == 1
+
+    pipeline.auto_send = False
+    assert not pipeline.notify
+
+
+def test_chart_frames_are_built_once_per_tick():
+    patient = PatientMonitor("p", make_agent(0.0), make_notifier(0.0))
+    patient.tick()
+    first = patient.snapshot
+    frame = patient.chart_frame(first, ("sys_bp", "dia_bp"))
+    assert patient.chart_frame(first, ("sys_bp", "dia_bp")) is frame
+    assert list(frame.columns) == ["sys_bp", "dia_bp"] and frame.index.tolist() == [1]
+    patient.tick()
+    assert patient.chart_frame(patient.snapshot, ("sys_bp", "dia_bp")).index.tolist() == [1, 2]
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from detector import RollingStats, StreamingDetector, ThresholdRule, TrendRule, default_rules
+from simulator import CohortSimulator
+
+NORMAL = {"heart_rate": 75, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+
+
+def vitals(**changes):
+    return dict(NORMAL, **changes)
+
+
+def run(detector, readings):
+    return [detector.update_one(reading)["status"] for reading in readings]
+
+
+def test_rolling_min_max_match_brute_force():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=(200, 3))
+    stats = RollingStats(3, window=7)
+    for t, values in enumerate(data):
+        stats.update(values)
+        window = data[max(0, t - 6):t + 1]
+        assert np.allclose(stats.max, window.max(axis=0))
+        assert np.allclose(stats.min, window.min(axis=0))
+
+
+def test_ewma_follows_a_step():
+    stats = RollingStats(1, window=5, alpha=0.5)
+    for value in (10.0, 20.0, 20.0):
+        stats.update([value])
+    assert stats.mean[0] == pytest.approx(17.5)
+
+
+def test_slope_is_a_least_squares_fit_over_the_window():
+    stats = RollingStats(2, window=10)
+    rng = np.random.default_rng(1)
+    for t in range(30):
+        stats.update([3.0 * t, 50 + rng.normal()], dt=1.0)
+        if t < 9:
+            assert stats.slope.tolist() == [0.0, 0.0]  # not enough samples for a fit yet
+    assert stats.slope[0] == pytest.approx(3.0)
+    assert abs(stats.slope[1]) < 0.5
+
+
+def test_single_spike_does_not_open_an_episode():
+    detector = StreamingDetector(1, rules=default_rules(duration=5), clear_duration=10)
+    assert run(detector, [vitals(), vitals(heart_rate=150), vitals()]) == ["NORMAL"] * 3
+
+
+def test_sustained_breach_opens_after_min_duration():
+    detector = StreamingDetector(1, rules=default_rules(duration=5), clear_duration=10)
+    statuses = run(detector, [vitals(heart_rate=130)] * 6)
+    assert statuses == ["NORMAL"] * 4 + ["ABNORMAL"] * 2
+    assert detector.active_vitals(0) == ["heart_rate"]
+
+
+def test_swinging_between_low_and_high_opens_within_duration():
+    # Every reading is out of range, just never on the same side twice in a row
+    detector = StreamingDetector(1, rules=default_rules(duration=5), clear_duration=10)
+    readings = [vitals(heart_rate=45), vitals(heart_rate=130)] * 3
+    assert run(detector, readings) == ["NORMAL"] * 4 + ["ABNORMAL"] * 2
+    # A far-low reading does not count as back in range for the high side
+    assert run(detector, [vitals(heart_rate=30)] * 15) == ["ABNORMAL"] * 15
+    assert detector.active_vitals(0) == ["heart_rate"]
+
+
+def test_hysteresis_and_clear_duration():
+    detector = StreamingDetector(1, rules=default_rules(duration=0), clear_duration=3)
+    run(detector, [vitals(heart_rate=130)])
+    # Back in range but inside the clear margin (high 100 - 5): the rule stays fired
+    assert run(detector, [vitals(heart_rate=98)] * 5) == ["ABNORMAL"] * 5
+    assert detector.active_rules(0)
+    # Past the margin the rule clears, and the episode ends after clear_duration seconds all clear
+    assert run(detector, [vitals(heart_rate=90)] * 4) == ["ABNORMAL"] * 2 + ["NORMAL"] * 2
+    assert detector.active_rules(0) == []
+
+
+def test_patients_are_independent():
+    detector = StreamingDetector(2, rules=[ThresholdRule("spo2", "<", 94, duration=2)], clear_duration=0)
+    columns = {key: np.full(2, value, dtype=float) for key, value in NORMAL.items()}
+    columns["spo2"] = np.array([90.0, 98.0])
+    for _ in range(2):
+        abnormal = detector.update(columns)
+    assert abnormal.tolist() == [True, False]
+
+
+def test_replace_rules_keeps_state_and_checks_count():
+    detector = StreamingDetector(1, rules=default_rules(duration=0), clear_duration=0)
+    run(detector, [vitals(temperature=38.5)])
+    assert detector.abnormal[0]
+    # A looser profile: the fired rule clears against its new level on the next update
+    detector.replace_rules(default_rules({**{k: (0, 1000) for k in NORMAL}, "temperature": (35.0, 39.0)},
+                                         duration=0))
+    assert run(detector, [vitals(temperature=38.5)]) == ["NORMAL"]
+    with pytest.raises(ValueError):
+        detector.replace_rules(detector.rules[:2])
+
+
+def test_trend_rules_stay_quiet_on_normal_data_and_fire_on_a_ramp():
+    rules = [TrendRule("heart_rate", 60, duration=15), TrendRule("heart_rate", -60, duration=15)]
+    sim = CohortSimulator(30, seed=3)
+    detector = StreamingDetector(30, rules=rules, clear_duration=0)
+    for _ in range(1800):
+        assert not detector.update(sim.step()).any()
+
+    detector = StreamingDetector(1, rules=rules, clear_duration=0)
+    ramp = [vitals(heart_rate=80)] * 60 + [vitals(heart_rate=80 + 2 * t) for t in range(1, 60)]
+    statuses = run(detector, ramp)
+    assert statuses[:60] == ["NORMAL"] * 60
+    assert "ABNORMAL" in statuses[60:]
+    assert detector.active_rules(0) == [rules[0].name]
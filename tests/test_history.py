@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from history import VitalsHistory
+
+
+def reading(i):
+    return {"timestamp": f"t{i}", "heart_rate": 60 + i, "spo2": 90 + i % 10, "sys_bp": 110 + i, "dia_bp": 70 + i,
+            "temperature": 36.0 + i / 10}
+
+
+def test_window_before_wrapping():
+    history = VitalsHistory(5)
+    for i in range(3):
+        history.append(reading(i))
+    assert len(history) == 3
+    assert history.column("heart_rate").tolist() == [60, 61, 62]
+    assert history.column("heart_rate", 10).tolist() == [60, 61, 62]
+
+
+def test_window_is_oldest_first_after_wrapping():
+    history = VitalsHistory(4)
+    for i in range(11):
+        history.append(reading(i))
+    assert len(history) == 4
+    assert history.column("heart_rate").tolist() == [67, 68, 69, 70]
+    window = history.window(2, keys=["sys_bp", "timestamp"])
+    assert window["sys_bp"].tolist() == [119, 120]
+    assert window["timestamp"].tolist() == ["t9", "t10"]
+
+
+def test_window_views_are_read_only_and_share_memory():
+    history = VitalsHistory(4)
+    for i in range(6):
+        history.append(reading(i))
+    view = history.column("spo2")
+    with pytest.raises(ValueError):
+        view[0] = 0
+    # A view, not a copy: it stays contiguous with the ring's storage
+    assert np.shares_memory(view, history._columns["spo2"])
+
+
+def test_latest_and_clear():
+    history = VitalsHistory(3)
+    assert history.latest() is None
+    for i in range(5):
+        history.append(reading(i))
+    latest = history.latest()
+    assert latest == reading(4)
+    assert type(latest["heart_rate"]) is int
+    history.clear()
+    assert len(history) == 0 and history.latest() is None
+    assert len(history.column("heart_rate")) == 0
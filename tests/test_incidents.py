@@ -0,0 +1,67 @@
+from incidents import IncidentManager, severity
+from monitor import DEFAULT_THRESHOLDS
+
+VITALS = {"heart_rate": 130, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+
+
+def test_severity_steps():
+    assert severity({}, DEFAULT_THRESHOLDS) == 0
+    assert severity({"heart_rate": 101}, DEFAULT_THRESHOLDS) == 1  # mild
+    assert severity({"spo2": 91}, DEFAULT_THRESHOLDS) == 2  # 4 points below, one 3-point step
+    assert severity({"heart_rate": 30, "spo2": 94}, DEFAULT_THRESHOLDS) == 2
+    assert severity({"temperature": 41.0}, DEFAULT_THRESHOLDS) == 3  # capped at severe
+
+
+def feed(manager, times, level=1, breaching=("heart_rate",), escalate=True):
+    reasons = {}
+    for now in times:
+        reason = manager.observe("p", now, True, VITALS, breaching, level, notify=True)
+        if reason is not None:
+            reasons[now] = reason
+            if escalate:
+                manager.escalated("p", now)
+    return reasons
+
+
+def test_one_escalation_per_unchanged_episode():
+    manager = IncidentManager(interval=10, quiet_period=30)
+    reasons = feed(manager, range(0, 60))
+    assert reasons == {11: "opened"}
+    incident = manager.current("p")
+    assert incident.escalations == 1
+    # Every interval after the escalation that would have re-sent is counted instead
+    assert incident.suppressed_analyses == 4
+    assert incident.suppressed_notifications == 4
+    assert manager.stats()["opened"] == 1
+
+
+def test_severity_rise_and_new_vital_escalate_at_most_once_per_interval():
+    manager = IncidentManager(interval=10, quiet_period=30)
+    feed(manager, range(0, 12))
+    assert feed(manager, range(12, 30), level=2) == {22: "severity rose to moderate"}
+    assert feed(manager, range(30, 45), level=2, breaching=("heart_rate", "spo2")) == {33: "new breach: spo2"}
+    # Falling back to a lower severity never escalates
+    assert feed(manager, range(45, 70), level=1, breaching=("heart_rate", "spo2")) == {}
+
+
+def test_quiet_period_closes_and_next_episode_is_a_new_incident():
+    manager = IncidentManager(interval=10, quiet_period=30)
+    feed(manager, range(0, 15))
+    first = manager.current("p")
+    for now in range(15, 44):
+        assert manager.observe("p", now, False, VITALS) is None
+    assert manager.current("p") is first  # still inside the quiet period
+    manager.observe("p", 44, False, VITALS)
+    assert manager.current("p") is None
+    assert first.closed_at == 44 and manager.closed[-1] is first
+
+    feed(manager, range(50, 62))
+    second = manager.current("p")
+    assert second.id == first.id + 1 and second.escalations == 1
+
+
+def test_unsent_escalation_is_offered_again():
+    manager = IncidentManager(interval=10, quiet_period=30)
+    # e.g. the agent was busy: observe() keeps returning the reason until escalated() is called
+    reasons = feed(manager, range(0, 14), escalate=False)
+    assert list(reasons) == [11, 12, 13]
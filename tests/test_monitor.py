@@ -0,0 +1,38 @@
+import math
+
+import pytest
+
+from monitor import DEFAULT_THRESHOLDS, VITAL_KEYS, VitalsMonitor
+
+NORMAL = {"heart_rate": 75, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+
+
+def edge_cases():
+    for key in VITAL_KEYS:
+        low, high = DEFAULT_THRESHOLDS[key]
+        step = 0.1 if isinstance(low, float) else 1
+        for value in (low, high, round(low - step, 1), round(high + step, 1), math.nan):
+            yield pytest.param(key, value, id=f"{key}={value}")
+
+
+@pytest.mark.parametrize("key,value", list(edge_cases()))
+def test_scalar_and_batch_checks_agree_on_the_boundaries(key, value):
+    monitor = VitalsMonitor()
+    readings = [NORMAL, {**NORMAL, key: value}, {**NORMAL, "heart_rate": 150, key: value}]
+    batch = monitor.check_vitals_batch({k: [r[k] for r in readings] for k in VITAL_KEYS})
+    for i, reading in enumerate(readings):
+        assert monitor.check_vitals(reading) == batch.row(i)
+
+
+def test_boundaries_are_in_range():
+    monitor = VitalsMonitor()
+    for key in VITAL_KEYS:
+        for value in DEFAULT_THRESHOLDS[key]:
+            assert monitor.check_vitals({**NORMAL, key: value})["status"] == "NORMAL"
+
+
+def test_abnormality_text():
+    result = VitalsMonitor().check_vitals({**NORMAL, "spo2": 91, "dia_bp": 95})
+    assert result["abnormalities"] == ["SpO2: 91% (Normal: 95-100)", "Diastolic BP: 95 mmHg (Normal: 60-90)"]
+    assert result["details"] == {"heart_rate": "NORMAL", "spo2": "ABNORMAL", "bp": "ABNORMAL",
+                                 "temperature": "NORMAL"}
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import notifier
+from fake_twilio import FakeTwilioServer
+from notifier import HttpTransport, NotificationQueue, WhatsAppNotifier
+
+
+@pytest.fixture
+def server():
+    server = FakeTwilioServer(port=0).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class FlakyTransport:
+    """Fails the first `failures` sends, then posts to the fake server. Records (to, time) of every attempt."""
+
+    def __init__(self, server, failures=0):
+        self.transport = HttpTransport(server.base_url, "ACfake", "token")
+        self.failures = failures
+        self.attempts = []
+
+    def send(self, body, from_, to):
+        self.attempts.append((to, time.monotonic()))
+        if len(self.attempts) <= self.failures:
+            raise RuntimeError("503 from Twilio")
+        return self.transport.send(body, from_, to)
+
+
+def make_queue(transport, **options):
+    options = {"workers": 2, "backoff": 0.05, "recipient_interval": 0, "path": "", **options}
+    return NotificationQueue(transport, "+10000000000", **options)
+
+
+def test_failed_sends_are_retried_with_doubling_backoff(server):
+    transport = FlakyTransport(server, failures=2)
+    queue = make_queue(transport)
+    queue.enqueue("report", "+1555")
+    assert queue.flush(timeout=5)
+    queue.close()
+    assert queue.stats == {"queued": 1, "sent": 1, "failed": 0, "retried": 2}
+    assert [m["body"] for m in server.messages] == ["report"]
+    (_, first), (_, second), (_, third) = transport.attempts
+    assert second - first >= 0.05
+    assert third - second >= 0.1
+
+
+def test_gives_up_after_max_retries(server):
+    transport = FlakyTransport(server, failures=10)
+    queue = make_queue(transport, max_retries=1)
+    queue.enqueue("report", "+1555")
+    assert queue.flush(timeout=5)
+    queue.close()
+    assert queue.stats["failed"] == 1 and len(transport.attempts) == 2
+    assert server.messages == []
+
+
+def test_messages_to_one_recipient_are_spaced_out(server):
+    transport = FlakyTransport(server)
+    queue = make_queue(transport, workers=4, recipient_interval=0.1)
+    for i in range(3):
+        queue.enqueue(f"report {i}", "+1555")
+    queue.enqueue("other", "+1666")
+    assert queue.flush(timeout=5)
+    queue.close()
+    times = [t for to, t in transport.attempts if to == "whatsapp:+1555"]
+    assert len(times) == 3
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+    # Another recipient isn't held up behind the first one
+    other = next(t for to, t in transport.attempts if to == "whatsapp:+1666")
+    assert other - times[0] < 0.09
+
+
+def test_undelivered_messages_are_restored_from_the_outbox(server, tmp_path):
+    path = str(tmp_path / "data" / "outbox.db")
+    down = make_queue(FlakyTransport(server, failures=100), backoff=60, path=path)
+    down.enqueue("first", "+1555")
+    down.enqueue("second", "+1666")
+    down.close(timeout=0.2)
+    assert server.messages == []
+
+    queue = make_queue(FlakyTransport(server), path=path)
+    assert queue.flush(timeout=5)
+    queue.close()
+    assert sorted(m["body"] for m in server.messages) == ["first", "second"]
+    assert sqlite3.connect(path).execute("SELECT COUNT(*) FROM outbox").fetchone() == (0,)
+
+
+def test_send_async_builds_the_client_on_a_worker(server, monkeypatch):
+    for name, value in (("TWILIO_ACCOUNT_SID", "ACfake"), ("TWILIO_AUTH_TOKEN", "token"),
+                        ("TWILIO_FROM_NUMBER", "+10000000000")):
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(notifier, "TWILIO_BASE_URL", server.base_url)
+    built_on = []
+
+    def transport(*args, **kwargs):
+        built_on.append(threading.current_thread().name)
+        return HttpTransport(*args, **kwargs)
+
+    monkeypatch.setattr(notifier, "HttpTransport", transport)
+    whatsapp = WhatsAppNotifier(outbox_path="")
+    assert whatsapp.send_async("report", "+1555") == (True, "Report queued for delivery.")
+    assert whatsapp.queue.flush(timeout=5)
+    whatsapp.queue.close()
+    assert len(built_on) == 1 and built_on[0].startswith("notifier-")
+    assert [m["to"] for m in server.messages] == ["whatsapp:+1555"]
@@ -0,0 +1,87 @@
+import numpy as np
+
+from ppg import PPGIngest, _box, _running_max, heart_rates, spo2_estimates
+from simulator import PPGSimulator
+
+FS = 100
+
+
+def test_box_matches_brute_force_moving_average():
+    x = np.random.default_rng(0).normal(size=(2, 50))
+    total = np.zeros((2, 51))
+    np.cumsum(x, axis=1, out=total[:, 1:])
+    width, half = 7, 3
+    expected = np.array([[row[max(0, j - half):j - half + width].mean() for j in range(50)] for row in x])
+    assert np.allclose(_box(total, width), expected)
+
+
+def test_running_max_matches_brute_force():
+    x = np.random.default_rng(1).normal(size=(3, 40))
+    for half in (1, 2, 5):
+        expected = np.array([[row[max(0, j - half):j + half + 1].max() for j in range(40)] for row in x])
+        assert np.array_equal(_running_max(x, half), expected)
+
+
+def test_heart_rate_of_a_clean_pulse():
+    t = np.arange(8 * FS) / FS
+    pulse = np.stack([np.sin(2 * np.pi * bpm / 60 * t) for bpm in (48, 72, 150)])
+    assert np.allclose(heart_rates(pulse, FS), [48, 72, 150], atol=1.5)
+    # Fewer than three beats is no estimate
+    assert np.isnan(heart_rates(pulse[:1, :FS], FS)[0])
+
+
+def test_spo2_inverts_the_calibration():
+    for spo2 in (85.0, 92.0, 99.0):
+        ratio = (110.0 - spo2) / 25.0
+        assert spo2_estimates(ratio * 0.02, 1.0, 0.02, 1.0) == np.float64(spo2)
+
+
+def stream(ingest, waves, seconds):
+    for _ in range(seconds):
+        ingest.push_batch(*waves.chunk(1.0))
+
+
+def test_estimates_track_simulated_vitals():
+    waves = PPGSimulator(5, FS, seed=3)
+    waves.set_vitals(heart_rate=[50, 75, 100, 140, 180], spo2=[86, 90, 94, 97, 99])
+    ingest = PPGIngest(5, FS, window_seconds=8)
+    stream(ingest, waves, 3)
+    assert not ingest.estimate().any() and ingest.reading(0) is None  # under PPG_MIN_SECONDS
+    stream(ingest, waves, 7)
+    assert ingest.estimate().all()
+    columns = ingest.columns()
+    assert np.allclose(columns["heart_rate"], waves.heart_rate, atol=3)
+    assert np.allclose(columns["spo2"], waves.spo2, atol=2)
+    assert ingest.reading(1)["heart_rate"] == int(columns["heart_rate"][1])
+
+
+def test_motion_keeps_the_previous_estimate():
+    waves = PPGSimulator(2, FS, seed=4)
+    ingest = PPGIngest(2, FS, window_seconds=8)
+    stream(ingest, waves, 8)
+    ingest.estimate()
+    before = ingest.heart_rate.copy()
+    waves.motion[1] = True
+    stream(ingest, waves, 2)
+    assert ingest.estimate().tolist() == [True, False]
+    assert ingest.heart_rate[1] == before[1]
+
+
+def test_per_patient_pushes_match_a_batch_push():
+    waves = PPGSimulator(3, FS, seed=5)
+    chunks = [waves.chunk(1.0) for _ in range(9)]
+    batch = PPGIngest(3, FS, window_seconds=4)
+    single = PPGIngest(3, FS, window_seconds=4)
+    for red, ir, accel in chunks:
+        batch.push_batch(red, ir, accel)
+        for i in range(3):
+            # Uneven pieces leave the patients' rings out of step with each other
+            split = 17 * (i + 1)
+            single.push(i, red[i, :split], ir[i, :split], accel[i, :split])
+            single.push(i, red[i, split:], ir[i, split:], accel[i, split:])
+    rows = np.arange(3)
+    samples = batch.capacity
+    assert np.array_equal(batch._windows(batch.ir, rows, samples), single._windows(single.ir, rows, samples))
+    batch.estimate()
+    single.estimate()
+    assert np.array_equal(batch.heart_rate, single.heart_rate)
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from monitor import DEFAULT_THRESHOLDS
+from profiles import ProfileRegistry
+
+CONFIG = {
+    "defaults": {"temperature": [36.0, 37.5]},
+    "cohorts": {"copd": {"spo2": [88, 100]}},
+    "patients": {
+        "p1": {"cohort": "copd"},
+        "p2": {"cohort": "copd", "thresholds": {"spo2": [90, 100], "sys_bp": [85, 135]}}
+    }
+}
+
+
+def write(path, config, mtime):
+    path.write_text(json.dumps(config))
+    # Set the mtime explicitly: two writes within one filesystem tick would otherwise look unchanged
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def profile_path(tmp_path):
+    path = tmp_path / "profiles.json"
+    write(path, CONFIG, 1_000_000)
+    return path
+
+
+def test_defaults_cohort_and_patient_overrides(profile_path):
+    registry = ProfileRegistry(str(profile_path), reload_interval=0)
+    assert registry.thresholds("unknown") == dict(DEFAULT_THRESHOLDS, temperature=(36.0, 37.5))
+    assert registry.thresholds("p1")["spo2"] == (88, 100)
+    p2 = registry.thresholds("p2")
+    assert p2["spo2"] == (90, 100) and p2["sys_bp"] == (85, 135) and p2["temperature"] == (36.0, 37.5)
+
+    table = registry.compile(["p1", "unknown", "p2"])
+    low, high = table["spo2"]
+    assert low.tolist() == [88, 95, 90] and high.tolist() == [100, 100, 100]
+    assert table.row(2)["sys_bp"] == (85, 135)
+
+
+def test_missing_file_uses_defaults(tmp_path):
+    registry = ProfileRegistry(str(tmp_path / "absent.json"))
+    assert registry.thresholds("p1") == DEFAULT_THRESHOLDS
+
+
+def test_invalid_config_at_startup_raises(tmp_path):
+    path = tmp_path / "profiles.json"
+    write(path, {"patients": {"p1": {"cohort": "nope"}}}, 1_000_000)
+    with pytest.raises(ValueError):
+        ProfileRegistry(str(path))
+
+
+def test_hot_reload_on_change(profile_path):
+    registry = ProfileRegistry(str(profile_path), reload_interval=0)
+    version = registry.version
+    assert not registry.maybe_reload()
+
+    write(profile_path, dict(CONFIG, cohorts={"copd": {"spo2": [85, 100]}}), 1_000_010)
+    assert registry.maybe_reload()
+    assert registry.version == version + 1
+    assert registry.thresholds("p1")["spo2"] == (85, 100)
+
+
+def test_broken_edit_keeps_previous_profiles(profile_path):
+    registry = ProfileRegistry(str(profile_path), reload_interval=0)
+    version = registry.version
+    profile_path.write_text("{not json")
+    os.utime(profile_path, (1_000_020, 1_000_020))
+    assert not registry.maybe_reload()
+    assert registry.version == version
+    assert registry.thresholds("p1")["spo2"] == (88, 100)
+    # The broken file is not retried until it changes again
+    assert not registry.maybe_reload()
+
+
+def test_reload_interval_limits_file_checks(profile_path):
+    registry = ProfileRegistry(str(profile_path), reload_interval=3600)
+    registry.maybe_reload()  # first check starts the interval
+    write(profile_path, dict(CONFIG, defaults={}), 1_000_030)
+    assert not registry.maybe_reload()
+    registry.reload_interval = 0
+    assert registry.maybe_reload()
@@ -0,0 +1,66 @@
+import numpy as np
+
+from store import VitalsStore
+
+START = 1_699_999_200.0  # on the hour, so rollup buckets line up with the readings
+
+
+def reading(i):
+    return {"heart_rate": 60 + i % 40, "spo2": 90 + i % 10, "sys_bp": 110 + i % 30, "dia_bp": 70 + i % 20,
+            "temperature": 36.0 + (i % 10) / 10}
+
+
+def fill(store, patient_id, start, n):
+    for i in range(start, start + n):
+        store.append(patient_id, reading(i), ts=START + i)
+
+
+def test_query_spans_segments_and_buffer(tmp_path):
+    store = VitalsStore(tmp_path, segment_size=50, buffer_size=7)
+    fill(store, "p", 0, 130)
+    # Readings still buffered in memory are returned too
+    result = store.query("p", START + 45, START + 128)
+    assert np.array_equal(result["ts"], START + np.arange(45, 128))
+    assert np.array_equal(result["heart_rate"], [reading(i)["heart_rate"] for i in range(45, 128)])
+
+
+def test_restart_continues_series_and_rollups(tmp_path):
+    store = VitalsStore(tmp_path, segment_size=50, buffer_size=7)
+    fill(store, "p", 0, 100)
+    store.close()
+
+    store = VitalsStore(tmp_path, segment_size=50, buffer_size=7)
+    assert store.series("p").last_ts == START + 99
+    fill(store, "p", 100, 80)
+    result = store.query("p", START, START + 1000)
+    assert np.array_equal(result["ts"], START + np.arange(180))
+
+    minutes = store.query("p", START, START + 1000, resolution="1m")
+    assert list(minutes["count"]) == [60, 60, 60]
+    # The minute open across the restart was rebuilt from the raw readings
+    expected = np.mean([reading(i)["heart_rate"] for i in range(60, 120)])
+    assert np.isclose(minutes["heart_rate_mean"][1], expected)
+    assert minutes["spo2_min"][2] == 90 and minutes["spo2_max"][2] == 99
+
+    hours = store.query("p", START, START + 3600, resolution="1h")
+    assert list(hours["count"]) == [180]
+
+
+def test_restart_without_close_keeps_flushed_readings(tmp_path):
+    store = VitalsStore(tmp_path, buffer_size=10)
+    fill(store, "p", 0, 25)
+    store.flush()
+    assert store.series("p").last_ts == START + 24
+    reopened = VitalsStore(tmp_path, buffer_size=10)
+    assert len(reopened.query("p", START, START + 100)["ts"]) == 25
+
+
+def test_many_patients_keep_few_segments_mapped(tmp_path):
+    store = VitalsStore(tmp_path, segment_size=50, max_mapped=3, buffer_size=4)
+    for i in range(20):
+        for patient_id in range(10):
+            store.append(patient_id, reading(i), ts=START + i)
+    assert len(store.mapped) <= 3
+    assert sum(bool(series._maps) for series in store._series.values()) <= 3
+    for patient_id in range(10):
+        assert np.array_equal(store.query(patient_id, START, START + 20)["ts"], START + np.arange(20))
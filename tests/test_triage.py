@@ -0,0 +1,62 @@
+from agent import MedicalAgent
+from cache import AnalysisCache
+from monitor import VitalsMonitor
+from triage import AUTO_SYMPTOMS, NORMAL_ADVICE, TEMPLATES, Triage, free_text
+
+NORMAL = {"heart_rate": 75, "spo2": 98, "sys_bp": 120, "dia_bp": 80, "temperature": 36.8}
+
+
+def assess(triage, symptoms=AUTO_SYMPTOMS, offline=False, **changes):
+    vitals = dict(NORMAL, **changes)
+    details = VitalsMonitor().check_vitals(vitals)["details"]
+    return triage.assess(vitals, symptoms, details, offline=offline)
+
+
+def test_free_text():
+    assert free_text("my chest hurts")
+    assert not free_text(AUTO_SYMPTOMS)
+    assert not free_text("  ")
+    assert not free_text(None)
+
+
+def test_normal_reading_is_answered_locally():
+    (advice, report, emergency), reason = assess(Triage(1))
+    assert advice == NORMAL_ADVICE and emergency is False and reason == "normal"
+    assert "All vitals within range" in report
+
+
+def test_single_mild_breach_uses_its_template():
+    (advice, report, emergency), reason = assess(Triage(1), heart_rate=105)
+    condition, template = TEMPLATES[("heart_rate", "high")]
+    assert template in advice and emergency is False
+    assert reason == condition and "Heart Rate 105 bpm (range 60-100) ABNORMAL" in report
+
+
+def test_escalations_online():
+    triage = Triage(1)
+    assert assess(triage, symptoms="I feel faint", heart_rate=105) == (None, "free-text symptoms")
+    assert assess(triage, heart_rate=105, temperature=38.0) == (None, "2 vitals abnormal")
+    assert assess(triage, spo2=90) == (None, "moderate spo2")
+    # A higher local ceiling answers the same reading locally
+    result, _ = assess(Triage(2), spo2=90)
+    assert result is not None and result[2] is False
+
+
+def test_offline_answers_everything_with_a_conservative_verdict():
+    triage = Triage(1)
+    result, _ = assess(triage, symptoms="I feel faint", offline=True, heart_rate=105)
+    assert result[2] is False and "I feel faint" in result[1]
+    result, _ = assess(triage, offline=True, spo2=85)  # severe
+    assert result[2] is True
+    result, _ = assess(triage, offline=True, spo2=91, heart_rate=125)  # two moderate cards
+    assert result[2] is True
+    assert "offline triage" in result[1]
+
+
+def test_agent_without_a_model_answers_offline():
+    agent = MedicalAgent(cache=AnalysisCache(path=""))
+    agent.api_key = None
+    progress = {}
+    result = agent.analyze(dict(NORMAL, temperature=38.0), "I have a headache", progress=progress)
+    assert progress["tier"] == "offline" and result[2] is False
+    assert agent.tier_stats()["offline"]["count"] == 1
@@ -0,0 +1,125 @@
+import os
+
+from env import load_env
+from incidents import SEVERITY_LEVELS, severity
+from monitor import ABNORMALITY_FORMATS, DEFAULT_THRESHOLDS, DETAIL_KEYS, VITAL_KEYS
+
+load_env()
+
+TRIAGE_MAX_LOCAL_SEVERITY = int(os.getenv("TRIAGE_MAX_LOCAL_SEVERITY", "1"))  # highest level answered locally (1 = mild)
+
+# Sent as the symptoms of monitor-triggered analyses; anything else is the patient's own words
+AUTO_SYMPTOMS = "Auto-detected abnormality. Patient has not provided symptoms yet."
+
+# (card, direction) -> (condition for the doctor report, advice for the patient)
+TEMPLATES = {
+    ("heart_rate", "high"): ("Tachycardia",
+                             "Your heart rate is higher than usual. Sit down, relax your shoulders and breathe "
+                             "slowly in through your nose and out through your mouth for a few minutes."),
+    ("heart_rate", "low"): ("Bradycardia",
+                            "Your heart rate is lower than usual. Sit or lie down and rest. If you feel dizzy, "
+                            "faint or short of breath, get medical help."),
+    ("spo2", "low"): ("Low oxygen saturation",
+                      "Your oxygen level is low. Sit upright, take slow deep breaths and stay still. "
+                      "Check that the sensor sits snugly on your finger."),
+    ("bp", "high"): ("Elevated blood pressure",
+                     "Your blood pressure is raised. Sit quietly with your feet flat on the floor, avoid "
+                     "caffeine and salty food, and let it settle for 15 minutes."),
+    ("bp", "low"): ("Low blood pressure",
+                    "Your blood pressure is low. Lie down, raise your legs and drink a glass of water."),
+    ("temperature", "high"): ("Fever",
+                              "You have a raised temperature. Rest, drink plenty of fluids and wear light clothing."),
+    ("temperature", "low"): ("Low body temperature",
+                             "Your temperature is lower than normal. Move somewhere warm, add a layer and have "
+                             "a warm drink.")
+}
+
+NORMAL_ADVICE = "Your vitals are within your normal ranges. Keep resting and let us know if you feel unwell."
+WORSE_ADVICE = "If you feel worse, have chest pain or trouble breathing, call emergency services."
+EMERGENCY_ADVICE = ("Your readings need urgent attention. Stay calm, sit or lie down and do not stay alone. "
+                    "Contact your doctor now and call emergency services if you feel worse.")
+URGENCY = ("Routine monitoring", "Routine review", "Prompt review recommended", "Immediate attention recommended")
+
+
+def free_text(symptoms):
+    """True when the patient described symptoms themselves rather than the monitor triggering the analysis."""
+    text = str(symptoms or "").strip()
+    return bool(text) and text != AUTO_SYMPTOMS
+
+
+def _direction(card, vitals, thresholds):
+    for key in DETAIL_KEYS[card]:
+        low, high = thresholds[key]
+        if vitals[key] > high:
+            return "high"
+        if vitals[key] < low:
+            return "low"
+    return None
+
+
+class Triage:
+    """Local first tier of the analysis: answers clear-cut readings from templates in microseconds.
+
+    Online, only normal readings and a single mildly abnormal vital card without free-text symptoms
+    are answered here; anything ambiguous, multi-vital or described by the patient goes to the LLM.
+    Offline (no API key) every reading is answered here, with a conservative emergency verdict."""
+
+    def __init__(self, max_local_severity=None):
+        self.max_local_severity = TRIAGE_MAX_LOCAL_SEVERITY if max_local_severity is None else max_local_severity
+
+    def assess(self, vitals, symptoms, details, thresholds=None, offline=False):
+        """Returns (result, reason): result is (patient_advice, doctor_report, emergency) or None to escalate,
+        reason says why the reading was escalated (or which template answered it).
+        details: per-card status from VitalsMonitor.check_vitals; thresholds: {vital: (low, high)}."""
+        thresholds = thresholds if thresholds is not None else DEFAULT_THRESHOLDS
+        cards = [card for card in DETAIL_KEYS if details.get(card) == "ABNORMAL"]
+        breaching = {key: vitals[key] for card in cards for key in DETAIL_KEYS[card]
+                     if not thresholds[key][0] <= vitals[key] <= thresholds[key][1]}
+        level = severity(breaching, thresholds)
+        described = free_text(symptoms)
+
+        if not offline:
+            if described:
+                return None, "free-text symptoms"
+            if len(cards) > 1:
+                return None, f"{len(cards)} vitals abnormal"
+            if level > self.max_local_severity:
+                return None, f"{SEVERITY_LEVELS[level]} {cards[0]}"
+
+        # Offline nobody else will judge it, so any severe or combined moderate picture is an emergency
+        emergency = level >= 3 or (len(cards) > 1 and level >= 2)
+        conditions = []
+        advice = []
+        for card in cards:
+            condition, card_advice = TEMPLATES.get((card, _direction(card, vitals, thresholds)),
+                                                   (f"Abnormal {card}", WORSE_ADVICE))
+            conditions.append(condition)
+            advice.append(card_advice)
+        if emergency:
+            advice.insert(0, EMERGENCY_ADVICE)
+        elif cards:
+            advice.append(WORSE_ADVICE)
+        else:
+            advice.append(NORMAL_ADVICE)
+
+        report = self._report(vitals, thresholds, breaching, conditions, level, symptoms if described else None,
+                              offline)
+        reason = ", ".join(conditions) or "normal"
+        return (" ".join(advice), report, emergency), reason
+
+    @staticmethod
+    def _report(vitals, thresholds, breaching, conditions, level, symptoms, offline):
+        readings = []
+        for key in VITAL_KEYS:
+            label, unit = ABNORMALITY_FORMATS[key]
+            low, high = thresholds[key]
+            flag = " ABNORMAL" if key in breaching else ""
+            readings.append(f"{label} {unit.format(vitals[key])} (range {low:g}-{high:g}){flag}")
+        summary = ", ".join(conditions) or "All vitals within range"
+        source = "offline triage, not reviewed by the AI" if offline else "automated triage"
+        return "\n".join([
+            f"- Patient Condition Summary: {summary} ({SEVERITY_LEVELS[level]}, {source}).",
+            f"- Vitals Analysis: {'; '.join(readings)}.",
+            f"- Reported Symptoms: {symptoms or 'None reported'}",
+            f"- Recommended Urgency Level: {URGENCY[level]}"
+        ])